@@ -0,0 +1,307 @@
+# Cliente MQTT asyncio: publicaciones en pipeline con futures de ACK, sin hilo de red propio
+"""
+Variante asyncio de GenericMQTTClient (misma superficie: connect, publish, subscribe,
+set_lwt, clear_retained, disconnect). paho se maneja con su integracion de loop externo:
+el socket se registra en el event loop (add_reader / add_writer) y loop_misc corre en una
+tarea cada segundo, asi no hay hilo de red ni locks entre hilos.
+
+- publish() espera lugar en la ventana de in-flight (max_inflight) y devuelve un Future que
+  se resuelve con el PUBACK (QoS 1) / PUBCOMP (QoS 2) o cuando se escribio en el socket (QoS 0):
+
+      ack = await client.publish(topic, payload, qos=1)   # pipeline: no espera al broker
+      ...
+      await ack                                           # confirmado por el broker
+
+- messages(): iterador asincrono de los mensajes recibidos (cola acotada; si el consumidor no
+  da abasto se descartan y se cuentan en dropped_messages, el loop de red nunca se bloquea).
+- Reconexion automatica con backoff; las suscripciones se rehacen si el broker no conservo
+  la sesion. Las publicaciones QoS>=1 en vuelo se reenvian al reconectar (sus futures siguen
+  pendientes); las QoS 0 no enviadas fallan con ConnectionError.
+
+connect() y las reconexiones abren el socket TCP de forma sincronica (paho), como el
+connect() de GenericMQTTClient; el resto del trafico no bloquea el loop.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from Shared.GenericMQTTClient import (BROKER_HOST, BROKER_PORT, MQTT_CONNECTS, MQTT_DISCONNECTS,
+                                      MQTT_RECONNECTS, GenericMQTTClient)
+from Shared.Logging import get_logger
+from Shared.Metrics import REGISTRY
+from Shared.PayloadCodecs import get_codec
+
+DEFAULT_MAX_INFLIGHT = 1000
+DEFAULT_MESSAGE_QUEUE = 10_000
+RECONNECT_DELAY_MIN_S = 1.0
+RECONNECT_DELAY_MAX_S = 30.0
+MISC_INTERVAL_S = 1.0          # keepalive / timeouts de paho (loop_misc)
+CONNECT_TIMEOUT_S = 10.0
+
+log = get_logger(__name__)
+
+MQTT_INFLIGHT = REGISTRY.gauge("mqtt_inflight_publishes", "Publicaciones esperando ACK (cliente asyncio)",
+                               ("client_id",))
+
+
+class AsyncMQTTClient:
+    def __init__(self, client_id: str = None, broker_host: str = BROKER_HOST, broker_port: int = BROKER_PORT,
+                 codec="json", mqtt_v5: bool = False, log_publishes: bool = True,
+                 clean_session: bool = True, session_expiry_s: int = 0,
+                 max_inflight: int = DEFAULT_MAX_INFLIGHT, message_queue_size: int = DEFAULT_MESSAGE_QUEUE):
+        """Mismos parametros que GenericMQTTClient + ventana de in-flight y tamaño de la cola de mensajes."""
+        if not clean_session and not client_id:
+            raise ValueError("una sesion persistente (clean_session=False) requiere client_id")
+        if mqtt_v5:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv5)
+        else:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                                      protocol=mqtt.MQTTv311, clean_session=clean_session)
+        # la ventana la controla el semaforo; paho no debe retener QoS>=1 por su cuenta
+        self.client.max_inflight_messages_set(max_inflight)
+        self.client.max_queued_messages_set(0)
+        self.broker_host = broker_host
+        self.broker_port = broker_port
+        self.clean_session = clean_session
+        self.session_expiry_s = session_expiry_s
+        self.mqtt_v5 = mqtt_v5
+        self.codec = get_codec(codec)
+        self.log_publishes = log_publishes
+        self.max_inflight = max_inflight
+        self._client_id = client_id or ""
+        self._publish_props = None
+        if mqtt_v5:
+            self._publish_props = Properties(PacketTypes.PUBLISH)
+            self._publish_props.ContentType = self.codec.content_type
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._window: Optional[asyncio.Semaphore] = None
+        self._messages: Optional[asyncio.Queue] = None
+        self._message_queue_size = message_queue_size
+        self._acks: Dict[int, asyncio.Future] = {}      # mid -> future del publish
+        self._ack_qos: Dict[int, int] = {}
+        self._subacks: Dict[int, asyncio.Future] = {}
+        self._subscriptions: Dict[str, int] = {}       # filtro -> qos (para resuscribir)
+        self._connack: Optional[asyncio.Future] = None
+        self._misc_task = None
+        self._reconnect_task = None
+        self._connected_once = False
+        self._closing = False
+        self._birth = None  # (topic, payload, qos, retain) publicado en cada conexion
+        self.dropped_messages = 0
+        self._m_inflight = MQTT_INFLIGHT.labels(self._client_id)
+
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.on_subscribe = self._on_subscribe
+        self.client.on_message = self._on_message
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    # --- integracion con el event loop ---
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._loop.add_reader(sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        while True:
+            await asyncio.sleep(MISC_INTERVAL_S)
+            self.client.loop_misc()
+
+    # --- callbacks de paho (corren dentro del event loop) ---
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        log.info("connected rc=%s", rc, extra={"client_id": self._client_id})
+        if getattr(rc, "is_failure", False):
+            if self._connack is not None and not self._connack.done():
+                self._connack.set_exception(ConnectionError(f"CONNACK rechazado: {rc}"))
+            return
+        MQTT_CONNECTS.labels(self._client_id).inc()
+        if self._connected_once:
+            MQTT_RECONNECTS.labels(self._client_id).inc()
+        if not getattr(flags, "session_present", False):
+            for topic, qos in self._subscriptions.items():
+                self.client.subscribe(topic, qos=qos)
+        if self._birth is not None:
+            self.client.publish(*self._birth)  # fuera de la ventana: un mensaje por conexion
+        self._connected_once = True
+        if self._connack is not None and not self._connack.done():
+            self._connack.set_result(flags)
+
+    def _on_disconnect(self, client, userdata, flags, rc, properties=None):
+        log.info("disconnected rc=%s", rc, extra={"client_id": self._client_id})
+        MQTT_DISCONNECTS.labels(self._client_id).inc()
+        # QoS 0 sin escribir se pierden; QoS>=1 quedan en paho y se reenvian al reconectar
+        self._fail_acks(ConnectionError("conexion MQTT cerrada"), qos0_only=not self._closing)
+        if not self._closing and (self._reconnect_task is None or self._reconnect_task.done()):
+            self._reconnect_task = self._loop.create_task(self._reconnect())
+
+    def _on_publish(self, client, userdata, mid, rc=None, properties=None):
+        fut = self._acks.pop(mid, None)
+        self._ack_qos.pop(mid, None)
+        if fut is not None and not fut.done():
+            if getattr(rc, "is_failure", False):
+                fut.set_exception(ConnectionError(f"publish rechazado: {rc}"))
+            else:
+                fut.set_result(mid)
+
+    def _on_subscribe(self, client, userdata, mid, reason_codes, properties=None):
+        fut = self._subacks.pop(mid, None)
+        if fut is not None and not fut.done():
+            fut.set_result(reason_codes)
+
+    def _on_message(self, client, userdata, msg):
+        try:
+            self._messages.put_nowait(msg)
+        except asyncio.QueueFull:
+            self.dropped_messages += 1
+
+    # --- API ---
+
+    def set_lwt(self, topic: str, payload, qos: int = 1, retain: bool = True):
+        if not isinstance(payload, (str, bytes)):
+            payload = json.dumps(payload)
+        self.client.will_set(topic, payload=payload, qos=qos, retain=retain)
+
+    def set_birth(self, topic: str, payload, qos: int = 1, retain: bool = True):
+        """Como GenericMQTTClient.set_birth: se publica en cada conexion (pisa al LWT retenido)."""
+        if not isinstance(payload, (str, bytes)):
+            payload = json.dumps(payload)
+        self._birth = (topic, payload, qos, retain)
+
+    async def connect(self, keepalive: int = 60, timeout: float = CONNECT_TIMEOUT_S):
+        """Conecta y espera el CONNACK. Asume que set_lwt() (si se necesita) fue llamado antes."""
+        self._loop = asyncio.get_running_loop()
+        if self._window is None:
+            self._window = asyncio.Semaphore(self.max_inflight)
+            self._messages = asyncio.Queue(self._message_queue_size)
+        self._closing = False
+        log.info("connecting to %s:%s ...", self.broker_host, self.broker_port,
+                 extra={"client_id": self._client_id})
+        kwargs = {}
+        if self.mqtt_v5:
+            kwargs["clean_start"] = self.clean_session
+            if self.session_expiry_s:
+                props = Properties(PacketTypes.CONNECT)
+                props.SessionExpiryInterval = self.session_expiry_s
+                kwargs["properties"] = props
+        self._connack = self._loop.create_future()
+        self.client.connect(self.broker_host, self.broker_port, keepalive=keepalive, **kwargs)
+        if self._misc_task is None:
+            self._misc_task = self._loop.create_task(self._misc_loop())
+        await asyncio.wait_for(self._connack, timeout)
+
+    async def _reconnect(self):
+        delay = RECONNECT_DELAY_MIN_S
+        while not self._closing:
+            await asyncio.sleep(delay)
+            try:
+                self._connack = self._loop.create_future()
+                self.client.reconnect()
+                await asyncio.wait_for(self._connack, CONNECT_TIMEOUT_S)
+                return
+            except (OSError, ConnectionError, asyncio.TimeoutError) as e:
+                log.warning("reconexion fallida (%s): reintento en %.0fs", e, delay,
+                            extra={"client_id": self._client_id})
+                delay = min(delay * 2, RECONNECT_DELAY_MAX_S)
+
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    async def publish(self, topic: str, payload, qos: int = 0, retain: bool = False) -> asyncio.Future:
+        """
+        Espera lugar en la ventana y publica. Devuelve el Future del ACK (ver docstring del modulo);
+        el lugar se libera cuando ese Future se completa.
+        """
+        properties = None
+        if not isinstance(payload, (str, bytes)):
+            payload = self.codec.encode(payload)
+            properties = self._publish_props
+        await self._window.acquire()
+        self._m_inflight.inc()
+        fut = self._loop.create_future()
+        fut.add_done_callback(self._release_slot)
+        info = self.client.publish(topic, payload=payload, qos=qos, retain=retain, properties=properties)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or (qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN):
+            # QoS>=1 sin conexion: paho lo guarda y lo envia al reconectar
+            self._acks[info.mid] = fut
+            self._ack_qos[info.mid] = qos
+        else:
+            fut.set_exception(ConnectionError(f"publish no encolado: {mqtt.error_string(info.rc)}"))
+        if self.log_publishes and log.isEnabledFor(logging.DEBUG):
+            log.debug("Publicado en '%s': %s", topic, payload)
+        return fut
+
+    def _release_slot(self, fut: asyncio.Future):
+        self._window.release()
+        self._m_inflight.dec()
+        if not fut.cancelled():
+            fut.exception()  # publicaciones fire-and-forget: sin aviso de 'exception never retrieved'
+
+    def _fail_acks(self, exc: Exception, qos0_only: bool = False):
+        for mid in [m for m, q in self._ack_qos.items() if not qos0_only or q == 0]:
+            fut = self._acks.pop(mid, None)
+            self._ack_qos.pop(mid, None)
+            if fut is not None and not fut.done():
+                fut.set_exception(exc)
+
+    async def subscribe(self, topic: str, qos: int = 0) -> Optional[List]:
+        """Suscribe y espera el SUBACK (devuelve los reason codes); sin conexion se suscribe al conectar."""
+        self._subscriptions[topic] = qos
+        rc, mid = self.client.subscribe(topic, qos=qos)
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            return None
+        fut = self._subacks[mid] = self._loop.create_future()
+        log.info("suscrito a '%s' con QoS=%s", topic, qos, extra={"client_id": self._client_id})
+        return await fut
+
+    async def unsubscribe(self, topic: str):
+        self._subscriptions.pop(topic, None)
+        self.client.unsubscribe(topic)
+
+    async def messages(self):
+        """Iterador asincrono de los mensajes de las suscripciones (paho MQTTMessage)."""
+        while True:
+            yield await self._messages.get()
+
+    async def clear_retained(self, topic: str) -> asyncio.Future:
+        """Limpia el retenido de 'topic' (payload vacio con retain=True)."""
+        return await self.publish(topic, b"", retain=True)
+
+    async def disconnect(self, timeout: float = 5.0):
+        """Espera los ACK en vuelo (hasta timeout), desconecta y cancela las tareas internas."""
+        pending = list(self._acks.values())
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        self._closing = True
+        for task in (self._reconnect_task, self._misc_task):
+            if task is not None:
+                task.cancel()
+        self._misc_task = self._reconnect_task = None
+        self.client.disconnect()
+        # DISCONNECT se escribe desde el loop (add_writer): darle un turno antes de soltar el socket
+        await asyncio.sleep(0)
+        self._fail_acks(ConnectionError("cliente desconectado"))
+
+    content_type = staticmethod(GenericMQTTClient.content_type)
+    decode_message = staticmethod(GenericMQTTClient.decode_message)
+    shared_topic = staticmethod(GenericMQTTClient.shared_topic)
+    strip_shared = staticmethod(GenericMQTTClient.strip_shared)
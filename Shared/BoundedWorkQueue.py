@@ -0,0 +1,369 @@
+import multiprocessing as mp
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from Shared.Logging import get_logger, setup_logging
+
+# -- Politicas de backpressure cuando la cola esta llena
+BACKPRESSURE_POLICIES = ("block", "drop_oldest", "spill")
+WORKER_MODES = ("thread", "process")
+
+DEFAULT_MAXSIZE = 10_000
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_SPILL_BYTES = 512 * 1024 * 1024  # 512 MB en disco como maximo
+
+_SPILL_HEADER = struct.Struct(">IIHI")  # len(topic), len(payload), len(content_type), crc32(registro)
+_SPILL_CURSOR = struct.Struct(">Q")     # offset del proximo registro a leer (al inicio del archivo)
+_STOP = None  # sentinela para detener workers
+
+log = get_logger(__name__, rate_limit=5)  # errores por item: acotados ante rafagas
+
+
+class _SpillFile:
+    """
+    Archivo donde se derraman items cuando la cola esta llena; se lee en orden FIFO.
+    [cursor:u64] + registros [len_topic:u32][len_payload:u32][len_ctype:u16][crc32:u32][topic][payload][ctype].
+    El cursor (offset del proximo registro a leer) se reescribe en cada consumo, asi lo derramado
+    sobrevive a un reinicio: al abrir se retoma desde el cursor y se descarta un registro
+    incompleto o con crc invalido al final (corte a mitad de escritura). Sin fsync: una caida del
+    proceso no pierde nada, un corte de energia puede perder lo ultimo. Cuando se consume todo
+    se trunca.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._fh = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self._next_size = 0
+        self._read_off = self._write_off = _SPILL_CURSOR.size
+        self._recover()
+
+    def _recover(self):
+        self._fh.seek(0)
+        head = self._fh.read(_SPILL_CURSOR.size)
+        if len(head) == _SPILL_CURSOR.size:
+            self._read_off = max(_SPILL_CURSOR.unpack(head)[0], _SPILL_CURSOR.size)
+        off = self._read_off
+        while True:
+            record = self._read_record(off)
+            if record is None:
+                break
+            off += record[1]
+            self.pending += 1
+        self._write_off = max(off, self._read_off)
+        if self.pending:
+            log.warning("%s items derramados recuperados de %s", self.pending, self.path)
+        else:
+            self._read_off = self._write_off = _SPILL_CURSOR.size
+        self._fh.truncate(self._write_off)  # cola incompleta de una escritura cortada
+        self._save_cursor()
+
+    def _read_record(self, off: int):
+        # (item, largo del registro) o None si no hay un registro completo y valido en off
+        self._fh.seek(off)
+        head = self._fh.read(_SPILL_HEADER.size)
+        if len(head) < _SPILL_HEADER.size:
+            return None
+        len_topic, len_payload, len_ctype, crc = _SPILL_HEADER.unpack(head)
+        body = self._fh.read(len_topic + len_payload + len_ctype)
+        if len(body) < len_topic + len_payload + len_ctype or zlib.crc32(body) != crc:
+            return None
+        topic = body[:len_topic].decode("utf-8")
+        payload = body[len_topic:len_topic + len_payload]
+        ctype = body[len_topic + len_payload:].decode("utf-8") if len_ctype else None
+        item = (topic, payload, ctype) if ctype else (topic, payload)
+        return item, _SPILL_HEADER.size + len(body)
+
+    def _save_cursor(self):
+        self._fh.seek(0)
+        self._fh.write(_SPILL_CURSOR.pack(self._read_off))
+
+    def append(self, item) -> bool:
+        topic, payload = item[0], item[1]
+        topic_b = topic.encode("utf-8")
+        ctype_b = (item[2] or "").encode("utf-8") if len(item) > 2 else b""
+        body = topic_b + bytes(payload) + ctype_b
+        record = _SPILL_HEADER.pack(len(topic_b), len(payload), len(ctype_b), zlib.crc32(body)) + body
+        with self._lock:
+            if self._write_off - self._read_off + len(record) > self.max_bytes:
+                return False
+            self._fh.seek(self._write_off)
+            self._fh.write(record)
+            self._write_off += len(record)
+            self.pending += 1
+        return True
+
+    def peek(self):
+        """Proximo item sin consumirlo (None si no hay); consume() lo descarta."""
+        with self._lock:
+            if not self.pending:
+                return None
+            item, self._next_size = self._read_record(self._read_off)
+            return item
+
+    def consume(self):
+        """Descarta el item devuelto por el ultimo peek() (un solo lector)."""
+        with self._lock:
+            self._read_off += self._next_size
+            self.pending -= 1
+            if not self.pending:
+                # todo consumido: reiniciar archivo para no crecer indefinidamente
+                self._read_off = self._write_off = _SPILL_CURSOR.size
+                self._fh.truncate(self._write_off)
+            self._save_cursor()
+            self._fh.flush()
+
+    def close(self):
+        """Cierra el archivo; se borra solo si no quedo nada pendiente (si no, se retoma al abrir)."""
+        with self._lock:
+            pending = self.pending
+            self._fh.close()
+        if not pending:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def _thread_worker(q, handler, processed, errors):
+    while True:
+        item = q.get()
+        if item is _STOP:
+            break
+        try:
+            handler(*item)
+            with processed.get_lock():
+                processed.value += 1
+        except Exception as e:
+            with errors.get_lock():
+                errors.value += 1
+            log.error("Error procesando item: %s", e)
+
+
+def _process_worker(q, handler_factory, processed, errors):
+    # cada proceso construye su propio handler (conexiones propias a Mongo, etc.)
+    setup_logging()  # hilo escritor propio del proceso
+    handler = handler_factory()
+    try:
+        _thread_worker(q, handler, processed, errors)
+    finally:
+        close = getattr(handler, "close", None)
+        if close:
+            close()
+
+
+class BoundedWorkQueue:
+    """
+    Cola acotada en proceso drenada por un pool de workers (hilos o procesos).
+    Desacopla el hilo de red de MQTT del procesamiento (parseo, escritura en BD).
+
+    - Items: tuplas (topic: str, payload: bytes[, content_type: str]); handler(*item).
+    - handler_factory: en modo 'thread' se invoca una sola vez y el handler se comparte
+      entre hilos (debe ser thread-safe); en modo 'process' se invoca una vez por proceso
+      (debe ser picklable, p.ej. funcion de modulo o functools.partial).
+    - policy cuando la cola esta llena:
+        'block'       espera lugar (backpressure hacia el broker); con block_timeout, descarta al vencer
+        'drop_oldest' descarta el item mas viejo de la cola
+        'spill'       derrama a disco (spill_path) y reinyecta cuando hay lugar, en orden; stop()
+                      reinyecta lo derramado antes de detener los workers y lo que no llega a
+                      procesarse queda en el archivo y se retoma al reabrirlo. Solo items
+                      (topic, payload[, content_type]): un callback (p.ej. ack) no se puede derramar
+    - partition_key: funcion item -> clave (p.ej. el topic de la turbina). Si se pasa, cada
+      worker tiene su propia cola (maxsize / workers) y los items de una misma clave van
+      siempre al mismo worker: se procesan en el orden de llegada.
+    """
+    def __init__(self, handler_factory, maxsize: int = DEFAULT_MAXSIZE, workers: int = DEFAULT_WORKERS,
+                 mode: str = "thread", policy: str = "block", block_timeout: float = None,
+                 spill_path: str = None, max_spill_bytes: int = DEFAULT_MAX_SPILL_BYTES,
+                 partition_key=None):
+        if mode not in WORKER_MODES:
+            raise ValueError(f"mode debe ser uno de {WORKER_MODES}")
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"policy debe ser uno de {BACKPRESSURE_POLICIES}")
+        if policy == "spill" and not spill_path:
+            raise ValueError("policy='spill' requiere spill_path")
+
+        self.handler_factory = handler_factory
+        self.maxsize = maxsize
+        self.workers = workers
+        self.mode = mode
+        self.policy = policy
+        self.block_timeout = block_timeout
+
+        self.partition_key = partition_key
+        n_queues = workers if partition_key is not None else 1
+        per_queue = max(1, maxsize // n_queues)
+        self._queues = [mp.Queue(per_queue) if mode == "process" else queue.Queue(per_queue)
+                        for _ in range(n_queues)]
+        self._spill = _SpillFile(spill_path, max_spill_bytes) if policy == "spill" else None
+        self._put_lock = threading.Lock()  # serializa drop_oldest / spill
+        self._stop_event = threading.Event()
+        self._workers = []
+        self._spill_thread = None
+
+        # contadores (mp.Value: los incrementan tambien procesos hijos)
+        self._processed = mp.Value("q", 0)
+        self._errors = mp.Value("q", 0)
+        self.enqueued = 0
+        self.dropped = 0
+        self.spilled_total = 0
+
+    def _worker_queue(self, i: int):
+        return self._queues[i % len(self._queues)]
+
+    def _queue_for(self, item):
+        if len(self._queues) == 1:
+            return self._queues[0]
+        key = self.partition_key(item)
+        data = key if isinstance(key, bytes) else str(key).encode("utf-8")
+        # crc32: estable entre ejecuciones (hash() de str cambia por proceso)
+        return self._queues[zlib.crc32(data) % len(self._queues)]
+
+    def start(self):
+        if self.mode == "thread":
+            handler = self.handler_factory()
+            for i in range(self.workers):
+                t = threading.Thread(target=_thread_worker, name=f"work-queue-{i}", daemon=True,
+                                     args=(self._worker_queue(i), handler, self._processed, self._errors))
+                t.start()
+                self._workers.append(t)
+        else:
+            for i in range(self.workers):
+                p = mp.Process(target=_process_worker, name=f"work-queue-{i}", daemon=True,
+                               args=(self._worker_queue(i), self.handler_factory, self._processed, self._errors))
+                p.start()
+                self._workers.append(p)
+
+        if self._spill is not None:
+            self._spill_thread = threading.Thread(target=self._drain_spill, daemon=True)
+            self._spill_thread.start()
+        log.info("%s workers (%s) maxsize=%s policy=%s particionada=%s", self.workers, self.mode,
+                 self.maxsize, self.policy, self.partition_key is not None)
+
+    def put(self, item) -> bool:
+        """Encola un item aplicando la politica de backpressure. Devuelve False si se descarto."""
+        q = self._queue_for(item)
+        if self.policy == "block":
+            try:
+                q.put(item, timeout=self.block_timeout)
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self.enqueued += 1
+            return True
+
+        with self._put_lock:
+            if self.policy == "spill" and self._spill.pending:
+                # ya hay items en disco: los nuevos van detras para conservar el orden FIFO
+                return self._spill_item(item)
+            try:
+                q.put_nowait(item)
+                self.enqueued += 1
+                return True
+            except queue.Full:
+                pass
+
+            if self.policy == "spill":
+                return self._spill_item(item)
+
+            # drop_oldest: liberar un lugar descartando el mas viejo (de la misma particion)
+            try:
+                # timeout corto: en mp.Queue el item puede seguir en el feeder thread
+                q.get(timeout=0.05)
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(item)
+                self.enqueued += 1
+                return True
+            except queue.Full:
+                self.dropped += 1
+                return False
+
+    def _spill_item(self, item) -> bool:
+        if len(item) > 3:
+            raise ValueError("policy='spill' solo admite items (topic, payload[, content_type])")
+        if self._spill.append(item):
+            self.spilled_total += 1
+            return True
+        self.dropped += 1  # disco lleno
+        return False
+
+    def _drain_spill(self):
+        # reinyecta lo derramado a disco a medida que la cola libera lugar
+        while not self._stop_event.is_set():
+            if not self._spill.pending or self.depth() >= self.maxsize:
+                self._stop_event.wait(0.05)
+                continue
+            if not self._reinject_spilled(timeout=0):
+                self._stop_event.wait(0.01)  # su particion sigue llena: esperar sin girar en vacio
+
+    def _reinject_spilled(self, timeout: float) -> bool:
+        """Pasa el proximo item derramado a su cola. Si no hay lugar queda primero en disco (orden)."""
+        with self._put_lock:
+            item = self._spill.peek()
+            if item is None:
+                return False
+            q = self._queue_for(item)
+            try:
+                if timeout:
+                    q.put(item, timeout=timeout)
+                else:
+                    q.put_nowait(item)
+            except queue.Full:
+                return False
+            self._spill.consume()
+            self.enqueued += 1
+            return True
+
+    def depth(self) -> int:
+        try:
+            return sum(q.qsize() for q in self._queues)
+        except NotImplementedError:  # mp.Queue en macOS
+            return -1
+
+    def stats(self) -> dict:
+        """Estado de la cola para detectar saturacion de la ingesta."""
+        return {
+            "mode": self.mode,
+            "policy": self.policy,
+            "workers": self.workers,
+            "maxsize": self.maxsize,
+            "depth": self.depth(),
+            "enqueued": self.enqueued,
+            "processed": self._processed.value,
+            "errors": self._errors.value,
+            "dropped": self.dropped,
+            "spilled_pending": self._spill.pending if self._spill else 0,
+            "spilled_total": self.spilled_total,
+        }
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Detiene el pool. Los items encolados (y los derramados a disco) se procesan antes de
+        salir; si timeout no alcanza, lo derramado que queda se retoma al reabrir spill_path.
+        """
+        deadline = time.monotonic() + timeout
+        self._stop_event.set()
+        if self._spill_thread:
+            self._spill_thread.join()
+        if self._spill is not None:
+            # los workers siguen vivos: reinyectar antes del _STOP (que va detras, en orden)
+            while self._spill.pending and time.monotonic() < deadline:
+                self._reinject_spilled(timeout=0.05)
+        for i in range(len(self._workers)):
+            self._worker_queue(i).put(_STOP)
+        for w in self._workers:
+            w.join(max(0.0, deadline - time.monotonic()))
+        if self._spill is not None:
+            if self._spill.pending:
+                log.warning("%s items quedan en disco (%s): se retoman al reabrirlo", self._spill.pending,
+                            self._spill.path)
+            self._spill.close()
+        self._workers = []
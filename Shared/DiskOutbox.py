@@ -0,0 +1,246 @@
+# Outbox en disco (store-and-forward) para publicadores con enlace intermitente
+"""
+Mientras el broker no esta disponible los mensajes se agregan a segmentos append-only en
+`directory`; al reconectar se reenvian en orden (read_batch / commit) y el cursor persistido
+evita reenviar lo ya confirmado si el proceso se reinicia (entrega al menos una vez).
+
+- Registro: [len_payload:u32][crc32:u32][len_topic:u16][topic utf-8][payload]. Un registro
+  incompleto o con crc invalido al final del ultimo segmento (corte a mitad de escritura)
+  se descarta al abrir.
+- Segmentos seg-<n>.log de hasta segment_bytes; los consumidos por completo se borran.
+- Uso de disco acotado por max_bytes: policy 'drop_oldest' borra el segmento mas viejo
+  (se pierden sus registros pendientes), 'drop_newest' rechaza lo nuevo.
+"""
+import os
+import struct
+import threading
+import zlib
+from typing import List, Optional, Tuple
+
+from Shared.Logging import get_logger
+
+EVICTION_POLICIES = ("drop_oldest", "drop_newest")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024    # 256 MB por outbox
+DEFAULT_SEGMENT_BYTES = 8 * 1024 * 1024  # 8 MB por segmento
+
+_HEADER = struct.Struct(">IIH")  # len(payload), crc32(topic + payload), len(topic)
+_CURSOR = struct.Struct(">QQ")   # segmento, offset del proximo registro a reenviar
+_CURSOR_FILE = "cursor"
+_SEGMENT_FMT = "seg-{:010d}.log"
+
+log = get_logger(__name__, rate_limit=1)  # 'outbox lleno' puede repetirse por cada muestra
+
+
+def _segment_seq(name: str) -> Optional[int]:
+    if name.startswith("seg-") and name.endswith(".log"):
+        try:
+            return int(name[4:-4])
+        except ValueError:
+            return None
+    return None
+
+
+class DiskOutbox:
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES,
+                 segment_bytes: int = DEFAULT_SEGMENT_BYTES, policy: str = "drop_oldest", fsync: bool = False):
+        """fsync: fuerza a disco cada append / commit (sobrevive a un corte de energia, mas lento)."""
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"policy debe ser uno de {EVICTION_POLICIES}")
+        if segment_bytes * 2 > max_bytes:
+            raise ValueError("max_bytes debe admitir al menos dos segmentos")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.policy = policy
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._segments = {}  # seq -> [bytes, registros pendientes]
+        self.pending = 0     # registros sin confirmar
+        self.appended = 0
+        self.replayed = 0
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, _SEGMENT_FMT.format(seq))
+
+    # --- apertura / recuperacion ---
+
+    def _open(self):
+        seqs = sorted(s for s in (_segment_seq(n) for n in os.listdir(self.directory)) if s is not None)
+        self._read_seq, self._read_off = self._load_cursor()
+        for seq in seqs:
+            if seq < self._read_seq:
+                os.remove(self._path(seq))  # ya reenviado (borrado interrumpido)
+                continue
+            size, records = self._scan(seq, self._read_off if seq == self._read_seq else 0)
+            self._segments[seq] = [size, records]
+            self.pending += records
+        if not self._segments:
+            self._segments[self._read_seq] = [0, 0]
+            self._read_off = 0
+        if self._read_seq not in self._segments:
+            # el segmento del cursor ya no existe (desalojado): seguir desde el mas viejo
+            self._read_seq, self._read_off = min(self._segments), 0
+        # un cursor mas alla del final (segmento truncado / cola corrupta descartada) apunta a su fin
+        self._read_off = min(self._read_off, self._segments[self._read_seq][0])
+        self._write_seq = max(self._segments)
+        self._fh = open(self._path(self._write_seq), "ab")
+        if self.pending:
+            log.info("outbox con %s mensajes pendientes", self.pending, extra={"dir": self.directory})
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.directory, _CURSOR_FILE), "rb") as fh:
+                return _CURSOR.unpack(fh.read(_CURSOR.size))
+        except (OSError, struct.error):
+            return 0, 0
+
+    def _scan(self, seq: int, start: int) -> Tuple[int, int]:
+        """Valida los registros desde start; trunca una cola corrupta. Devuelve (tamaño, registros pendientes)."""
+        path = self._path(seq)
+        records, offset = 0, 0
+        with open(path, "r+b") as fh:
+            while True:
+                header = fh.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                len_payload, crc, len_topic = _HEADER.unpack(header)
+                body = fh.read(len_topic + len_payload)
+                if len(body) < len_topic + len_payload or zlib.crc32(body) != crc:
+                    break
+                if offset >= start:
+                    records += 1
+                offset += _HEADER.size + len(body)
+            if offset < os.path.getsize(path):
+                log.warning("outbox: registro incompleto al final de %s, se descarta", path)
+                fh.truncate(offset)
+        return offset, records
+
+    # --- escritura ---
+
+    def append(self, topic: str, payload: bytes) -> bool:
+        """Agrega un mensaje. Devuelve False si se descarto (outbox lleno con 'drop_newest')."""
+        topic_b = topic.encode("utf-8")
+        payload = bytes(payload)
+        body = topic_b + payload
+        record = _HEADER.pack(len(payload), zlib.crc32(body), len(topic_b)) + body
+        with self._lock:
+            if self._total_bytes() + len(record) > self.max_bytes and not self._evict(len(record)):
+                self.dropped += 1
+                log.warning("outbox lleno: mensaje descartado", extra={"dir": self.directory})
+                return False
+            if self._segments[self._write_seq][0] + len(record) > self.segment_bytes:
+                self._rotate()
+            self._fh.write(record)
+            self._fh.flush()
+            if self.fsync:
+                os.fsync(self._fh.fileno())
+            seg = self._segments[self._write_seq]
+            seg[0] += len(record)
+            seg[1] += 1
+            self.pending += 1
+            self.appended += 1
+        return True
+
+    def _total_bytes(self) -> int:
+        return sum(size for size, _ in self._segments.values())
+
+    def _rotate(self):
+        self._fh.close()
+        self._write_seq += 1
+        self._segments[self._write_seq] = [0, 0]
+        self._fh = open(self._path(self._write_seq), "ab")
+
+    def _evict(self, needed: int) -> bool:
+        if self.policy == "drop_newest":
+            return False
+        # drop_oldest: nunca el segmento activo (por eso max_bytes >= 2 segmentos)
+        while self._total_bytes() + needed > self.max_bytes and len(self._segments) > 1:
+            seq = min(self._segments)
+            _, records = self._segments.pop(seq)
+            os.remove(self._path(seq))
+            self.pending -= records
+            self.dropped += records
+            if seq == self._read_seq:
+                self._read_seq, self._read_off = min(self._segments), 0
+                self._save_cursor()
+            log.warning("outbox: segmento %s desalojado (%s mensajes)", seq, records, extra={"dir": self.directory})
+        return self._total_bytes() + needed <= self.max_bytes
+
+    # --- lectura / confirmacion ---
+
+    def read_batch(self, max_records: int) -> Tuple[List[Tuple[str, bytes]], tuple]:
+        """
+        Hasta max_records mensajes desde el cursor, sin consumirlos. Devuelve (mensajes, token);
+        commit(token) los confirma. Un read_batch sin commit se repite en la proxima lectura.
+        """
+        out = []
+        with self._lock:
+            seq, off = self._read_seq, self._read_off
+            while len(out) < max_records and seq in self._segments:
+                if off >= self._segments[seq][0]:
+                    if seq >= self._write_seq:
+                        break
+                    seq, off = seq + 1, 0
+                    continue
+                if seq == self._write_seq:
+                    self._fh.flush()
+                with open(self._path(seq), "rb") as fh:
+                    fh.seek(off)
+                    while len(out) < max_records and off < self._segments[seq][0]:
+                        len_payload, _, len_topic = _HEADER.unpack(fh.read(_HEADER.size))
+                        topic = fh.read(len_topic).decode("utf-8")
+                        out.append((topic, fh.read(len_payload)))
+                        off += _HEADER.size + len_topic + len_payload
+        return out, (self._read_seq, self._read_off, seq, off, len(out))
+
+    def commit(self, token: tuple):
+        """Confirma lo leido con read_batch (borra los segmentos consumidos y persiste el cursor)."""
+        from_seq, from_off, seq, off, count = token
+        with self._lock:
+            if (from_seq, from_off) != (self._read_seq, self._read_off):
+                return  # el cursor se movio (desalojo): el lote ya no aplica
+            remaining = count
+            for old in [s for s in self._segments if s < seq]:
+                remaining -= self._segments.pop(old)[1]
+                os.remove(self._path(old))
+            self._segments[seq][1] -= remaining
+            self._read_seq, self._read_off = seq, off
+            self.pending -= count
+            self.replayed += count
+            truncate = not self.pending and self._segments[self._write_seq][0] == off and seq == self._write_seq
+            if truncate:
+                self._read_off = 0
+            # el cursor (seq, 0) se persiste antes de truncar: un corte entre ambos solo reenvia el segmento
+            self._save_cursor()
+            if truncate:
+                # todo reenviado: el segmento activo vuelve a cero
+                self._fh.truncate(0)
+                self._segments[seq] = [0, 0]
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(_CURSOR.pack(self._read_seq, self._read_off))
+            if self.fsync:
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.replace(tmp, path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "bytes": self._total_bytes(),
+                "segments": len(self._segments),
+                "appended": self.appended,
+                "replayed": self.replayed,
+                "dropped": self.dropped,
+            }
+
+    def close(self):
+        with self._lock:
+            self._fh.close()
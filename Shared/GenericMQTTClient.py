@@ -1,31 +1,105 @@
 import json
+import logging
 import time
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from Shared.Logging import get_logger
+from Shared.Metrics import REGISTRY
+from Shared.PayloadCodecs import decode_payload, get_codec
 
 # -- Constantes configuracion
 BROKER_HOST = "localhost"
 BROKER_PORT = 1883
+SHARED_PREFIX = "$share/"
+
+log = get_logger(__name__)
+
+# -- Metricas de conexion (ver Shared.Metrics)
+MQTT_CONNECTS = REGISTRY.counter("mqtt_connects_total", "Conexiones aceptadas por el broker", ("client_id",))
+MQTT_RECONNECTS = REGISTRY.counter("mqtt_reconnects_total", "Reconexiones tras la primera conexion", ("client_id",))
+MQTT_DISCONNECTS = REGISTRY.counter("mqtt_disconnects_total", "Desconexiones (esperadas o no)", ("client_id",))
 
 class GenericMQTTClient:
     """
     Cliente MQTT genérico y reutilizable.
     NO contiene nada específico de turbinas ni payloads.
     Métodos: connect, disconnect, publish, set_lwt, clear_retained.
+
+    codec: serializacion de payloads no str/bytes ('json' | 'msgpack' | 'cbor' | 'struct',
+    ver Shared.PayloadCodecs). mqtt_v5: con MQTT 5 cada publish lleva la propiedad
+    Content-Type del codec y los suscriptores la reciben en msg.properties; con 3.1.1
+    el receptor detecta el formato por el primer byte (decode_message cubre ambos casos).
+
+    Sesion persistente: clean_session=False (requiere client_id estable) hace que el broker
+    conserve suscripciones y mensajes QoS>=1 mientras el cliente esta desconectado; con
+    MQTT 5 session_expiry_s limita cuanto (0 = la sesion termina al desconectar).
+    Las suscripciones se recuerdan y se rehacen al reconectar si el broker no conservo la sesion;
+    las pedidas antes de connect() se envian al conectar (callbacks registrados antes de que
+    una sesion persistente entregue lo encolado).
+
+    manual_ack: paho no responde PUBACK al recibir un mensaje QoS 1; el receptor llama
+    ack(mid, qos) cuando ya lo proceso (p.ej. escrito en Mongo). Si el proceso muere antes,
+    el broker lo reenvia al retomar la sesion.
     """
-    def __init__(self, client_id: str = None, broker_host: str = BROKER_HOST, broker_port: int = BROKER_PORT):
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    def __init__(self, client_id: str = None, broker_host: str = BROKER_HOST, broker_port: int = BROKER_PORT,
+                 codec="json", mqtt_v5: bool = False, log_publishes: bool = True,
+                 clean_session: bool = True, session_expiry_s: int = 0, manual_ack: bool = False):
+        if not clean_session and not client_id:
+            raise ValueError("una sesion persistente (clean_session=False) requiere client_id")
+        if mqtt_v5:
+            # en MQTT 5 clean_start / session expiry van en el CONNECT (ver connect())
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=mqtt.MQTTv5,
+                                      manual_ack=manual_ack)
+        else:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id,
+                                      protocol=mqtt.MQTTv311, clean_session=clean_session, manual_ack=manual_ack)
+        self.manual_ack = manual_ack
+        self.clean_session = clean_session
+        self.session_expiry_s = session_expiry_s
+        self._subscriptions = {}  # filtro -> qos (para resuscribir)
+        self._pending = set()     # filtros pedidos sin conexion: se envian en _on_connect
         self.broker_host = broker_host
         self.broker_port = broker_port
         self._client_id = client_id or ""
-        # callbacks básicos opcionales (solo logging)
+        self.codec = get_codec(codec)
+        self.mqtt_v5 = mqtt_v5
+        self.log_publishes = log_publishes  # volcado de payloads (nivel DEBUG); False en simulaciones
+        self._publish_props = None
+        if mqtt_v5:
+            self._publish_props = Properties(PacketTypes.PUBLISH)
+            self._publish_props.ContentType = self.codec.content_type
+        self._connected_once = False
+        self._birth = None        # (topic, payload, qos, retain) publicado en cada conexion
+        # callbacks básicos opcionales (logging y metricas)
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
 
     def _on_connect(self, client, userdata, flags, rc, properties=None):
-        print(f"[MQTT:{self._client_id}] connected rc={rc}")
+        log.info("connected rc=%s", rc, extra={"client_id": self._client_id})
+        if getattr(rc, "is_failure", False):
+            return
+        MQTT_CONNECTS.labels(self._client_id).inc()
+        if self._connected_once:
+            MQTT_RECONNECTS.labels(self._client_id).inc()
+        if self._connected_once and not getattr(flags, "session_present", False):
+            # sesion nueva en el broker: las suscripciones se perdieron
+            topics = list(self._subscriptions)
+        else:
+            topics = [t for t in self._pending if t in self._subscriptions]
+        self._pending.clear()
+        for topic in topics:
+            self.client.subscribe(topic, qos=self._subscriptions[topic])
+        if topics:
+            log.info("suscrito a %s filtros al conectar", len(topics), extra={"client_id": self._client_id})
+        if self._birth is not None:
+            self.client.publish(*self._birth)
+        self._connected_once = True
 
     def _on_disconnect(self, client, userdata, flags, rc, properties=None):
-        print(f"[MQTT:{self._client_id}] disconnected rc={rc}")
+        log.info("disconnected rc=%s", rc, extra={"client_id": self._client_id})
+        MQTT_DISCONNECTS.labels(self._client_id).inc()
 
     def set_lwt(self, topic: str, payload, qos: int = 1, retain: bool = True):
         """
@@ -36,31 +110,109 @@ class GenericMQTTClient:
             payload = json.dumps(payload)
         self.client.will_set(topic, payload=payload, qos=qos, retain=retain)
 
-    def connect(self, keepalive: int = 60):
-        """Conecta y arranca el loop. Asume que set_lwt() (si se necesita) fue llamado antes."""
-        print(f"[MQTT:{self._client_id}] connecting to {self.broker_host}:{self.broker_port} ...")
-        self.client.connect(self.broker_host, self.broker_port, keepalive=keepalive)
+    def set_birth(self, topic: str, payload, qos: int = 1, retain: bool = True):
+        """
+        Mensaje de nacimiento: se publica en cada conexion (tambien al reconectar), asi un
+        'online' retenido vuelve a pisar al LWT 'offline' que el broker publico al caerse.
+        """
+        if not isinstance(payload, (str, bytes)):
+            payload = json.dumps(payload)
+        self._birth = (topic, payload, qos, retain)
+
+    def connect(self, keepalive: int = 60, wait: bool = True):
+        """
+        Conecta y arranca el loop. Asume que set_lwt() (si se necesita) fue llamado antes.
+        wait=False: no falla si el broker no responde; el loop de paho reintenta en segundo plano.
+        """
+        log.info("connecting to %s:%s ...", self.broker_host, self.broker_port,
+                 extra={"client_id": self._client_id})
+        kwargs = {}
+        if self.mqtt_v5:
+            kwargs["clean_start"] = self.clean_session
+            if self.session_expiry_s:
+                props = Properties(PacketTypes.CONNECT)
+                props.SessionExpiryInterval = self.session_expiry_s
+                kwargs["properties"] = props
+        if wait:
+            self.client.connect(self.broker_host, self.broker_port, keepalive=keepalive, **kwargs)
+        else:
+            self.client.connect_async(self.broker_host, self.broker_port, keepalive=keepalive, **kwargs)
         self.client.loop_start()
 
+    def is_connected(self) -> bool:
+        return self.client.is_connected()
+
+    def ack(self, mid: int, qos: int):
+        """Confirma un mensaje recibido (solo con manual_ack; seguro desde cualquier hilo)."""
+        self.client.ack(mid, qos)
+
     def publish(self, topic: str, payload, qos: int = 0, retain: bool = False):
         """
-        Publica en cualquier topic. Payload se serializa a JSON si no es str/bytes.
+        Publica en cualquier topic. Payload se serializa con el codec si no es str/bytes.
+        Devuelve el MQTTMessageInfo de paho (wait_for_publish / is_published).
         """
+        properties = None
         if not isinstance(payload, (str, bytes)):
-            payload = json.dumps(payload)
-        self.client.publish(topic, payload=payload, qos=qos, retain=retain)
-        print(f"--- Publicado en '{topic}': \n{payload}\n")
+            payload = self.codec.encode(payload)
+            properties = self._publish_props
+        info = self.client.publish(topic, payload=payload, qos=qos, retain=retain, properties=properties)
+        if self.log_publishes and log.isEnabledFor(logging.DEBUG):
+            log.debug("Publicado en '%s': %s", topic, payload)
+        return info
+
+    @staticmethod
+    def content_type(msg):
+        """Content-Type MQTT 5 del mensaje recibido (None en 3.1.1 o si no vino)."""
+        props = getattr(msg, "properties", None)
+        return getattr(props, "ContentType", None) if props is not None else None
+
+    @staticmethod
+    def decode_message(msg):
+        """Payload decodificado segun Content-Type o, si falta, detectando el formato."""
+        return decode_payload(msg.payload, GenericMQTTClient.content_type(msg))
 
     def clear_retained(self, topic: str):
         """Limpia el mensaje retenido en 'topic' (publicando un payload vacío con retain=True)."""
         self.client.publish(topic, payload="", retain=True)
 
+    @staticmethod
+    def shared_topic(group: str, topic: str) -> str:
+        """Filtro de suscripcion compartida MQTT 5: el broker reparte los mensajes entre los miembros del grupo."""
+        return f"{SHARED_PREFIX}{group}/{topic}"
+
+    @staticmethod
+    def strip_shared(topic: str) -> str:
+        """'$share/grupo/a/b' -> 'a/b' (los mensajes llegan con el topic real, sin el prefijo)."""
+        if topic.startswith(SHARED_PREFIX):
+            return topic.split("/", 2)[2]
+        return topic
+
+    def _subscribe(self, topic: str, qos: int):
+        self._subscriptions[topic] = qos
+        rc, _ = self.client.subscribe(topic, qos=qos)
+        if rc == mqtt.MQTT_ERR_NO_CONN:
+            self._pending.add(topic)  # todavia sin conexion: se envia en _on_connect
+        log.info("suscrito a '%s' con QoS=%s", topic, qos, extra={"client_id": self._client_id})
+
     def subscribe(self, topic: str, callback, qos: int = 0):
         # Suscription & register a callback method to handle incoming messages
         self.client.on_message = callback
-        self.client.subscribe(topic, qos=qos)
-        print(f"[MQTT:{self._client_id}] suscrito a '{topic}' con QoS={qos}")
+        self._subscribe(topic, qos)
 
+    def message_callback_add(self, topic: str, callback, qos: int = 0):
+        """
+        Suscribe 'topic' con un callback propio (los demas mensajes siguen yendo al de subscribe()).
+        Acepta filtros compartidos ($share/grupo/...): el callback se registra sobre el filtro real.
+        """
+        self.client.message_callback_add(self.strip_shared(topic), callback)
+        self._subscribe(topic, qos)
+
+    def unsubscribe(self, topic: str):
+        """Deja de recibir 'topic' (en un grupo compartido: el broker deja de repartirle mensajes)."""
+        self._subscriptions.pop(topic, None)
+        self._pending.discard(topic)
+        self.client.unsubscribe(topic)
+        self.client.message_callback_remove(self.strip_shared(topic))
 
     def disconnect(self):
         """Detiene loop y desconecta. No asume limpieza de topics (eso lo decide el caller)."""
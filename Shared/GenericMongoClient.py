@@ -1,6 +1,30 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReadPreference
 from pymongo.collection import Collection
-from pymongo.errors import ConnectionFailure, PyMongoError
+from pymongo.errors import BulkWriteError, CollectionInvalid, ConnectionFailure, DuplicateKeyError, PyMongoError
+from pymongo.write_concern import WriteConcern
+
+from Shared.Logging import get_logger
+
+log = get_logger(__name__, rate_limit=5)  # con Mongo caido cada escritura falla: acotar
+
+DEFAULT_URI = "mongodb://localhost:27017"
+DEFAULT_DB_NAME = "test_db"
+DUPLICATE_KEY_ERROR = 11000  # code de writeErrors por clave duplicada
+
+# -- Perfiles de escritura / lectura (se aplican a la base: heredan todas sus colecciones)
+#    fast: telemetria cruda (alto volumen, perder la ultima muestra ante una caida es aceptable)
+#    majority: rollups, alertas (sobreviven a un failover del primario)
+WRITE_PROFILES = {
+    "default": WriteConcern(),  # el del servidor / la URI
+    "fast": WriteConcern(w=1, j=False),
+    "majority": WriteConcern(w="majority", j=True, wtimeout=10_000),
+}
+READ_PROFILES = {
+    "primary": ReadPreference.PRIMARY,
+    "primary_preferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary_preferred": ReadPreference.SECONDARY_PREFERRED,  # dashboards / historial: aceptan atraso
+    "nearest": ReadPreference.NEAREST,
+}
 
 
 class GenericMongoClient:
@@ -8,22 +32,39 @@ class GenericMongoClient:
     Clase genérica para conectarse a MongoDB usando pymongo.
     Permite operaciones básicas de inserción, consulta y actualización.
     """
-    def __init__(self, uri: str = "mongodb://localhost:27017", db_name: str = "test_db"):
+    def __init__(self, uri: str = DEFAULT_URI, db_name: str = DEFAULT_DB_NAME, client: MongoClient = None,
+                 write_profile: str = "default", read_profile: str = "primary", **client_options):
+        """
+        client: MongoClient (pool) ya creado y compartido (ver MongoConnectionManager); si no se
+        pasa, connect() crea uno propio con client_options (maxPoolSize, compressors, ...).
+        write_profile / read_profile: claves de WRITE_PROFILES / READ_PROFILES.
+        """
+        if write_profile not in WRITE_PROFILES:
+            raise ValueError(f"write_profile debe ser uno de {tuple(WRITE_PROFILES)}")
+        if read_profile not in READ_PROFILES:
+            raise ValueError(f"read_profile debe ser uno de {tuple(READ_PROFILES)}")
         self.uri = uri
         self.db_name = db_name
-        self.client: MongoClient = None
+        self.write_profile = write_profile
+        self.read_profile = read_profile
+        self.client_options = client_options
+        self._owns_client = client is None
+        self.client: MongoClient = client
         self.db = None
 
     def connect(self):
         """Conecta al servidor MongoDB y selecciona la base de datos."""
         try:
-            self.client = MongoClient(self.uri)
+            if self.client is None:
+                self.client = MongoClient(self.uri, **self.client_options)
             # Test de conexión rápida
             self.client.admin.command("ping")
-            self.db = self.client[self.db_name]
-            print(f"[MongoDB] Conectado a {self.db_name} en {self.uri}")
+            self.db = self.client.get_database(self.db_name, write_concern=WRITE_PROFILES[self.write_profile],
+                                               read_preference=READ_PROFILES[self.read_profile])
+            log.info("Conectado a %s en %s", self.db_name, self.uri,
+                     extra={"write_profile": self.write_profile, "read_profile": self.read_profile})
         except ConnectionFailure as e:
-            print(f"[MongoDB] Error de conexión: {e}")
+            log.error("Error de conexión: %s", e)
             raise
 
     def get_collection(self, collection_name: str) -> Collection:
@@ -32,14 +73,58 @@ class GenericMongoClient:
             raise RuntimeError("No conectado a la base de datos")
         return self.db[collection_name]
 
+    def create_collection(self, collection_name: str, **options) -> Collection:
+        """Crea la coleccion con opciones (p.ej. timeseries={...}); si ya existe la devuelve."""
+        if self.db is None:
+            raise RuntimeError("No conectado a la base de datos")
+        try:
+            return self.db.create_collection(collection_name, **options)
+        except CollectionInvalid:
+            return self.db[collection_name]  # ya existe
+
     def insert_one(self, collection_name: str, document: dict):
         """Inserta un documento en la colección."""
         try:
             collection = self.get_collection(collection_name)
             result = collection.insert_one(document)
             return result.inserted_id
+        except DuplicateKeyError:
+            raise  # sin log: el llamador decide (p.ej. reentrega ya persistida)
         except PyMongoError as e:
-            print(f"[MongoDB] Error al insertar: {e}")
+            log.error("Error al insertar: %s", e, extra={"collection": collection_name})
+            raise
+
+    def insert_many(self, collection_name: str, documents: list, ordered: bool = False):
+        """
+        Inserta varios documentos en un solo round-trip (bulk).
+        Con ordered=False el servidor sigue insertando aunque falle algun documento;
+        en ese caso se relanza BulkWriteError (details['writeErrors'] trae los indices fallidos).
+        """
+        if not documents:
+            return []
+        try:
+            collection = self.get_collection(collection_name)
+            result = collection.insert_many(documents, ordered=ordered)
+            return result.inserted_ids
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            failed = sum(1 for err in errors if err.get("code") != DUPLICATE_KEY_ERROR)
+            if failed:  # las claves duplicadas (ya persistidos) no son un error
+                log.warning("Error parcial en insert_many: %s fallidos", failed, extra={"collection": collection_name})
+            raise
+        except PyMongoError as e:
+            log.error("Error al insertar (bulk): %s", e, extra={"collection": collection_name})
+            raise
+
+    def bulk_write(self, collection_name: str, operations: list, ordered: bool = False):
+        """Ejecuta operaciones de escritura (UpdateOne, InsertOne, ...) en un solo round-trip."""
+        if not operations:
+            return None
+        try:
+            collection = self.get_collection(collection_name)
+            return collection.bulk_write(operations, ordered=ordered)
+        except PyMongoError as e:
+            log.error("Error en bulk_write: %s", e, extra={"collection": collection_name})
             raise
 
     def find(self, collection_name: str, query: dict = None, limit: int = 0):
@@ -50,7 +135,7 @@ class GenericMongoClient:
             cursor = collection.find(query).limit(limit)
             return list(cursor)
         except PyMongoError as e:
-            print(f"[MongoDB] Error al consultar: {e}")
+            log.error("Error al consultar: %s", e, extra={"collection": collection_name})
             raise
 
     def update_one(self, collection_name: str, filter_query: dict, update_values: dict):
@@ -60,14 +145,43 @@ class GenericMongoClient:
             result = collection.update_one(filter_query, {"$set": update_values})
             return result.modified_count
         except PyMongoError as e:
-            print(f"[MongoDB] Error al actualizar: {e}")
+            log.error("Error al actualizar: %s", e, extra={"collection": collection_name})
+            raise
+
+    def create_index(self, collection_name: str, keys: list, **kwargs) -> str:
+        """Crea (si no existe) un indice. keys: [(campo, 1|-1), ...]. Devuelve el nombre del indice."""
+        try:
+            collection = self.get_collection(collection_name)
+            return collection.create_index(keys, **kwargs)
+        except PyMongoError as e:
+            log.error("Error al crear indice: %s", e, extra={"collection": collection_name})
+            raise
+
+    def drop_superseded_indexes(self, collection_name: str, superseded: list) -> list:
+        """
+        Borra los indices reemplazados que sigan existiendo. superseded: [(keys, nombre), ...]; solo
+        se borra si nombre y claves coinciden (uno homonimo con otras claves no se toca).
+        Devuelve los nombres borrados.
+        """
+        try:
+            collection = self.get_collection(collection_name)
+            existing = collection.index_information()
+            dropped = []
+            for keys, name in superseded:
+                info = existing.get(name)
+                if info is not None and [tuple(k) for k in info["key"]] == [tuple(k) for k in keys]:
+                    collection.drop_index(name)
+                    dropped.append(name)
+            return dropped
+        except PyMongoError as e:
+            log.error("Error al borrar indices reemplazados: %s", e, extra={"collection": collection_name})
             raise
 
     def close(self):
-        """Cierra la conexión con MongoDB."""
-        if self.client:
+        """Cierra la conexión con MongoDB (un pool compartido lo cierra MongoConnectionManager)."""
+        if self.client and self._owns_client:
             self.client.close()
-            print("[MongoDB] Conexión cerrada")
+            log.info("Conexión cerrada")
 
 """
 Ejemplo de uso:
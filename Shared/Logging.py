@@ -0,0 +1,245 @@
+# Logging estructurado, no bloqueante, con limite de tasa y muestreo por logger
+"""
+Capa sobre el modulo logging de la stdlib:
+
+- setup_logging(): un QueueHandler en el root logger y un QueueListener (hilo propio)
+  que formatea y escribe. El hilo que loguea (p.ej. el de red de paho) solo encola;
+  si la cola esta llena el registro se descarta y se cuenta (dropped_records()).
+- Registros estructurados: los campos de extra={...} salen como k=v (texto) o como
+  claves del objeto (json, una linea por registro).
+- Limite de tasa (token bucket por plantilla de mensaje) y muestreo (1 de cada N) por
+  logger: get_logger(__name__, rate_limit=5) / configure_logger(...). Al pasar el
+  siguiente registro de la plantilla se informa cuantos se suprimieron.
+- Volcados de payloads solo en DEBUG; usar argumentos %-style para que el formateo
+  ocurra solo si el registro se emite:  log.debug("Recibido en '%s': %s", topic, data)
+
+Variables de entorno (setup_logging): LOG_LEVEL (INFO), LOG_FORMAT ('text' | 'json'),
+LOG_RATE_LIMITS ('logger=registros_por_s,...'), LOG_SAMPLING ('logger=ratio,...').
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+LOG_FORMATS = ("text", "json")
+DEFAULT_LEVEL = "INFO"
+DEFAULT_FORMAT = "text"
+LOG_QUEUE_MAXSIZE = 10_000
+
+# atributos propios de LogRecord: lo demas vino en extra={...}
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "suppressed"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler = None
+_listener_pid = None  # un proceso hijo (fork) hereda el handler pero no el hilo escritor
+_setup_lock = threading.Lock()
+
+
+def _fields(record: logging.LogRecord) -> Dict[str, object]:
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS and not k.startswith("_")}
+
+
+class TextFormatter(logging.Formatter):
+    """2024-01-01 12:00:00,123 INFO [StatNode.DB.TelemetryDB] mensaje k=v ..."""
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extra = " ".join(f"{k}={v}" for k, v in _fields(record).items())
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            extra += f" (+{suppressed} suprimidos)"
+        if extra:
+            # los campos van en la primera linea (antes de un traceback)
+            head, sep, tail = line.partition("\n")
+            line = f"{head} {extra.strip()}{sep}{tail}"
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Un objeto JSON por linea: ts, level, logger, msg, campos de extra y exc si hay."""
+    def format(self, record: logging.LogRecord) -> str:
+        doc = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        doc.update(_fields(record))
+        if getattr(record, "suppressed", 0):
+            doc["suppressed"] = record.suppressed
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            doc["exc"] = record.exc_text
+        return json.dumps(doc, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket por plantilla de mensaje (record.msg): rate registros/s, rafaga burst."""
+    def __init__(self, rate: float, burst: float = None):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1.0))
+        self._buckets: Dict[object, list] = {}  # plantilla -> [tokens, ultimo_t, suprimidos]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        now = time.monotonic()
+        key = record.msg
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1.0:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1.0
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.suppressed = getattr(record, "suppressed", 0) + suppressed
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Deja pasar 1 de cada round(1/ratio) registros por plantilla (deterministico)."""
+    def __init__(self, ratio: float):
+        super().__init__()
+        if not 0 < ratio <= 1:
+            raise ValueError("ratio debe estar en (0, 1]")
+        self.every = max(1, int(round(1.0 / ratio)))
+        self._counts: Dict[object, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.every == 1:
+            return True
+        with self._lock:
+            n = self._counts.get(record.msg, 0)
+            self._counts[record.msg] = n + 1
+        if n % self.every:
+            return False
+        if n:
+            record.suppressed = getattr(record, "suppressed", 0) + self.every - 1
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Encola sin bloquear nunca al llamador; con la cola llena descarta y cuenta."""
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # el mensaje se resuelve aqui (los args pueden mutar despues); el formato en el listener
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _parse_mapping(raw: Optional[str]) -> Dict[str, float]:
+    out = {}
+    for item in (raw or "").split(","):
+        name, sep, value = item.strip().partition("=")
+        if sep:
+            try:
+                out[name.strip()] = float(value)
+            except ValueError:
+                pass
+    return out
+
+
+def configure_logger(name: str, level=None, rate_limit: float = None, burst: float = None,
+                     sample: float = None) -> logging.Logger:
+    """Nivel, limite de tasa y/o muestreo de un logger (reemplaza los filtros previos del mismo tipo)."""
+    logger = logging.getLogger(name)
+    if level is not None:
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+    if rate_limit is not None:
+        for f in [f for f in logger.filters if isinstance(f, RateLimitFilter)]:
+            logger.removeFilter(f)
+        if rate_limit > 0:
+            logger.addFilter(RateLimitFilter(rate_limit, burst))
+    if sample is not None:
+        for f in [f for f in logger.filters if isinstance(f, SamplingFilter)]:
+            logger.removeFilter(f)
+        if sample < 1:
+            logger.addFilter(SamplingFilter(sample))
+    return logger
+
+
+def get_logger(name: str, rate_limit: float = None, burst: float = None, sample: float = None) -> logging.Logger:
+    """Logger del modulo; rate_limit / sample son los valores por defecto (LOG_RATE_LIMITS / LOG_SAMPLING mandan)."""
+    return configure_logger(name, rate_limit=rate_limit, burst=burst, sample=sample)
+
+
+def setup_logging(level: str = None, fmt: str = None, stream=None,
+                  queue_maxsize: int = LOG_QUEUE_MAXSIZE) -> logging.Logger:
+    """
+    Configura el root logger una vez por proceso (llamadas siguientes solo ajustan el nivel;
+    en un hijo creado con fork vuelve a crear la cola y el hilo escritor).
+    Devuelve el root logger.
+    """
+    global _listener, _queue_handler, _listener_pid
+    root = logging.getLogger()
+    level = (level or os.environ.get("LOG_LEVEL") or DEFAULT_LEVEL).upper()
+    with _setup_lock:
+        root.setLevel(level)
+        if _listener is not None and _listener_pid == os.getpid():
+            return root
+        fmt = (fmt or os.environ.get("LOG_FORMAT") or DEFAULT_FORMAT).lower()
+        if fmt not in LOG_FORMATS:
+            raise ValueError(f"fmt debe ser uno de {LOG_FORMATS}")
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        _queue_handler = _DroppingQueueHandler(queue.Queue(maxsize=queue_maxsize))
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, output, respect_handler_level=False)
+        _listener.start()
+        if _listener_pid is None:
+            atexit.register(shutdown_logging)
+        _listener_pid = os.getpid()
+
+    for name, rate in _parse_mapping(os.environ.get("LOG_RATE_LIMITS")).items():
+        configure_logger(name, rate_limit=rate)
+    for name, ratio in _parse_mapping(os.environ.get("LOG_SAMPLING")).items():
+        configure_logger(name, sample=ratio)
+    return root
+
+
+def dropped_records() -> int:
+    """Registros descartados por cola llena desde setup_logging()."""
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def shutdown_logging():
+    """Vacia la cola y detiene el hilo escritor (se registra en atexit)."""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is None or _listener_pid != os.getpid():
+            return
+        _listener.stop()
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener = _queue_handler = None
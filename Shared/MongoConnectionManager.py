@@ -0,0 +1,105 @@
+# Conexiones a Mongo por proceso: un pool (MongoClient) por URI, un conector por (URI, base, perfiles)
+"""
+Reemplaza al singleton unico (que ignoraba uri / db_name despues de la primera llamada):
+
+- configure(uri, db_name, **pool) fija los valores por defecto del proceso (p.ej. el worker
+  del StatNode con la URI y base de la linea de comandos) y las opciones del pool.
+- get(uri, db_name, write_profile, read_profile) devuelve un GenericMongoClient conectado;
+  los conectores con la misma URI comparten el MongoClient (y su pool de conexiones), las
+  distintas bases / perfiles solo cambian el Database que envuelven.
+- Seguro entre hilos (creacion bajo lock; MongoClient es thread-safe) y entre procesos:
+  MongoClient no sobrevive a un fork, asi que si el pid cambio se descartan los heredados
+  (sin cerrarlos: sus sockets son del padre) y se abren nuevos en el hijo.
+"""
+import os
+import threading
+from typing import Dict, Tuple
+
+from pymongo import MongoClient
+
+from Shared.GenericMongoClient import DEFAULT_DB_NAME, DEFAULT_URI, GenericMongoClient
+from Shared.Logging import get_logger
+
+# opciones del pool expuestas -> nombre en pymongo (None = default de pymongo / de la URI)
+POOL_OPTIONS = {
+    "max_pool_size": "maxPoolSize",
+    "min_pool_size": "minPoolSize",
+    "max_idle_time_ms": "maxIdleTimeMS",
+    "wait_queue_timeout_ms": "waitQueueTimeoutMS",
+    "connect_timeout_ms": "connectTimeoutMS",
+    "server_selection_timeout_ms": "serverSelectionTimeoutMS",
+    "socket_timeout_ms": "socketTimeoutMS",
+    "compressors": "compressors",  # p.ej. "zstd,snappy,zlib" (se negocia con el servidor)
+    "appname": "appName",
+}
+
+log = get_logger(__name__)
+
+
+class MongoConnectionManager:
+    _lock = threading.Lock()
+    _pid = os.getpid()
+    _defaults = {"uri": DEFAULT_URI, "db_name": DEFAULT_DB_NAME}
+    _pool_options: Dict[str, object] = {}
+    _clients: Dict[str, MongoClient] = {}
+    _connectors: Dict[Tuple[str, str, str, str], GenericMongoClient] = {}
+
+    @classmethod
+    def configure(cls, uri: str = None, db_name: str = None, **pool_options):
+        """
+        Valores por defecto del proceso y opciones del pool (claves de POOL_OPTIONS). Afecta a
+        los pools que se creen despues: llamarlo al arrancar, antes del primer get().
+        """
+        unknown = set(pool_options) - set(POOL_OPTIONS)
+        if unknown:
+            raise ValueError(f"opciones de pool desconocidas: {sorted(unknown)}")
+        with cls._lock:
+            if uri:
+                cls._defaults["uri"] = uri
+            if db_name:
+                cls._defaults["db_name"] = db_name
+            cls._pool_options.update({POOL_OPTIONS[k]: v for k, v in pool_options.items() if v is not None})
+
+    @classmethod
+    def get(cls, uri: str = None, db_name: str = None, write_profile: str = "default",
+            read_profile: str = "primary") -> GenericMongoClient:
+        """Conector (conectado) para uri / db_name (None = los de configure()) con esos perfiles."""
+        cls._check_pid()
+        uri = uri or cls._defaults["uri"]
+        db_name = db_name or cls._defaults["db_name"]
+        key = (uri, db_name, write_profile, read_profile)
+        connector = cls._connectors.get(key)
+        if connector is not None:
+            return connector
+        with cls._lock:
+            connector = cls._connectors.get(key)
+            if connector is None:
+                client = cls._clients.get(uri)
+                if client is None:
+                    client = cls._clients[uri] = MongoClient(uri, **cls._pool_options)
+                    log.info("pool Mongo para %s", uri, extra={"options": cls._pool_options})
+                connector = GenericMongoClient(uri=uri, db_name=db_name, client=client,
+                                               write_profile=write_profile, read_profile=read_profile)
+                connector.connect()
+                cls._connectors[key] = connector
+        return connector
+
+    @classmethod
+    def _check_pid(cls):
+        pid = os.getpid()
+        if pid != cls._pid:
+            # proceso hijo (fork): lo heredado no es usable (ni el lock, que pudo quedar tomado)
+            cls._lock = threading.Lock()
+            cls._clients = {}
+            cls._connectors = {}
+            cls._pid = pid
+
+    @classmethod
+    def close_all(cls):
+        """Cierra los pools del proceso (al terminar)."""
+        cls._check_pid()
+        with cls._lock:
+            for client in cls._clients.values():
+                client.close()
+            cls._clients.clear()
+            cls._connectors.clear()
@@ -1,11 +1,15 @@
 from Shared.GenericMongoClient import GenericMongoClient
+from Shared.MongoConnectionManager import MongoConnectionManager
+
 
 class MongoSingleton:
+    # conector inyectado (benchmarks / pruebas): si esta, se devuelve siempre
     _instance: GenericMongoClient = None
 
     @classmethod
-    def get_singleton_client(cls, uri="mongodb://localhost:27017", db_name="test_db"):
-        if cls._instance is None:
-            cls._instance = GenericMongoClient(uri=uri, db_name=db_name)
-            cls._instance.connect()
-        return cls._instance
+    def get_singleton_client(cls, uri: str = None, db_name: str = None, write_profile: str = "default",
+                             read_profile: str = "primary"):
+        """Conector para uri / db_name (None = defaults del proceso, ver MongoConnectionManager)."""
+        if cls._instance is not None:
+            return cls._instance
+        return MongoConnectionManager.get(uri, db_name, write_profile=write_profile, read_profile=read_profile)
@@ -0,0 +1,176 @@
+"""
+Codecs de payload MQTT. Cada codec expone name, content_type, encode(obj) -> bytes y
+decode(bytes) -> obj. El content_type viaja en la propiedad Content-Type de MQTT 5;
+con MQTT 3.1.1 (sin propiedades) el receptor detecta el formato por el primer byte.
+
+- json:    texto JSON (default, compatible con el frontend)
+- msgpack: MessagePack (requiere 'msgpack')
+- cbor:    CBOR (requiere 'cbor2')
+- struct:  layout fijo de telemetria de turbina (67 bytes), timestamp en epoch ms
+"""
+import json
+import math
+import struct
+from typing import Any, Dict, Optional
+
+try:
+    import msgpack
+except ImportError:  # opcional: solo necesario para el codec 'msgpack'
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # opcional: solo necesario para el codec 'cbor'
+    cbor2 = None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+CBOR_CONTENT_TYPE = "application/cbor"
+STRUCT_CONTENT_TYPE = "application/vnd.windfarm.telemetry.v1"
+
+
+class JsonCodec:
+    name = "json"
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes):
+        return json.loads(data)
+
+
+class MsgPackCodec:
+    name = "msgpack"
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("codec 'msgpack' requiere el paquete msgpack (pip install msgpack)")
+
+    def encode(self, obj) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: bytes):
+        return msgpack.unpackb(data, raw=False)
+
+
+class CborCodec:
+    name = "cbor"
+    content_type = CBOR_CONTENT_TYPE
+
+    def __init__(self):
+        if cbor2 is None:
+            raise ImportError("codec 'cbor' requiere el paquete cbor2 (pip install cbor2)")
+
+    def encode(self, obj) -> bytes:
+        return cbor2.dumps(obj)
+
+    def decode(self, data: bytes):
+        return cbor2.loads(data)
+
+
+# --- Layout binario fijo de telemetria ---
+STRUCT_MAGIC = 0xFE  # no colisiona con JSON ('{', '['), mapas msgpack (0x8_, 0xde/0xdf) ni CBOR (0xa_, 0xb_)
+STRUCT_VERSION = 1
+STRUCT_FLOAT_FIELDS = (
+    "wind_speed_mps", "wind_direction_deg", "rotor_speed_rpm", "blade_pitch_angle_deg",
+    "yaw_position_deg", "vibrations_mms", "gear_temperature_c", "bearing_temperature_c",
+    "output_voltage_v", "generated_current_a", "active_power_kw", "reactive_power_kvar",
+    "capacity_mw",
+)
+STRUCT_STATES = ("operational", "maintenance", "standby", "fault", "stopped")
+STRUCT_UNKNOWN_STATE = 0xFF
+STRUCT_DECIMALS = 3  # float32 tiene ~7 cifras; los valores de origen traen <= 2 decimales
+
+# magic, version, farm_id, turbine_id, timestamp_ms, estado, variables (float32, NaN = ausente)
+_TELEMETRY_STRUCT = struct.Struct(f"<BBHHqB{len(STRUCT_FLOAT_FIELDS)}f")
+_STATE_CODES = {s: i for i, s in enumerate(STRUCT_STATES)}
+
+
+class TelemetryStructCodec:
+    """
+    Telemetria de una turbina en un registro little-endian de tamaño fijo.
+    Solo transporta los campos de STRUCT_FLOAT_FIELDS + ids, estado y timestamp
+    (epoch ms UTC); los nombres legibles (farm_name, turbine_name) no viajan.
+    """
+    name = "struct"
+    content_type = STRUCT_CONTENT_TYPE
+    size = _TELEMETRY_STRUCT.size
+
+    def encode(self, obj: Dict[str, Any]) -> bytes:
+        values = []
+        for f in STRUCT_FLOAT_FIELDS:
+            v = obj.get(f)
+            values.append(float("nan") if v is None else float(v))
+        return _TELEMETRY_STRUCT.pack(
+            STRUCT_MAGIC, STRUCT_VERSION,
+            int(obj["farm_id"]), int(obj["turbine_id"]), int(obj["timestamp"]),
+            _STATE_CODES.get(obj.get("operational_state"), STRUCT_UNKNOWN_STATE),
+            *values
+        )
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        magic, version, farm_id, turbine_id, ts_ms, state, *values = _TELEMETRY_STRUCT.unpack(data)
+        if magic != STRUCT_MAGIC or version != STRUCT_VERSION:
+            raise ValueError(f"registro struct invalido (magic={magic:#x}, version={version})")
+        doc = {
+            "farm_id": farm_id,
+            "turbine_id": turbine_id,
+            "timestamp": ts_ms,
+            "operational_state": STRUCT_STATES[state] if state < len(STRUCT_STATES) else None,
+        }
+        for f, v in zip(STRUCT_FLOAT_FIELDS, values):
+            doc[f] = None if math.isnan(v) else round(v, STRUCT_DECIMALS)
+        return doc
+
+
+CODECS = {
+    JsonCodec.name: JsonCodec,
+    MsgPackCodec.name: MsgPackCodec,
+    CborCodec.name: CborCodec,
+    TelemetryStructCodec.name: TelemetryStructCodec,
+}
+_BY_CONTENT_TYPE = {cls.content_type: cls for cls in CODECS.values()}
+_instances: Dict[type, Any] = {}
+
+
+def _instance(cls):
+    codec = _instances.get(cls)
+    if codec is None:
+        codec = _instances[cls] = cls()
+    return codec
+
+
+def get_codec(codec) -> Any:
+    """Acepta un nombre de CODECS o un objeto codec ya construido."""
+    if not isinstance(codec, str):
+        return codec
+    if codec not in CODECS:
+        raise ValueError(f"codec debe ser uno de {tuple(CODECS)}")
+    return _instance(CODECS[codec])
+
+
+def codec_for_content_type(content_type: Optional[str]):
+    cls = _BY_CONTENT_TYPE.get((content_type or "").split(";")[0].strip().lower())
+    return _instance(cls) if cls else None
+
+
+def sniff_codec(data: bytes):
+    """Formato por el primer byte (fallback sin Content-Type, p.ej. MQTT 3.1.1)."""
+    if not data:
+        return _instance(JsonCodec)
+    first = data[0]
+    if first == STRUCT_MAGIC and len(data) == TelemetryStructCodec.size:
+        return _instance(TelemetryStructCodec)
+    if 0x80 <= first <= 0x8F or first in (0xDE, 0xDF):
+        return _instance(MsgPackCodec)
+    if 0xA0 <= first <= 0xBB or first == 0xBF:
+        return _instance(CborCodec)
+    return _instance(JsonCodec)
+
+
+def decode_payload(data: bytes, content_type: Optional[str] = None):
+    """Decodifica segun Content-Type; si falta o es desconocido, detecta el formato."""
+    codec = codec_for_content_type(content_type) or sniff_codec(data)
+    return codec.decode(data)
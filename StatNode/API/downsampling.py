@@ -0,0 +1,82 @@
+"""
+Downsampling de series para graficos: reduce una serie a un numero acotado de puntos
+conservando su forma, asi el payload no depende del rango de tiempo pedido.
+
+- lttb:   Largest-Triangle-Three-Buckets (Steinarsson, 2013). Conserva picos y valles visibles.
+- minmax: por bucket emite el minimo y el maximo (en orden temporal). Conserva extremos exactos.
+
+Las series son listas de dicts ordenadas por x (p.ej. timestamp); y_key es el campo graficado.
+Los puntos sin valor en y_key se ignoran.
+"""
+from datetime import datetime
+from typing import Callable, List
+
+DOWNSAMPLING_METHODS = ("lttb", "minmax")
+
+
+def _x_value(x) -> float:
+    return x.timestamp() if isinstance(x, datetime) else float(x)
+
+
+def lttb(points: List[dict], threshold: int, y_key: str, x_key: str = "timestamp") -> List[dict]:
+    data = [p for p in points if p.get(y_key) is not None]
+    n = len(data)
+    if threshold >= n or threshold < 3:
+        return data
+
+    xs = [_x_value(p[x_key]) for p in data]
+    ys = [float(p[y_key]) for p in data]
+
+    sampled = [data[0]]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0  # indice del ultimo punto elegido
+    for i in range(threshold - 2):
+        # promedio del bucket siguiente (tercer vertice del triangulo)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / span
+        avg_y = sum(ys[next_start:next_end]) / span
+
+        # en el bucket actual, el punto que forma el triangulo de mayor area
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(data[best])
+        a = best
+
+    sampled.append(data[-1])
+    return sampled
+
+
+def minmax(points: List[dict], threshold: int, y_key: str, x_key: str = "timestamp") -> List[dict]:
+    data = [p for p in points if p.get(y_key) is not None]
+    n = len(data)
+    if threshold >= n or threshold < 2:
+        return data
+
+    buckets = threshold // 2
+    size = n / buckets
+    out = []
+    for b in range(buckets):
+        chunk = data[int(b * size):int((b + 1) * size)]
+        if not chunk:
+            continue
+        lo = min(chunk, key=lambda p: p[y_key])
+        hi = max(chunk, key=lambda p: p[y_key])
+        if lo is hi:
+            out.append(lo)
+        else:
+            out.extend(sorted((lo, hi), key=lambda p: _x_value(p[x_key])))
+    return out
+
+
+def get_downsampler(method: str) -> Callable[..., List[dict]]:
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"method debe ser uno de {DOWNSAMPLING_METHODS}")
+    return lttb if method == "lttb" else minmax
@@ -0,0 +1,51 @@
+# Configuracion gunicorn para la API (historial + ingesta HTTP desde EMQX)
+"""
+Workers gthread: cada proceso atiende varios requests en paralelo con hilos (la escritura
+a Mongo libera el GIL) y mantiene conexiones keep-alive, asi el pool HTTP de EMQX reutiliza
+conexiones en vez de abrir una por mensaje. TelemetryDB se crea perezosamente en cada
+worker (despues del fork), nunca en el master.
+
+Coleccion de telemetria: TELEMETRY_STORAGE_MODE (flat | timeseries), el mismo valor que la
+ingesta (StatNode.main --storage-mode); TelemetryDB lo lee en cada worker.
+
+Metricas: los workers no comparten registro, asi que el /metrics de la app responderia el
+de un worker cualquiera. Cada worker expone el suyo con serve_metrics en
+API_METRICS_PORT + slot; el slot (0..workers-1) lo asigna el master en pre_fork y se
+reutiliza al reciclar un worker, asi Prometheus scrapea un conjunto fijo de puertos.
+
+Uso:
+    gunicorn -c StatNode/API/gunicorn.conf.py StatNode.API.server:app
+"""
+import itertools
+import multiprocessing
+import os
+
+bind = os.environ.get("API_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("API_WORKERS", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.environ.get("API_THREADS", 8))
+keepalive = 75          # > idle timeout del pool HTTP de EMQX
+timeout = 60
+backlog = 2048
+max_requests = 50_000   # recicla workers de a poco para acotar fragmentacion de memoria
+max_requests_jitter = 5_000
+preload_app = False     # pymongo no es fork-safe: cada worker abre su propio cliente
+accesslog = None        # a miles de req/s el access log domina el costo
+
+METRICS_PORT = int(os.environ.get("API_METRICS_PORT", 9200))
+os.environ["API_METRICS_PORT"] = str(METRICS_PORT)  # server.py lo ve en cada worker
+
+
+def pre_fork(server, worker):
+    # en el master: el slot libre mas bajo (WORKERS aun no incluye al nuevo)
+    used = {getattr(w, "metrics_slot", None) for w in server.WORKERS.values()}
+    worker.metrics_slot = next(i for i in itertools.count() if i not in used)
+
+
+def post_fork(server, worker):
+    from Shared.Metrics import serve_metrics
+    try:
+        serve_metrics(METRICS_PORT + worker.metrics_slot)
+    except OSError as e:
+        # p.ej. un worker viejo todavia no libero el puerto: sin /metrics en este worker
+        server.log.warning("worker %s sin /metrics en %s: %s", worker.pid, METRICS_PORT + worker.metrics_slot, e)
@@ -1,28 +1,331 @@
-from flask import Flask, request, jsonify
+import base64
+import json
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from flask import Flask, Response, request, jsonify, stream_with_context
+
+from Shared.Logging import setup_logging
+from Shared.Metrics import CONTENT_TYPE_LATEST, REGISTRY
+from StatNode.API.downsampling import DOWNSAMPLING_METHODS, get_downsampler
+from StatNode.DB.TelemetryDB import TelemetryDB
 
 app = Flask(__name__)
+setup_logging()  # por worker de gunicorn (preload_app=False): cola y hilo escritor propios
+
+# --- Configuracion historial ---
+DEFAULT_FARM_ID = 1
+DEFAULT_HISTORY_RANGE = timedelta(hours=24)  # si no se envia 'from'
+DEFAULT_CHART_POINTS = 500                   # puntos por serie en modo grafico
+MAX_CHART_POINTS = 5000
+CHART_OVERSAMPLE = 4                         # filas leidas por punto de salida (margen para LTTB / min-max)
+MAX_PAGE_SIZE = 10_000
+
+# --- Configuracion ingesta HTTP ---
+MAX_INGEST_ITEMS = 20_000                     # muestras por request
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+INGEST_ROLLUPS = True                         # esta instancia tambien ingiere: mantener rollups
+app.config["MAX_CONTENT_LENGTH"] = 32 * 1024 * 1024
+
+# --- Metricas ---
+METRICS_PORT_ENV = "API_METRICS_PORT"         # lo fija gunicorn.conf.py: /metrics por worker
+
+_db_service = None
+
+
+def get_db() -> TelemetryDB:
+    # un TelemetryDB por proceso (el conector Mongo es thread-safe); coleccion segun TELEMETRY_STORAGE_MODE
+    global _db_service
+    if _db_service is None:
+        _db_service = TelemetryDB(maintain_rollups=INGEST_ROLLUPS)
+    return _db_service
+
+
+class BadRequest(ValueError):
+    pass
+
+
+@app.errorhandler(BadRequest)
+def handle_bad_request(e):
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+
+# --- Helpers ---
+
+def _parse_ts(value: str, name: str) -> datetime:
+    try:
+        # fromisoformat de python 3.8 no acepta el sufijo 'Z' de toISOString()
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise BadRequest(f"'{name}' debe ser ISO-8601")
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def _parse_int(name: str, default=None, max_value: int = None):
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise BadRequest(f"'{name}' debe ser entero")
+    if value <= 0:
+        raise BadRequest(f"'{name}' debe ser > 0")
+    return min(value, max_value) if max_value else value
+
+
+def _time_range():
+    end = _parse_ts(request.args["to"], "to") if "to" in request.args else datetime.now(timezone.utc)
+    start = _parse_ts(request.args["from"], "from") if "from" in request.args else end - DEFAULT_HISTORY_RANGE
+    if start >= end:
+        raise BadRequest("'from' debe ser anterior a 'to'")
+    return start, end
+
+
+def _iso(ts: datetime) -> str:
+    # pymongo devuelve datetimes naive en UTC
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _encode_cursor(p: dict) -> str:
+    # keyset: (timestamp, turbine_id, _id) del ultimo punto emitido (_id solo en telemetria cruda)
+    ts = p["timestamp"]
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    oid = p.get("_id")
+    key = [int(ts.timestamp() * 1000), p.get("turbine_id"), str(oid) if oid is not None else None]
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ms, turbine_id, oid = json.loads(raw)
+        return (datetime.fromtimestamp(int(ms) / 1000.0, tz=timezone.utc), turbine_id,
+                ObjectId(oid) if oid is not None else None)
+    except (ValueError, TypeError, InvalidId):
+        raise BadRequest("'cursor' invalido")
+
+
+def _api_point(p: dict) -> dict:
+    """Punto de historial -> HistoricalDataPoint del frontend (+ min/max del bucket)."""
+    return {
+        "timestamp": _iso(p["timestamp"]),
+        "turbineId": str(p.get("turbine_id")),
+        "activePower": p.get("active_power_kw"),
+        "windSpeed": p.get("wind_speed_mps"),
+        "status": p.get("operational_state"),
+        "activePowerMin": p.get("active_power_kw_min"),
+        "activePowerMax": p.get("active_power_kw_max"),
+        "windSpeedMin": p.get("wind_speed_mps_min"),
+        "windSpeedMax": p.get("wind_speed_mps_max"),
+        "count": p.get("count"),
+    }
+
+
+def _stream_json_array(points):
+    # serializa punto a punto: nunca se arma la respuesta completa en memoria
+    first = True
+    for p in points:
+        yield ("" if first else ",") + json.dumps(_api_point(p))
+        first = False
+
+
+def _downsampled(farm_id: int, start: datetime, end: datetime, turbine_id=None):
+    """
+    Modo grafico: a lo sumo 'points' puntos por turbina. Se lee el rollup mas fino con a lo
+    sumo points * CHART_OVERSAMPLE filas por turbina (nunca la telemetria cruda: lo leido y
+    lo retenido quedan acotados por la respuesta) y se reduce con LTTB / min-max por turbina.
+    """
+    points = _parse_int("points", DEFAULT_CHART_POINTS, MAX_CHART_POINTS)
+    method = request.args.get("method", "lttb")
+    if method not in DOWNSAMPLING_METHODS:
+        raise BadRequest(f"'method' debe ser uno de {DOWNSAMPLING_METHODS}")
+    downsample = get_downsampler(method)
+
+    resolution, source = get_db().get_history(farm_id, start, end, turbine_id=turbine_id, max_points=points,
+                                              max_rows=points * CHART_OVERSAMPLE)
+    series = {}
+    for p in source:
+        series.setdefault(p.get("turbine_id"), []).append(p)
+
+    out = []
+    for tid in sorted(series, key=str):
+        out.extend(downsample(series[tid], points, y_key="active_power_kw"))
+    out.sort(key=lambda p: p["timestamp"])
+    return resolution, out
+
+
+def _paginated(farm_id: int, start: datetime, end: datetime, turbine_id=None):
+    """
+    Modo paginado (keyset): ?limit=N[&cursor=...][&resolution_s=...].
+    El cursor es la clave de orden (timestamp, turbine_id, _id) del ultimo punto enviado; la
+    pagina siguiente la retoma con un $match sobre esa tupla (por indice, sin saltear filas).
+    """
+    limit = _parse_int("limit", DEFAULT_CHART_POINTS, MAX_PAGE_SIZE)
+    resolution_s = _parse_int("resolution_s", None)
+    after = _decode_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+
+    resolution, source = get_db().get_history(farm_id, start, end, turbine_id=turbine_id,
+                                              max_points=None, resolution_s=resolution_s or 0, after=after)
+    page = islice(source, limit + 1)  # +1 para saber si hay pagina siguiente
+
+    state = {"next_cursor": None}
+
+    def gen():
+        last = None
+        for i, p in enumerate(page):
+            if i == limit:
+                state["next_cursor"] = _encode_cursor(last)
+                break
+            last = p
+            yield p
+
+    return resolution, gen(), state
+
+
+def _history_response(farm_id: int, turbine_id=None):
+    start, end = _time_range()
+    header = {"farmId": farm_id, "from": _iso(start), "to": _iso(end)}
+    if turbine_id is not None:
+        header = {"turbineId": str(turbine_id), **header}
+
+    if "limit" in request.args or "cursor" in request.args:
+        resolution, points, state = _paginated(farm_id, start, end, turbine_id)
+
+        def body():
+            head = json.dumps({**header, "resolution": resolution})
+            yield head[:-1] + ', "data": ['
+            yield from _stream_json_array(points)
+            yield '], "next_cursor": ' + json.dumps(state["next_cursor"]) + "}"
+    else:
+        resolution, points = _downsampled(farm_id, start, end, turbine_id)
+        if turbine_id is None:
+            # /api/turbines/history: el frontend espera un array de HistoricalDataPoint
+            def body():
+                yield "["
+                yield from _stream_json_array(points)
+                yield "]"
+        else:
+            def body():
+                head = json.dumps({**header, "resolution": resolution})
+                yield head[:-1] + ', "data": ['
+                yield from _stream_json_array(points)
+                yield "]}"
+
+    return Response(stream_with_context(body()), mimetype="application/json",
+                    headers={"X-History-Resolution": resolution})
+
+
+def _parse_ingest_body():
+    """
+    Devuelve (items, errores de parseo por indice). En NDJSON una linea invalida solo
+    invalida ese item; en JSON un body invalido rechaza el request completo.
+    """
+    raw = request.get_data(cache=False)
+    if not raw.strip():
+        raise BadRequest("body vacio")
+
+    is_ndjson = request.mimetype in NDJSON_MIMETYPES
+    if not is_ndjson:
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            # sin Content-Type explicito, varias lineas JSON se tratan como NDJSON
+            if b"\n" not in raw.strip():
+                raise BadRequest("body JSON invalido")
+            is_ndjson = True
+        else:
+            return (data if isinstance(data, list) else [data]), {}
+
+    items, errors = [], {}
+    for line in raw.splitlines():
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError:
+            errors[len(items)] = "linea JSON invalida"
+            items.append(None)
+    return items, errors
+
+
+# --- Rutas ---
 
 @app.route('/')
 def hello_geek():
     return '<h1>Hello from Flask & Docker</h2>'
 
-# Testing - EMQX RULE → Endpoint POST 
-@app.route('/farm/{id_farm}/turbines/telemetry ', methods=['POST'])
-def emqx_receiver():
-    # Obtener los datos JSON enviados por EMQX 
-    data = request.get_json(force=True)
-    
-    # Mostrar en consola para depurar
-    print("Mensaje recibido desde EMQX:")
-    print(data)
 
-    # Podés procesar los datos acá si querés (guardar en DB, etc.)
-    
-    # Responder con éxito
-    return jsonify({"status": "ok", "message": "Data received"}), 200
+@app.route('/api/turbines/<int:turbine_id>/history', methods=['GET'])
+def turbine_history(turbine_id: int):
+    """
+    Historial de una turbina. Query: from, to (ISO-8601), farm_id.
+    - Por defecto (grafico): ?points=500&method=lttb|minmax -> ApiHistoricalResponse acotado.
+    - Paginado: ?limit=N&cursor=...&resolution_s=... -> {..., data, next_cursor}.
+    """
+    farm_id = _parse_int("farm_id", DEFAULT_FARM_ID)
+    return _history_response(farm_id, turbine_id=turbine_id)
+
+
+@app.route('/api/turbines/history', methods=['GET'])
+def turbines_history():
+    """Historial de todas las turbinas del farm (mismos parametros que el de una turbina)."""
+    farm_id = _parse_int("farm_id", DEFAULT_FARM_ID)
+    return _history_response(farm_id)
+
+
+@app.route('/farm/<int:id_farm>/turbines/telemetry', methods=['POST'])
+def ingest_telemetry(id_farm: int):
+    """
+    Ingesta por lotes (regla de EMQX -> HTTP). Body:
+    - array JSON de muestras, o un objeto JSON (una muestra), o
+    - NDJSON (una muestra por linea, Content-Type application/x-ndjson).
+    Todo el lote se escribe con un solo insert_many. Responde un estado por item;
+    200 si todo entro, 207 si hubo rechazos parciales, 400 si nada era valido y
+    503 si Mongo no acepto el lote (el emisor debe reintentar).
+    """
+    items, parse_errors = _parse_ingest_body()
+    if len(items) > MAX_INGEST_ITEMS:
+        raise BadRequest(f"el lote supera {MAX_INGEST_ITEMS} items")
+
+    results = get_db().insert_telemetry_batch(items, farm_id=id_farm)
+    for i, error in parse_errors.items():
+        results[i].update(status="invalid", error=error)
+
+    counts = Counter(r["status"] for r in results)
+    accepted = counts["ok"] + counts["duplicate"]
+    if counts["error"]:
+        code = 503 if not accepted else 207
+    elif accepted == len(results):
+        code = 200
+    else:
+        code = 207 if accepted else 400
+    body = {
+        "status": "ok" if code == 200 else ("partial" if code == 207 else "error"),
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": results,
+    }
+    return jsonify(body), code
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # formato texto Prometheus. Con gunicorn (API_METRICS_PORT) cada worker tiene su registro y
+    # lo expone en su propio puerto: aca se responderia el de un worker al azar
+    port = os.environ.get(METRICS_PORT_ENV)
+    if port:
+        return jsonify({"error": f"metricas por worker en los puertos {port}+slot (ver gunicorn.conf.py)"}), 404
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE_LATEST)
 
 
 if __name__ == '__main__':
     # Ejecuta en el puerto 5000 por defecto
     app.run()
-
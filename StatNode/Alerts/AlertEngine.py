@@ -0,0 +1,343 @@
+# Motor de alertas en streaming: reglas declarativas evaluadas sobre cada muestra ingerida
+"""
+Cada muestra normalizada (salida de TelemetryDB.insert_telemetry) pasa por evaluate():
+
+- Las reglas (dicts, ver DEFAULT_RULES) se compilan una vez a predicados; por muestra el
+  costo es O(reglas) y el estado por turbina y regla es constante (contadores, alerta
+  activa, ultimo valor para las reglas de pendiente).
+- Tipos de regla:
+    threshold  campo <op> valor durante for_samples muestras consecutivas
+    rate       pendiente del campo (unidades por per_s segundos, p.ej. °C/min) <op> valor
+    state      el campo toma el valor 'equals' (p.ej. operational_state == 'fault')
+- Histeresis: la alerta se resuelve cuando la condicion 'clear' (umbral propio, por defecto
+  el mismo) se cumple clear_samples veces seguidas; mientras esta activa no se repite
+  (dedup). cooldown_s evita re-disparar enseguida tras resolverse.
+- Publicacion y persistencia en lote: evaluate() solo encola; un hilo cada flush_interval
+  publica en ALERTS_TOPIC (JSON plano de Frontend/src/docs/STATS_AND_ALERTS_MQTT.md) y
+  hace un bulk_write (upsert por alert_id) en la coleccion 'alerts' con escritura 'majority'.
+  Una alerta resuelta se vuelve a emitir con el mismo alert_id y resolved=true. El upsert
+  se apoya en el indice unico de ALERT_INDEXES (creado una vez por proceso).
+
+Se asume el orden por turbina de la ingesta (cola particionada por topic): dos muestras de
+la misma turbina no se evaluan en paralelo. Una muestra con timestamp no posterior a la
+ultima evaluada de su turbina (reentrega MQTT con manual_ack) se ignora.
+"""
+import json
+import math
+import operator
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from Shared.GenericMQTTClient import GenericMQTTClient
+from Shared.Logging import get_logger
+from Shared.Metrics import REGISTRY
+from Shared.MongoSingleton import MongoSingleton
+
+ALERTS_TOPIC = "windfarm/alerts"
+ALERTS_QOS = 1
+ALERTS_COLLECTION = "alerts"
+ALERTS_WRITE_PROFILE = "majority"
+ALERTS_FLUSH_INTERVAL_S = 0.5
+ALERTS_MAX_PENDING = 10_000       # alertas sin persistir (Mongo caido) antes de descartar
+TIMESTAMP_STR_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# -- Indices de 'alerts' (ver query_pipelines / explain_queries.py)
+#    upsert {alert_id}  -> alert_id (unico: dos emisiones concurrentes no duplican la alerta)
+ALERT_INDEXES = [
+    ([("alert_id", 1)], {"name": "alert_id", "unique": True}),
+]
+
+RULE_KINDS = ("threshold", "rate", "state")
+SEVERITIES = ("critical", "warning", "info")
+ALERT_TYPES = ("electrical", "mechanical", "environmental", "system")
+_OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+# condicion de resolucion de cada operador: sale del rango con histeresis
+_CLEAR_OPS = {">": operator.le, ">=": operator.lt, "<": operator.ge, "<=": operator.gt}
+
+DEFAULT_RULES = [
+    {"name": "vibration_high", "field": "vibrations_mms", "op": ">", "value": 4.0, "clear": 3.5,
+     "for_samples": 3, "clear_samples": 3, "severity": "warning", "alert_type": "mechanical",
+     "message": "Vibración elevada en rotor"},
+    {"name": "gear_temperature_high", "field": "gear_temperature_c", "op": ">", "value": 68.0, "clear": 65.0,
+     "for_samples": 2, "clear_samples": 2, "severity": "warning", "alert_type": "mechanical",
+     "message": "Temperatura del engranaje elevada"},
+    {"name": "gear_temperature_rise", "kind": "rate", "field": "gear_temperature_c", "op": ">", "value": 5.0,
+     "per_s": 60, "clear": 1.0, "for_samples": 3, "clear_samples": 3, "severity": "warning",
+     "alert_type": "mechanical", "message": "Aumento rápido de temperatura del engranaje", "unit": "°C/min"},
+    {"name": "turbine_fault", "kind": "state", "field": "operational_state", "equals": "fault",
+     "severity": "critical", "alert_type": "system", "message": "Turbina en estado de falla"},
+]
+
+log = get_logger(__name__, rate_limit=5)
+
+# --- Metricas ---
+ALERTS_RAISED = REGISTRY.counter("alerts_raised_total", "Alertas disparadas", ("rule", "severity"))
+ALERTS_RESOLVED = REGISTRY.counter("alerts_resolved_total", "Alertas resueltas (histeresis)", ("rule",))
+ALERTS_ACTIVE = REGISTRY.gauge("alerts_active", "Alertas activas")
+ALERTS_DROPPED = REGISTRY.counter("alerts_dropped_total", "Alertas descartadas sin persistir")
+
+
+class _Rule:
+    """Regla compilada: predicados de disparo / resolucion sobre el valor ya extraido."""
+    __slots__ = ("index", "name", "field", "kind", "trigger", "clear", "for_samples", "clear_samples",
+                 "cooldown_s", "per_s", "limit", "unit", "severity", "alert_type", "message")
+
+    def __init__(self, index: int, spec: Dict[str, Any]):
+        self.index = index
+        self.name = spec["name"]
+        self.field = spec["field"]
+        self.kind = spec.get("kind", "threshold")
+        if self.kind not in RULE_KINDS:
+            raise ValueError(f"regla {self.name}: kind debe ser uno de {RULE_KINDS}")
+        self.severity = spec.get("severity", "warning")
+        if self.severity not in SEVERITIES:
+            raise ValueError(f"regla {self.name}: severity debe ser uno de {SEVERITIES}")
+        self.alert_type = spec.get("alert_type", "system")
+        if self.alert_type not in ALERT_TYPES:
+            raise ValueError(f"regla {self.name}: alert_type debe ser uno de {ALERT_TYPES}")
+        self.message = spec.get("message", self.name)
+        self.unit = spec.get("unit", "")
+        self.for_samples = max(1, int(spec.get("for_samples", 1)))
+        self.clear_samples = max(1, int(spec.get("clear_samples", 1)))
+        self.cooldown_s = float(spec.get("cooldown_s", 0))
+        self.per_s = float(spec.get("per_s", 1))
+
+        if self.kind == "state":
+            equals = spec["equals"]
+            self.limit = equals
+            self.trigger = lambda v, _e=equals: v == _e
+            self.clear = lambda v, _e=equals: v != _e
+            return
+        op = spec.get("op", ">")
+        if op not in _OPS:
+            raise ValueError(f"regla {self.name}: op debe ser uno de {tuple(_OPS)}")
+        limit = float(spec["value"])
+        clear_limit = float(spec.get("clear", limit))
+        if (op in (">", ">=") and clear_limit > limit) or (op in ("<", "<=") and clear_limit < limit):
+            raise ValueError(f"regla {self.name}: 'clear' debe quedar del lado seguro de 'value'")
+        self.limit = limit
+        self.trigger = lambda v, _op=_OPS[op], _l=limit: _op(v, _l)
+        self.clear = lambda v, _op=_CLEAR_OPS[op], _l=clear_limit: _op(v, _l)
+
+
+class _RuleState:
+    __slots__ = ("hits", "clears", "alert", "resolved_at", "prev_value", "prev_ts")
+
+    def __init__(self):
+        self.hits = 0
+        self.clears = 0
+        self.alert: Optional[dict] = None
+        self.resolved_at = -math.inf
+        self.prev_value = None
+        self.prev_ts = None
+
+
+def compile_rules(specs: Sequence[Dict[str, Any]]) -> List[_Rule]:
+    names = [s.get("name") for s in specs]
+    if len(set(names)) != len(names) or None in names:
+        raise ValueError("cada regla necesita un 'name' unico")
+    return [_Rule(i, spec) for i, spec in enumerate(specs)]
+
+
+def load_rules(path: str) -> List[Dict[str, Any]]:
+    """Reglas desde un archivo JSON (lista de dicts con la forma de DEFAULT_RULES)."""
+    with open(path, encoding="utf-8") as fh:
+        specs = json.load(fh)
+    compile_rules(specs)  # valida al cargar
+    return specs
+
+
+_indexes_ensured = set()  # (db_name, coleccion) ya verificados en este proceso
+
+
+def ensure_indexes(mongo):
+    """Crea los indices de ALERT_INDEXES (una vez por proceso y base)."""
+    key = (mongo.db_name, ALERTS_COLLECTION)
+    if key in _indexes_ensured:
+        return
+    for keys, options in ALERT_INDEXES:
+        mongo.create_index(ALERTS_COLLECTION, keys, **options)
+    _indexes_ensured.add(key)
+
+
+def query_pipelines() -> Dict[str, tuple]:
+    """Consultas de AlertEngine contra Mongo: {nombre: (coleccion, pipeline)} (explain_queries.py)."""
+    return {"alert_upsert": (ALERTS_COLLECTION, [{"$match": {"alert_id": "ALT-0-0-0-0"}}])}
+
+
+def _epoch(ts) -> float:
+    if isinstance(ts, datetime):
+        return ts.timestamp()
+    return time.time()
+
+
+class AlertEngine:
+    def __init__(self, rules: Sequence[Dict[str, Any]] = None, mqtt_client: GenericMQTTClient = None,
+                 mongo=None, persist: bool = True, flush_interval: float = ALERTS_FLUSH_INTERVAL_S,
+                 topic: str = ALERTS_TOPIC):
+        """
+        mqtt_client: conexion por la que se publican las alertas (None: no se publican).
+        mongo: conector para la coleccion 'alerts'; por defecto el del proceso con perfil 'majority'
+        (persist=False: no se persisten).
+        """
+        self.rules = compile_rules(DEFAULT_RULES if rules is None else rules)
+        self.mqtt_client = mqtt_client
+        self.persist = persist
+        self._mongo = mongo
+        self.flush_interval = flush_interval
+        self.topic = topic
+        self._state: Dict[tuple, List[_RuleState]] = {}
+        self._last_ts: Dict[tuple, float] = {}  # (farm, turbina) -> timestamp de la ultima muestra evaluada
+        self._outbox = deque()         # alertas por emitir (dicts ya serializables)
+        self._unsaved: List[dict] = [] # emitidas pero no persistidas (reintento)
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._m_raised = {(r.name, r.severity): ALERTS_RAISED.labels(r.name, r.severity) for r in self.rules}
+        self._m_resolved = {r.name: ALERTS_RESOLVED.labels(r.name) for r in self.rules}
+        ALERTS_ACTIVE.set_function(self.active_count)
+
+    # --- camino de ingesta ---
+
+    def evaluate(self, doc: Dict[str, Any]):
+        """Evalua las reglas sobre una muestra normalizada (farm_id, turbine_id, timestamp datetime)."""
+        key = (doc.get("farm_id"), doc.get("turbine_id"))
+        ts = _epoch(doc.get("timestamp"))
+        last_ts = self._last_ts.get(key)
+        if last_ts is not None and ts <= last_ts:
+            return  # reentrega de una muestra ya evaluada (ingesta al menos una vez): no suma hits
+        self._last_ts[key] = ts
+        states = self._state.get(key)
+        if states is None:
+            states = self._state[key] = [_RuleState() for _ in self.rules]
+        for rule, st in zip(self.rules, states):
+            value = doc.get(rule.field)
+            if value is None:
+                continue
+            if rule.kind == "rate":
+                prev_value, prev_ts = st.prev_value, st.prev_ts
+                st.prev_value, st.prev_ts = value, ts
+                if prev_ts is None or ts <= prev_ts:
+                    continue
+                try:
+                    value = (value - prev_value) / (ts - prev_ts) * rule.per_s
+                except TypeError:
+                    continue
+            try:
+                if st.alert is None:
+                    if not rule.trigger(value):
+                        st.hits = 0
+                        continue
+                    st.hits += 1
+                    if st.hits >= rule.for_samples:
+                        if ts - st.resolved_at >= rule.cooldown_s:
+                            self._raise(rule, st, doc, value, ts)
+                elif rule.clear(value):
+                    st.clears += 1
+                    if st.clears >= rule.clear_samples:
+                        self._resolve(rule, st, ts)
+                else:
+                    st.clears = 0
+            except TypeError:
+                continue  # valor no comparable (p.ej. string en un campo numerico)
+
+    def _raise(self, rule: _Rule, st: _RuleState, doc: Dict[str, Any], value, ts: float):
+        farm_id, turbine_id = doc.get("farm_id"), doc.get("turbine_id")
+        turbine_name = doc.get("turbine_name")
+        if not turbine_name:
+            turbine_name = f"T-{turbine_id:03d}" if isinstance(turbine_id, int) else str(turbine_id)
+        if rule.kind == "state":
+            details = f"{rule.field}: {value}"
+        else:
+            details = f"{rule.field}: {value:.2f}{rule.unit} (límite: {rule.limit:g}{rule.unit})"
+        st.alert = {
+            "alert_id": f"ALT-{int(ts * 1000)}-{farm_id}-{turbine_id}-{rule.index}",
+            "farm_id": farm_id,
+            "turbine_id": turbine_id,
+            "turbine_name": turbine_name,
+            "alert_type": rule.alert_type,
+            "severity": rule.severity,
+            "message": rule.message,
+            "details": details,
+            "timestamp": datetime.fromtimestamp(ts).strftime(TIMESTAMP_STR_FORMAT),
+            "acknowledged": False,
+            "resolved": False,
+            "rule": rule.name,
+        }
+        st.hits = st.clears = 0
+        self._m_raised[(rule.name, rule.severity)].inc()
+        self._outbox.append(dict(st.alert))
+
+    def _resolve(self, rule: _Rule, st: _RuleState, ts: float):
+        alert = st.alert
+        alert["resolved"] = True
+        alert["resolved_at"] = datetime.fromtimestamp(ts).strftime(TIMESTAMP_STR_FORMAT)
+        st.alert = None
+        st.hits = st.clears = 0
+        st.resolved_at = ts
+        self._m_resolved[rule.name].inc()
+        self._outbox.append(alert)
+
+    def active_alerts(self) -> List[dict]:
+        return [dict(st.alert) for states in list(self._state.values()) for st in states if st.alert is not None]
+
+    def active_count(self) -> int:
+        # derivado del estado (sin contador propio): evaluate corre en varios workers de ingesta a la vez
+        return sum(1 for states in list(self._state.values()) for st in states if st.alert is not None)
+
+    # --- emision en lote ---
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="alerts-flush", daemon=True)
+        self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """Publica y persiste lo encolado por evaluate(). Devuelve cuantas alertas emitio."""
+        batch = []
+        while self._outbox:
+            batch.append(self._outbox.popleft())
+        if self.mqtt_client is not None:
+            for alert in batch:
+                self.mqtt_client.publish(self.topic, alert, qos=ALERTS_QOS)
+        if self.persist:
+            self._persist(batch)
+        return len(batch)
+
+    def _persist(self, batch: List[dict]):
+        pending = self._unsaved + batch
+        if not pending:
+            return
+        try:
+            if self._mongo is None:
+                self._mongo = MongoSingleton.get_singleton_client(write_profile=ALERTS_WRITE_PROFILE)
+            ensure_indexes(self._mongo)
+            # upsert por alert_id: la resolucion actualiza el mismo documento; reintentos idempotentes
+            self._mongo.bulk_write(ALERTS_COLLECTION, [
+                UpdateOne({"alert_id": a["alert_id"]}, {"$set": a}, upsert=True) for a in pending
+            ], ordered=True)
+            self._unsaved = []
+        except PyMongoError as e:
+            overflow = len(pending) - ALERTS_MAX_PENDING
+            if overflow > 0:
+                ALERTS_DROPPED.inc(overflow)
+                pending = pending[overflow:]
+            self._unsaved = pending
+            log.warning("alertas sin persistir (%s): %s", len(pending), e)
+
+    def stop(self):
+        """Detiene el hilo y emite lo pendiente (llamar despues de drenar la ingesta)."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
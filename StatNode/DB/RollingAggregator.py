@@ -0,0 +1,202 @@
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+# indices de cada muestra guardada en el ring buffer de la turbina
+_TS, _WIND, _POWER, _ACTIVE, _CAPACITY, _WEIGHT, _ENERGY = range(7)
+
+
+def is_transient(doc: Dict[str, Any]) -> bool:
+    """Muestra instantanea publicada por un transitorio (modo summary): no entra en las agregaciones."""
+    return doc.get("transient") is not None
+
+
+def sample_weight(doc: Dict[str, Any]) -> float:
+    """Peso del documento en disponibilidad: window_s de un resumen de turbina, 1 por muestra cruda."""
+    window_s = _num(doc.get("window_s"))
+    return 1.0 if window_s is None else window_s
+
+
+def active_weight(doc: Dict[str, Any]) -> float:
+    """Fraccion del documento en operacion: active_fraction de un resumen o 1/0 segun el estado."""
+    fraction = _num(doc.get("active_fraction"))
+    if fraction is not None:
+        return fraction
+    return 1.0 if doc.get("operational_state") == "operational" else 0.0
+
+
+def _num(val) -> Optional[float]:
+    # igual que $avg/$sum de Mongo: se ignoran null, faltantes y no numericos
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return float(val)
+    return None
+
+
+class _TurbineWindow:
+    """Ring buffer de muestras de una turbina + sumas corrientes de la ventana."""
+    __slots__ = ("samples", "wind_sum", "wind_n", "power_sum", "power_n", "capacity_sum", "capacity_n",
+                 "active", "weight", "raw_power_sum", "raw_n", "energy", "covered_s", "last_ts", "last_state")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = deque()
+        self.wind_sum = self.power_sum = self.capacity_sum = 0.0
+        self.wind_n = self.power_n = self.capacity_n = self.raw_n = 0
+        self.active = self.weight = self.raw_power_sum = self.energy = self.covered_s = 0.0
+        self.last_ts = None
+        self.last_state = None
+
+    def add(self, sample: tuple, state):
+        self.samples.append(sample)
+        self._apply(sample, +1)
+        if self.last_ts is None or sample[_TS] >= self.last_ts:
+            self.last_ts = sample[_TS]
+            self.last_state = state
+
+    def evict(self, cutoff: float):
+        samples = self.samples
+        while samples and samples[0][_TS] < cutoff:
+            self._apply(samples.popleft(), -1)
+        if not samples:
+            # ventana vacia: reiniciar sumas (evita arrastrar error de redondeo)
+            self.reset()
+
+    def _apply(self, sample: tuple, sign: int):
+        wind, power, capacity = sample[_WIND], sample[_POWER], sample[_CAPACITY]
+        if wind is not None:
+            self.wind_sum += sign * wind
+            self.wind_n += sign
+        if power is not None:
+            self.power_sum += sign * power
+            self.power_n += sign
+        if capacity is not None:
+            self.capacity_sum += sign * capacity
+            self.capacity_n += sign
+        self.active += sign * sample[_ACTIVE]
+        self.weight += sign * sample[_WEIGHT]
+        energy = sample[_ENERGY]
+        if energy is not None:
+            # resumen: energia integrada en la turbina sobre window_s
+            self.energy += sign * energy
+            self.covered_s += sign * sample[_WEIGHT]
+        else:
+            self.raw_n += sign
+            if power is not None:
+                self.raw_power_sum += sign * power
+
+
+class RollingWindowAggregator:
+    """
+    Agregador incremental en memoria alimentado desde la ingesta (TelemetryDB.insert_telemetry).
+    Mantiene por turbina una ventana deslizante de window_minutes con sumas corrientes, de modo
+    que las metricas se obtienen en O(turbinas) sin consultar Mongo.
+
+    turbine_groups() devuelve los mismos documentos que el $group por turbina del pipeline
+    de TelemetryDB (avg_wind, avg_power_kw, sum_power_kw, sample_count, raw_samples, weight,
+    active_samples, energy_kwh, covered_s, last_state, avg_capacity_mw), asi el
+    post-procesamiento es comun a ambos caminos. Los transitorios no entran.
+
+    Solo ve lo ingerido por este proceso: recien arrancado (cold start) no esta "caliente"
+    y TelemetryDB usa Mongo como fallback.
+    """
+    def __init__(self, window_minutes: int = 5):
+        self.window_s = window_minutes * 60
+        self.started_at = datetime.now(timezone.utc).timestamp()
+        self._farms: Dict[Any, Dict[Any, _TurbineWindow]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, doc: Dict[str, Any]):
+        """Agrega una muestra ya normalizada (timestamp datetime UTC)."""
+        ts = doc.get("timestamp")
+        if not isinstance(ts, datetime) or is_transient(doc):
+            return
+        ts = ts.timestamp()
+        state = doc.get("operational_state")
+        weight = sample_weight(doc)
+        sample = (
+            ts,
+            _num(doc.get("wind_speed_mps")),
+            _num(doc.get("active_power_kw")),
+            active_weight(doc) * weight,
+            _num(doc.get("capacity_mw")),
+            weight,
+            _num(doc.get("energy_kwh")),
+        )
+        farm_id, turbine_id = doc.get("farm_id"), doc.get("turbine_id")
+
+        with self._lock:
+            cutoff = datetime.now(timezone.utc).timestamp() - self.window_s
+            if ts < cutoff:
+                return  # ya fuera de la ventana
+            turbines = self._farms.setdefault(farm_id, {})
+            window = turbines.get(turbine_id)
+            if window is None:
+                window = turbines[turbine_id] = _TurbineWindow()
+            window.add(sample, state)
+            window.evict(cutoff)  # O(1) amortizado: el buffer no crece aunque nadie consulte
+
+    def is_warm(self, minutes: int) -> bool:
+        """True si el agregador lleva corriendo al menos 'minutes' y la ventana los cubre."""
+        now = datetime.now(timezone.utc).timestamp()
+        return minutes * 60 <= self.window_s and now - self.started_at >= minutes * 60
+
+    def turbine_groups(self, farm_id, minutes: int) -> Optional[List[dict]]:
+        """
+        Grupos por turbina de los ultimos 'minutes' (ordenados por turbine_id), o None si el
+        agregador no cubre ese rango (cold start o ventana mas chica que la pedida).
+        """
+        if not self.is_warm(minutes):
+            return None
+        now = datetime.now(timezone.utc).timestamp()
+        cutoff = now - minutes * 60
+
+        out = []
+        with self._lock:
+            turbines = self._farms.get(farm_id, {})
+            for tid in list(turbines):
+                window = turbines[tid]
+                window.evict(now - self.window_s)
+                if not window.samples:
+                    del turbines[tid]
+                    continue
+                if minutes * 60 == self.window_s:
+                    out.append(self._group_from_sums(tid, window))
+                else:
+                    out.append(self._group_from_scan(tid, window, cutoff))
+        out = [g for g in out if g is not None]
+        out.sort(key=lambda g: g["_id"])
+        return out
+
+    @staticmethod
+    def _group_from_sums(tid, w: _TurbineWindow) -> dict:
+        return {
+            "_id": tid,
+            "avg_wind": w.wind_sum / w.wind_n if w.wind_n else None,
+            "avg_power_kw": w.power_sum / w.power_n if w.power_n else None,
+            "sum_power_kw": w.raw_power_sum,
+            "sample_count": len(w.samples),
+            "raw_samples": w.raw_n,
+            "weight": w.weight,
+            "active_samples": w.active,
+            "energy_kwh": w.energy,
+            "covered_s": w.covered_s,
+            "last_state": w.last_state,
+            "avg_capacity_mw": w.capacity_sum / w.capacity_n if w.capacity_n else None,
+        }
+
+    @staticmethod
+    def _group_from_scan(tid, w: _TurbineWindow, cutoff: float) -> Optional[dict]:
+        # rango mas chico que la ventana: recorrer el buffer (sigue sin tocar la BD)
+        part = _TurbineWindow()
+        for s in w.samples:
+            if s[_TS] >= cutoff:
+                part.samples.append(s)
+                part._apply(s, +1)
+        if not part.samples:
+            return None
+        group = RollingWindowAggregator._group_from_sums(tid, part)
+        group["last_state"] = w.last_state
+        return group
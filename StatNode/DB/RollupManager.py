@@ -0,0 +1,361 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import PyMongoError
+
+from Shared.GenericMongoClient import GenericMongoClient
+from Shared.Logging import get_logger
+from StatNode.DB.RollingAggregator import active_weight, is_transient, sample_weight
+
+# -- Niveles de rollup: (nombre, tamaño de bucket en segundos), de mas fino a mas grueso
+ROLLUP_LEVELS = [("1m", 60), ("1h", 3600), ("1d", 86400)]
+ROLLUP_COLLECTION = "telemetry_rollup_{level}"
+
+# variables con count/sum/min/max por bucket
+ROLLUP_FIELDS = (
+    "wind_speed_mps", "active_power_kw", "rotor_speed_rpm",
+    "gear_temperature_c", "bearing_temperature_c", "vibrations_mms",
+)
+# variables del snapshot 'last' (ultimo valor del bucket)
+LAST_FIELDS = ("wind_speed_mps", "active_power_kw", "operational_state")
+
+SCOPES = ("turbine", "farm")  # farm: agregado de todas las turbinas del parque
+
+# (scope, farm, bucket, turbine): historial de todas las turbinas en el orden keyset (bucket, turbine_id)
+ROLLUP_INDEXES = [
+    ([("scope", 1), ("farm_id", 1), ("turbine_id", 1), ("bucket", 1)], {"name": "scope_farm_turbine_bucket", "unique": True}),
+    ([("scope", 1), ("farm_id", 1), ("bucket", 1), ("turbine_id", 1)], {"name": "scope_farm_bucket_turbine"}),
+]
+# reemplazado por scope_farm_bucket_turbine (prefijo de este): ensure_indexes lo borra
+ROLLUP_SUPERSEDED_INDEXES = [
+    ([("scope", 1), ("farm_id", 1), ("bucket", 1)], "scope_farm_bucket"),
+]
+
+# -- Backfill desde la telemetria cruda
+BACKFILL_CHUNK_BUCKETS = 1440  # buckets por agregacion (1 dia de 1m, 60 dias de 1h)
+BACKFILL_BATCH = 1000          # reemplazos por bulk_write
+
+log = get_logger(__name__, rate_limit=5)
+
+
+def keyset_after(keys: List[str], values: List[Any]) -> dict:
+    """Filtro 'tupla(keys) > tupla(values)' para retomar un recorrido ordenado por keys (keyset)."""
+    clauses = []
+    for i, key in enumerate(keys):
+        clause = dict(zip(keys[:i], values[:i]))
+        clause[key] = {"$gt": values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def _is_num(val) -> bool:
+    return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+
+def _bucket_start(ts: datetime, size_s: int) -> datetime:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % size_s, tz=timezone.utc)
+
+
+class _BucketAcc:
+    """Acumulado parcial de un bucket dentro de un lote de ingesta."""
+    __slots__ = ("count", "weight", "operational", "energy", "stats", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.weight = 0.0
+        self.operational = 0.0
+        self.energy: Optional[float] = None  # solo si hubo resumenes con energy_kwh
+        self.stats: Dict[str, list] = {}  # campo -> [sum, n, min, max]
+        self.last: Optional[dict] = None
+
+    def add(self, doc: Dict[str, Any], ts: datetime):
+        weight = sample_weight(doc)
+        self.count += 1
+        self.weight += weight
+        self.operational += active_weight(doc) * weight
+        energy = doc.get("energy_kwh")
+        if _is_num(energy):
+            self.energy = (self.energy or 0.0) + energy
+        for f in ROLLUP_FIELDS:
+            v = doc.get(f)
+            if not _is_num(v):
+                continue
+            st = self.stats.get(f)
+            if st is None:
+                self.stats[f] = [v, 1, v, v]
+            else:
+                st[0] += v
+                st[1] += 1
+                if v < st[2]:
+                    st[2] = v
+                if v > st[3]:
+                    st[3] = v
+        if self.last is None or ts >= self.last["t"]:
+            # 't' primero: $max compara documentos campo a campo, gana el mas reciente
+            self.last = {"t": ts, **{f: doc.get(f) for f in LAST_FIELDS}}
+
+
+class RollupManager:
+    """
+    Mantiene colecciones de rollup (1 min / 1 h / 1 dia) por turbina y por farm,
+    actualizadas incrementalmente con cada lote ingerido (un bulk_write de upserts por nivel).
+
+    Documento de rollup:
+        {scope, farm_id, turbine_id (None en scope 'farm'), bucket,
+         count, weight, operational_count, energy_kwh (solo con resumenes de turbina),
+         stats: {campo: {sum, n, min, max}},
+         last: {t, wind_speed_mps, active_power_kw, operational_state}}
+    """
+    _indexes_ensured = set()
+
+    def __init__(self, mongo: GenericMongoClient, levels: List[Tuple[str, int]] = None):
+        self.mongo = mongo
+        self.levels = levels or ROLLUP_LEVELS
+        self.ensure_indexes()
+
+    @staticmethod
+    def collection_for(level: str) -> str:
+        return ROLLUP_COLLECTION.format(level=level)
+
+    def ensure_indexes(self):
+        for level, _ in self.levels:
+            key = (self.mongo.db_name, self.collection_for(level))
+            if key in RollupManager._indexes_ensured:
+                continue
+            collection = self.collection_for(level)
+            for keys, options in ROLLUP_INDEXES:
+                self.mongo.create_index(collection, keys, **options)
+            try:
+                dropped = self.mongo.drop_superseded_indexes(collection, ROLLUP_SUPERSEDED_INDEXES)
+                if dropped:
+                    log.info("Indices reemplazados borrados en '%s': %s", collection, dropped)
+            except PyMongoError as e:
+                log.warning("No se pudieron borrar los indices reemplazados en '%s': %s", collection, e)
+            RollupManager._indexes_ensured.add(key)
+
+    # --- Mantenimiento incremental ---
+
+    def ingest(self, docs: List[Dict[str, Any]]) -> int:
+        """
+        Incorpora documentos normalizados (planos, timestamp UTC) a todos los niveles.
+        Primero reduce el lote en memoria (un acumulado por bucket) y luego aplica un
+        upsert por bucket con $inc/$min/$max. Devuelve la cantidad de upserts enviados.
+        """
+        per_level: Dict[str, Dict[tuple, _BucketAcc]] = {level: {} for level, _ in self.levels}
+        for doc in docs:
+            ts = doc.get("timestamp")
+            if not isinstance(ts, datetime) or is_transient(doc):
+                continue
+            farm_id, turbine_id = doc.get("farm_id"), doc.get("turbine_id")
+            for level, size_s in self.levels:
+                bucket = _bucket_start(ts, size_s)
+                accs = per_level[level]
+                for key in (("turbine", farm_id, turbine_id, bucket), ("farm", farm_id, None, bucket)):
+                    acc = accs.get(key)
+                    if acc is None:
+                        acc = accs[key] = _BucketAcc()
+                    acc.add(doc, ts)
+
+        sent = 0
+        for level, accs in per_level.items():
+            ops = [self._upsert_op(key, acc) for key, acc in accs.items()]
+            if not ops:
+                continue
+            try:
+                self.mongo.bulk_write(self.collection_for(level), ops, ordered=False)
+                sent += len(ops)
+            except PyMongoError as e:
+                # los rollups son derivados: se registra y se sigue (la telemetria cruda ya esta guardada)
+                log.error("Error actualizando nivel %s: %s", level, e)
+        return sent
+
+    @staticmethod
+    def _upsert_op(key: tuple, acc: _BucketAcc) -> UpdateOne:
+        scope, farm_id, turbine_id, bucket = key
+        # weight: segundos de los resumenes (window_s) o 1 por muestra; operational_count en la misma unidad
+        inc = {"count": acc.count, "weight": acc.weight, "operational_count": acc.operational}
+        if acc.energy is not None:
+            inc["energy_kwh"] = acc.energy
+        mins, maxs = {}, {"last": acc.last}
+        for f, (total, n, lo, hi) in acc.stats.items():
+            inc[f"stats.{f}.sum"] = total
+            inc[f"stats.{f}.n"] = n
+            mins[f"stats.{f}.min"] = lo
+            maxs[f"stats.{f}.max"] = hi
+        update = {"$inc": inc, "$max": maxs}
+        if mins:
+            update["$min"] = mins
+        return UpdateOne(
+            {"scope": scope, "farm_id": farm_id, "turbine_id": turbine_id, "bucket": bucket},
+            update,
+            upsert=True
+        )
+
+    # --- Backfill ---
+
+    @staticmethod
+    def backfill_pipeline(size_s: int, farm_id: int, start: datetime, end: datetime, scope: str = "turbine",
+                          farm_field: str = "farm_id", turbine_field: str = "turbine_id") -> List[dict]:
+        """
+        Documentos de rollup de un nivel calculados en el servidor desde la telemetria cruda,
+        con las mismas reglas que ingest (transitorios fuera, weight = window_s o 1).
+        farm_field / turbine_field: ubicacion de la identidad en la coleccion cruda (metaField en time-series).
+        """
+        weight = {"$ifNull": ["$window_s", 1]}
+        active = {"$ifNull": ["$active_fraction",
+                              {"$cond": [{"$eq": ["$operational_state", "operational"]}, 1, 0]}]}
+        energy = {"$isNumber": "$energy_kwh"}
+        ts_ms = {"$toLong": "$timestamp"}
+        group_id = {"bucket": {"$toDate": {"$subtract": [ts_ms, {"$mod": [ts_ms, size_s * 1000]}]}}}
+        if scope == "turbine":
+            group_id["turbine_id"] = f"${turbine_field}"
+        group = {
+            "_id": group_id,
+            "count": {"$sum": 1},
+            "weight": {"$sum": weight},
+            "operational_count": {"$sum": {"$multiply": [weight, active]}},
+            "energy_kwh": {"$sum": {"$cond": [energy, "$energy_kwh", 0]}},
+            "energy_n": {"$sum": {"$cond": [energy, 1, 0]}},
+            # 't' primero: igual que el $max de ingest, gana el documento mas reciente
+            "last": {"$max": {"t": "$timestamp", **{f: {"$ifNull": [f"${f}", None]} for f in LAST_FIELDS}}},
+        }
+        stats = {}
+        for f in ROLLUP_FIELDS:
+            numeric = {"$isNumber": f"${f}"}
+            group[f"{f}__sum"] = {"$sum": {"$cond": [numeric, f"${f}", 0]}}
+            group[f"{f}__n"] = {"$sum": {"$cond": [numeric, 1, 0]}}
+            group[f"{f}__min"] = {"$min": {"$cond": [numeric, f"${f}", None]}}  # $min/$max ignoran null
+            group[f"{f}__max"] = {"$max": {"$cond": [numeric, f"${f}", None]}}
+            stats[f] = {"$cond": [{"$gt": [f"${f}__n", 0]},
+                                  {"sum": f"${f}__sum", "n": f"${f}__n", "min": f"${f}__min", "max": f"${f}__max"},
+                                  "$$REMOVE"]}
+        return [
+            {"$match": {farm_field: farm_id, "timestamp": {"$gte": start, "$lt": end},
+                        "transient": {"$exists": False}}},
+            {"$group": group},
+            {"$project": {
+                "_id": 0,
+                "scope": {"$literal": scope},
+                "farm_id": {"$literal": farm_id},
+                "turbine_id": {"$ifNull": ["$_id.turbine_id", None]} if scope == "turbine" else {"$literal": None},
+                "bucket": "$_id.bucket",
+                "count": 1, "weight": 1, "operational_count": 1,
+                "energy_kwh": {"$cond": [{"$gt": ["$energy_n", 0]}, "$energy_kwh", "$$REMOVE"]},
+                "stats": stats,
+                "last": 1,
+            }},
+        ]
+
+    def backfill(self, raw_collection: str, farm_id: int, start: datetime, end: datetime,
+                 farm_field: str = "farm_id", turbine_field: str = "turbine_id",
+                 levels: List[Tuple[str, int]] = None) -> int:
+        """
+        Recalcula desde la coleccion cruda los buckets que tocan [start, end) (ampliado a buckets
+        enteros) y los reemplaza (upsert): completa rollups de datos ingeridos sin maintain_rollups
+        y es idempotente. Un bucket que sigue recibiendo ingesta mientras se recalcula puede perder
+        los incrementos de ese intervalo: conviene un rango ya cerrado. Devuelve los buckets escritos.
+        """
+        raw = self.mongo.get_collection(raw_collection)
+        written = 0
+        for level, size_s in levels or self.levels:
+            collection = self.collection_for(level)
+            lo = _bucket_start(start, size_s)
+            stop = _bucket_start(end, size_s)
+            if stop < end:
+                stop += timedelta(seconds=size_s)
+            while lo < stop:
+                hi = min(stop, lo + timedelta(seconds=size_s * BACKFILL_CHUNK_BUCKETS))
+                ops = []
+                for scope in SCOPES:
+                    pipeline = self.backfill_pipeline(size_s, farm_id, lo, hi, scope, farm_field, turbine_field)
+                    for doc in raw.aggregate(pipeline, allowDiskUse=True):
+                        key = {k: doc[k] for k in ("scope", "farm_id", "turbine_id", "bucket")}
+                        ops.append(ReplaceOne(key, doc, upsert=True))
+                        if len(ops) >= BACKFILL_BATCH:
+                            self.mongo.bulk_write(collection, ops, ordered=False)
+                            written += len(ops)
+                            ops = []
+                if ops:
+                    self.mongo.bulk_write(collection, ops, ordered=False)
+                    written += len(ops)
+                log.info("Backfill %s farm %s hasta %s: %s buckets escritos", level, farm_id, hi.isoformat(), written)
+                lo = hi
+        return written
+
+    # --- Consultas ---
+
+    def choose_level(self, start: datetime, end: datetime, max_points: int = None,
+                     resolution_s: int = None, max_rows: int = None) -> Optional[Tuple[str, int]]:
+        """
+        Nivel mas grueso cuyo bucket no supera la resolucion pedida
+        (resolution_s o (end - start) / max_points). None => usar telemetria cruda.
+        max_rows: en cambio, el nivel mas fino con a lo sumo max_rows buckets por serie en el
+        rango (acota lo leido; el mas grueso si ninguno alcanza). Nunca None.
+        """
+        if max_rows:
+            span_s = max((end - start).total_seconds(), 0.0)
+            for level, size_s in self.levels:
+                if span_s / size_s + 1 <= max_rows:  # +1: bucket parcial en cada borde
+                    return level, size_s
+            return self.levels[-1]
+        if resolution_s is None:
+            span_s = max((end - start).total_seconds(), 0.0)
+            resolution_s = span_s / max_points if max_points else 0
+        chosen = None
+        for level, size_s in self.levels:
+            if size_s <= resolution_s:
+                chosen = (level, size_s)
+        return chosen
+
+    @staticmethod
+    def history_pipeline(farm_id: int, start: datetime, end: datetime, turbine_id: Optional[int] = None,
+                         scope: str = "turbine", after: tuple = None) -> List[dict]:
+        """
+        Orden keyset (bucket, turbine_id): total por el indice unico (turbine_id se omite si
+        es fijo). after = (bucket, turbine_id, _id) del ultimo punto ya emitido (_id no se usa).
+        """
+        match = {"scope": scope, "farm_id": farm_id, "bucket": {"$gte": start, "$lt": end}}
+        keys = ["bucket"]
+        if scope == "turbine" and turbine_id is not None:
+            match["turbine_id"] = turbine_id
+        elif scope == "turbine":
+            keys.append("turbine_id")
+        if after is not None:
+            match["bucket"]["$gte"] = max(start, after[0])
+            match.update(keyset_after(keys, list(after[:len(keys)])))
+        return [{"$match": match}, {"$sort": {k: 1 for k in keys}}]
+
+    def query_history(self, level: str, farm_id: int, start: datetime, end: datetime,
+                      turbine_id: Optional[int] = None, scope: str = "turbine",
+                      after: tuple = None) -> Iterator[dict]:
+        """Itera los puntos del nivel (ordenados por bucket, turbine_id) sin materializar la lista."""
+        col = self.mongo.get_collection(self.collection_for(level))
+        cursor = col.aggregate(self.history_pipeline(farm_id, start, end, turbine_id, scope, after))
+        for doc in cursor:
+            yield self.to_point(doc)
+
+    @staticmethod
+    def to_point(doc: dict) -> dict:
+        """Documento de rollup -> punto plano de historial (campo=promedio, campo_min, campo_max)."""
+        count = doc.get("count", 0)
+        weight = doc.get("weight", count)  # rollups previos a 'weight': una unidad por muestra
+        last = doc.get("last") or {}
+        point = {
+            "timestamp": doc["bucket"],
+            "turbine_id": doc.get("turbine_id"),
+            "count": count,
+            "operational_pct": round(doc.get("operational_count", 0) / weight * 100.0, 2) if weight else None,
+            "operational_state": last.get("operational_state"),
+        }
+        if "energy_kwh" in doc:
+            point["energy_kwh"] = doc["energy_kwh"]
+        stats = doc.get("stats", {})
+        for f in ROLLUP_FIELDS:
+            st = stats.get(f)
+            if st and st.get("n"):
+                point[f] = st["sum"] / st["n"]
+                point[f"{f}_min"] = st.get("min")
+                point[f"{f}_max"] = st.get("max")
+        return point
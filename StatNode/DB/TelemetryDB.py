@@ -1,23 +1,233 @@
 # telemetry_db.py
+import hashlib
+import os
+import struct
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from math import pi
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Tuple
 
-from pymongo.errors import PyMongoError
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 
 from Shared.MongoSingleton import MongoSingleton
-from Shared.GenericMongoClient import GenericMongoClient
+from Shared.GenericMongoClient import DUPLICATE_KEY_ERROR, GenericMongoClient
+from Shared.Logging import get_logger
+from Shared.Metrics import REGISTRY, SIZE_BUCKETS
+from StatNode.DB.RollingAggregator import RollingWindowAggregator
+from StatNode.DB.RollupManager import ROLLUP_FIELDS, RollupManager, keyset_after
 
 DEFAULT_AIR_DENSITY = 1.225  # kg/m^3
 TIMESTAMP_STR_FORMAT = "%Y-%m-%d %H:%M:%S"
+TELEMETRY_COLLECTION = "telemetry"
+
+# -- Indices que necesitan las consultas de TelemetryDB (ver query_pipelines / explain_queries.py)
+#    $match {farm_id, timestamp>=} + $sort {timestamp}  -> farm_ts_turbine_id (igualdad + rango/orden)
+#    historial keyset (timestamp, turbine_id, _id)      -> farm_ts_turbine_id
+#    consultas por turbina (historial: timestamp, _id)  -> farm_turbine_ts_id
+TELEMETRY_INDEXES = [
+    ([("farm_id", 1), ("timestamp", 1), ("turbine_id", 1), ("_id", 1)], {"name": "farm_ts_turbine_id"}),
+    ([("farm_id", 1), ("turbine_id", 1), ("timestamp", 1), ("_id", 1)], {"name": "farm_turbine_ts_id"}),
+]
+# indices anteriores (prefijos de los de arriba, ya no los usa ninguna consulta): ensure_indexes los borra
+TELEMETRY_SUPERSEDED_INDEXES = [
+    ([("farm_id", 1), ("timestamp", 1)], "farm_ts"),
+    ([("farm_id", 1), ("turbine_id", 1), ("timestamp", 1)], "farm_turbine_ts"),
+]
+
+# -- Modo de almacenamiento 'timeseries' (coleccion nativa de series temporales, MongoDB >= 5.0)
+#    Identidad farm/turbina en el metaField; se descartan los campos redundantes.
+STORAGE_MODES = ("flat", "timeseries")
+STORAGE_MODE_ENV = "TELEMETRY_STORAGE_MODE"  # default de storage_mode para ingesta, API y jobs
+TELEMETRY_TS_COLLECTION = "telemetry_ts"
+TS_META_FIELD = "meta"
+TS_GRANULARITIES = ("seconds", "minutes", "hours")
+TS_DROPPED_FIELDS = ("farm_name", "turbine_name", "timestamp_str")
+# (el desempate por _id del historial keyset se ordena en memoria: se desempaquetan buckets igual)
+TELEMETRY_TS_INDEXES = [
+    ([("meta.farm_id", 1), ("timestamp", 1)], {"name": "farm_ts"}),
+    ([("meta.farm_id", 1), ("meta.turbine_id", 1), ("timestamp", 1)], {"name": "farm_turbine_ts"}),
+]
+
+# -- Ingesta por lotes (batch_size <= 1 => un insert_one por mensaje, comportamiento original)
+DEFAULT_BATCH_SIZE = 1
+DEFAULT_FLUSH_INTERVAL_S = 1.0       # latencia maxima de un documento dentro del buffer
+DEFAULT_MAX_BUFFERED_DOCS = 50_000   # tope del buffer mientras Mongo no acepta escrituras
+FLUSH_ERROR_POLICIES = ("retry", "drop")
+
+# -- Durabilidad (ver Shared.GenericMongoClient.WRITE_PROFILES): la muestra cruda no espera al journal; los rollups
+#    (fuente del historial largo) se escriben con mayoria
+TELEMETRY_WRITE_PROFILE = "fast"
+ROLLUP_WRITE_PROFILE = "majority"
+
+log = get_logger(__name__, rate_limit=5)
+
+# -- Metricas (ver Shared.Metrics)
+DB_WRITE_SECONDS = REGISTRY.histogram("db_write_seconds", "Duracion de escrituras de telemetria en Mongo",
+                                      ("collection", "op"))
+DB_WRITE_BATCH_SIZE = REGISTRY.histogram("db_write_batch_size", "Documentos por insert_many",
+                                         ("collection",), buckets=SIZE_BUCKETS)
+DB_DOCUMENTS = REGISTRY.counter("db_documents_total", "Documentos de telemetria por resultado de escritura",
+                                ("collection", "result"))
+DB_AGGREGATION_SECONDS = REGISTRY.histogram("db_aggregation_seconds",
+                                            "Duracion del calculo de grupos por turbina (memoria o pipeline)",
+                                            ("source",))
+
+# -- Historial
+DEFAULT_HISTORY_POINTS = 500  # resolucion por defecto: (to - from) / puntos
+
+def default_storage_mode() -> str:
+    """storage_mode configurado para el proceso (TELEMETRY_STORAGE_MODE, default 'flat')."""
+    return os.environ.get(STORAGE_MODE_ENV, "flat").strip().lower() or "flat"
+
+
+def telemetry_id(doc: Dict[str, Any]) -> Optional[ObjectId]:
+    """
+    _id deterministico de una muestra: (farm, turbina, timestamp en ms, transitorio). La ingesta
+    es al menos una vez (reentregas MQTT, reintentos HTTP): la misma muestra choca por clave
+    duplicada en vez de guardarse dos veces. ObjectId con los segundos del timestamp adelante
+    (sigue ordenado por tiempo); None si falta la identidad (Mongo genera uno).
+    """
+    ts, turbine_id = doc.get("timestamp"), doc.get("turbine_id")
+    if not isinstance(ts, datetime) or turbine_id is None:
+        return None
+    ms = int(ts.timestamp() * 1000)
+    key = f"{doc.get('farm_id')}:{turbine_id}:{ms}:{doc.get('transient') or ''}".encode()
+    return ObjectId(struct.pack(">I", (ms // 1000) & 0xFFFFFFFF) + hashlib.blake2b(key, digest_size=8).digest())
+
+
+def to_timeseries_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento plano normalizado -> documento de la coleccion time-series (no modifica doc)."""
+    out = {k: v for k, v in doc.items() if k not in TS_DROPPED_FIELDS}
+    out[TS_META_FIELD] = {"farm_id": out.pop("farm_id", None), "turbine_id": out.pop("turbine_id", None)}
+    return out
+
 
 class TelemetryDB:
-    def __init__(self, mongo_client: Optional[GenericMongoClient] = None, db_name: str = "test_db"):
+    _indexes_ensured = set()  # (db_name, coleccion) ya verificados en este proceso
+
+    def __init__(self, mongo_client: Optional[GenericMongoClient] = None, db_name: str = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL_S,
+                 max_buffered_docs: int = DEFAULT_MAX_BUFFERED_DOCS, on_flush_error: str = "retry",
+                 aggregator: Optional[RollingWindowAggregator] = None, ensure_indexes: bool = True,
+                 storage_mode: str = None, ts_granularity: str = "seconds", maintain_rollups: bool = False,
+                 write_profile: str = TELEMETRY_WRITE_PROFILE, rollup_write_profile: str = ROLLUP_WRITE_PROFILE,
+                 read_profile: str = "primary"):
+        """
+        batch_size > 1 activa el modo batch: los documentos normalizados se acumulan y se
+        escriben con insert_many (unordered) al llegar a batch_size o cuando el mas viejo
+        supera flush_interval segundos.
+        on_flush_error: 'retry' vuelve a encolar los fallidos (acotado por max_buffered_docs,
+        descartando los mas viejos) | 'drop' los descarta.
+        aggregator: si se pasa, cada muestra ingerida lo alimenta y get_metrics_* se responden
+        desde memoria mientras cubra la ventana pedida (Mongo queda como fallback).
+        ensure_indexes: crea al arrancar los indices de TELEMETRY_INDEXES (una vez por proceso).
+        storage_mode: 'flat' (coleccion 'telemetry') | 'timeseries' (coleccion time-series
+        'telemetry_ts' con meta={farm_id, turbine_id}, granularidad ts_granularity). None = la
+        variable de entorno TELEMETRY_STORAGE_MODE (default 'flat'): ingesta, API y jobs leen la
+        misma coleccion sin pasarla por cada constructor.
+        maintain_rollups: actualiza los rollups 1m/1h/1d con lo que se inserta (get_history los
+        usa siempre; solo la instancia que ingiere necesita mantenerlos).
+        db_name: None = la base configurada para el proceso (MongoConnectionManager.configure).
+        write_profile / rollup_write_profile / read_profile: perfiles de GenericMongoClient para la
+        telemetria cruda y para los rollups (solo sin mongo_client: uno inyectado se usa tal cual).
+        """
         if mongo_client is None:
-            self.mongo = MongoSingleton.get_singleton_client(db_name=db_name)
+            self.mongo = MongoSingleton.get_singleton_client(db_name=db_name, write_profile=write_profile,
+                                                             read_profile=read_profile)
+            rollup_mongo = MongoSingleton.get_singleton_client(db_name=db_name, write_profile=rollup_write_profile,
+                                                               read_profile=read_profile)
         else:
-            self.mongo = mongo_client
-        
+            self.mongo = rollup_mongo = mongo_client
+
+        if storage_mode is None:
+            storage_mode = default_storage_mode()
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"storage_mode debe ser uno de {STORAGE_MODES}")
+        if ts_granularity not in TS_GRANULARITIES:
+            raise ValueError(f"ts_granularity debe ser uno de {TS_GRANULARITIES}")
+        self.storage_mode = storage_mode
+        self.ts_granularity = ts_granularity
+        if storage_mode == "timeseries":
+            self.collection_name = TELEMETRY_TS_COLLECTION
+            self._farm_field, self._turbine_field = f"{TS_META_FIELD}.farm_id", f"{TS_META_FIELD}.turbine_id"
+            self._ensure_timeseries_collection()
+        else:
+            self.collection_name = TELEMETRY_COLLECTION
+            self._farm_field, self._turbine_field = "farm_id", "turbine_id"
+
+        if on_flush_error not in FLUSH_ERROR_POLICIES:
+            raise ValueError(f"on_flush_error debe ser uno de {FLUSH_ERROR_POLICIES}")
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.max_buffered_docs = max_buffered_docs
+        self.on_flush_error = on_flush_error
+        self.aggregator = aggregator
+        self.rollups = RollupManager(rollup_mongo)
+        self.maintain_rollups = maintain_rollups
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._on_persisted: Dict[int, Callable[[], None]] = {}  # id(doc en buffer) -> callback
+        self._buffer_since: Optional[float] = None  # monotonic del doc mas viejo en buffer
+        self._retry_after = 0.0                     # backoff tras un flush fallido
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flush_thread = None
+        self.dropped_docs = 0
+
+        # hijos de las metricas resueltos una vez (labels fijos por instancia)
+        col = self.collection_name
+        self._m_insert_one = DB_WRITE_SECONDS.labels(col, "insert_one")
+        self._m_insert_many = DB_WRITE_SECONDS.labels(col, "insert_many")
+        self._m_batch_size = DB_WRITE_BATCH_SIZE.labels(col)
+        self._m_inserted = DB_DOCUMENTS.labels(col, "inserted")
+        self._m_failed = DB_DOCUMENTS.labels(col, "failed")
+        self._m_dropped = DB_DOCUMENTS.labels(col, "dropped")
+        self._m_duplicate = DB_DOCUMENTS.labels(col, "duplicate")
+
+        if ensure_indexes:
+            self.ensure_indexes()
+
+        if self.batch_size > 1:
+            self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flush_thread.start()
+
+    def _ensure_timeseries_collection(self):
+        self.mongo.create_collection(self.collection_name, timeseries={
+            "timeField": "timestamp",
+            "metaField": TS_META_FIELD,
+            "granularity": self.ts_granularity,
+        })
+
+    def ensure_indexes(self):
+        """Crea los indices declarados (idempotente: create_index no hace nada si ya existen)."""
+        key = (self.mongo.db_name, self.collection_name)
+        if key in TelemetryDB._indexes_ensured:
+            return
+        indexes = TELEMETRY_TS_INDEXES if self.storage_mode == "timeseries" else TELEMETRY_INDEXES
+        for keys, options in indexes:
+            self.mongo.create_index(self.collection_name, keys, **options)
+        if self.storage_mode == "flat":
+            # despues de crear los nuevos: las consultas nunca quedan sin indice
+            try:
+                dropped = self.mongo.drop_superseded_indexes(self.collection_name, TELEMETRY_SUPERSEDED_INDEXES)
+                if dropped:
+                    log.info("Indices reemplazados borrados en '%s': %s", self.collection_name, dropped)
+            except PyMongoError as e:
+                log.warning("No se pudieron borrar los indices reemplazados en '%s': %s", self.collection_name, e)
+        TelemetryDB._indexes_ensured.add(key)
+        log.info("Indices verificados en '%s': %s", self.collection_name, [opts["name"] for _, opts in indexes])
+
+    def _storage_document(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.storage_mode == "timeseries":
+            # sin indices unicos en time-series: las reentregas quedan duplicadas
+            return to_timeseries_document(payload)
+        if "_id" not in payload:
+            oid = telemetry_id(payload)
+            if oid is not None:
+                payload["_id"] = oid  # queda en el payload: los reintentos usan el mismo
+        return payload
 
     def _ensure_numeric_fields(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -60,10 +270,19 @@ class TelemetryDB:
         - Interpreta incoming timestamp string como hora LOCAL del productor,
         lo convierte a UTC (timezone-aware) y lo guarda en payload['timestamp'].
         - Conserva payload['timestamp_str'] con la forma legible original.
+        - Numerico (formatos compactos): epoch en milisegundos UTC; sin timestamp_str.
         - Si no puede parsear, usa ahora en UTC.
         """
         ts = payload.get("timestamp")
 
+        # camino rapido: epoch ms no necesita zona local ni strptime
+        if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+            try:
+                payload["timestamp"] = datetime.fromtimestamp(ts / 1000.0, tz=timezone.utc)
+            except (OverflowError, OSError, ValueError):
+                payload["timestamp"] = datetime.now(timezone.utc)
+            return payload
+
         # Detectar zona local (del host donde corre este código)
         local_tz = datetime.now().astimezone().tzinfo
 
@@ -97,9 +316,7 @@ class TelemetryDB:
 
         return payload
 
-    def insert_telemetry(self, payload: Dict[str, Any]):
-        collection_name = "telemetry"
-
+    def _normalize_telemetry(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         # normalizar timestamp y campos numericos
         payload = self._ensure_timestamp(payload)
         payload = self._ensure_numeric_fields(payload)
@@ -115,13 +332,223 @@ class TelemetryDB:
                 payload["turbine_id"] = int(payload["turbine_id"])
             except Exception:
                 pass
+        return payload
+
+    def insert_telemetry(self, payload: Dict[str, Any],
+                         on_persisted: Callable[[], None] = None) -> Dict[str, Any]:
+        """
+        Normaliza e inserta (o encola, en modo batch). Devuelve el documento normalizado.
+        on_persisted: se llama cuando el documento ya no depende de este proceso: escrito (o
+        duplicado) en Mongo, o descartado por on_flush_error='drop' / buffer lleno. No se llama
+        mientras espera en el buffer o en reintento (p.ej. para confirmar el mensaje MQTT recien ahi).
+        """
+        payload = self._normalize_telemetry(payload)
+        if self.aggregator is not None:
+            self.aggregator.add(payload)
+
+        if self.batch_size <= 1:
+            started = time.perf_counter()
+            try:
+                inserted_id = self.mongo.insert_one(self.collection_name, self._storage_document(payload))
+            except DuplicateKeyError:
+                # reentrega de una muestra ya guardada: confirmarla sin volver a contarla
+                self._m_insert_one.observe(time.perf_counter() - started)
+                self._m_duplicate.inc()
+                if on_persisted is not None:
+                    on_persisted()
+                return payload
+            self._m_insert_one.observe(time.perf_counter() - started)
+            self._m_inserted.inc()
+            log.debug("Insertado _id=%s - farm_id=%s turbine_id=%s",
+                      inserted_id, payload.get("farm_id"), payload.get("turbine_id"))
+            if self.maintain_rollups:
+                self.rollups.ingest([payload])
+            if on_persisted is not None:
+                on_persisted()
+            return payload
+
+        with self._lock:
+            if not self._buffer:
+                self._buffer_since = time.monotonic()
+            self._buffer.append(payload)
+            if on_persisted is not None:
+                self._on_persisted[id(payload)] = on_persisted
+            full = len(self._buffer) >= self.batch_size and time.monotonic() >= self._retry_after
+        if full:
+            self.flush()
+        return payload
+
+    # --- Modo batch ---
+
+    def flush(self) -> int:
+        """Escribe lo acumulado con un insert_many unordered. Devuelve cuantos se insertaron."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+            self._buffer_since = None
+        if not batch:
+            return 0
 
-        inserted_id = self.mongo.insert_one(collection_name, payload)
-        print(f"--- [TelemetryDB] Insertado _id={inserted_id} - farm_id={payload.get('farm_id')} "
-            f"turbine_id={payload.get('turbine_id')} ---\n")
+        failed_idx = retry_idx = set()
+        self._m_batch_size.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            self.mongo.insert_many(self.collection_name, [self._storage_document(d) for d in batch], ordered=False)
+        except BulkWriteError as e:
+            # unordered: solo fallan los indices reportados
+            failed_idx = {err["index"] for err in e.details.get("writeErrors", [])}
+            retry_idx = self._handle_failed(batch, e.details.get("writeErrors", []))
+        except PyMongoError:
+            failed_idx = retry_idx = set(range(len(batch)))
+            self._handle_failed(batch)
+        self._m_insert_many.observe(time.perf_counter() - started)
+        inserted = len(batch) - len(failed_idx)
+        self._m_inserted.inc(inserted)
+        self._m_duplicate.inc(len(failed_idx) - len(retry_idx))
+        self._m_failed.inc(len(retry_idx))
+        if self._on_persisted:
+            # lo que vuelve al buffer para reintento se confirma cuando entre (o se descarte)
+            self._settle(d for i, d in enumerate(batch) if i not in retry_idx or self.on_flush_error == "drop")
+
+        if self.maintain_rollups and inserted:
+            # solo lo insertado en este intento (los reintentos se agregan cuando entren)
+            self.rollups.ingest([d for i, d in enumerate(batch) if i not in failed_idx])
+
+        log.debug("Batch insertado: %s/%s documentos", inserted, len(batch))
+        return inserted
+
+    def _settle(self, docs: Iterable[Dict[str, Any]]):
+        for doc in docs:
+            callback = self._on_persisted.pop(id(doc), None)
+            if callback is not None:
+                callback()
+
+    def _handle_failed(self, batch: List[Dict[str, Any]], errors: List[dict] = None) -> set:
+        """
+        Reencola (o descarta) lo que fallo de batch; errors: writeErrors de un BulkWriteError
+        (None = fallo todo el lote). Una clave duplicada ya esta persistida (reintento tras un
+        fallo parcial o reentrega MQTT con el mismo _id): no se reintenta ni se cuenta como
+        fallida. Devuelve los indices de batch que no quedaron persistidos.
+        """
+        if errors is None:
+            retry_idx = set(range(len(batch)))
+        else:
+            retry_idx = {err["index"] for err in errors if err.get("code") != DUPLICATE_KEY_ERROR}
+        failed = [batch[i] for i in sorted(retry_idx)]
+        if not failed:
+            return retry_idx
+        evicted = []
+        with self._lock:
+            self._retry_after = time.monotonic() + self.flush_interval
+            if self.on_flush_error == "drop":
+                self.dropped_docs += len(failed)
+                self._m_dropped.inc(len(failed))
+                log.warning("Descartados %s documentos (on_flush_error=drop)", len(failed))
+                return retry_idx
+            # retry: los fallidos vuelven al frente del buffer, respetando el tope
+            self._buffer = failed + self._buffer
+            overflow = len(self._buffer) - self.max_buffered_docs
+            if overflow > 0:
+                evicted = self._buffer[:overflow]
+                del self._buffer[:overflow]
+                self.dropped_docs += overflow
+                self._m_dropped.inc(overflow)
+                log.warning("Buffer lleno, descartados %s documentos viejos", overflow)
+            if self._buffer_since is None:
+                self._buffer_since = time.monotonic()
+        if evicted and self._on_persisted:
+            self._settle(evicted)
+        return retry_idx
+
+    def _flush_loop(self):
+        # flush por antiguedad: ningun documento espera mas de flush_interval
+        while not self._stop_event.wait(self.flush_interval / 2):
+            with self._lock:
+                since = self._buffer_since
+            now = time.monotonic()
+            if since is not None and now - since >= self.flush_interval and now >= self._retry_after:
+                self.flush()
+
+    def close(self):
+        """Detiene el hilo de flush y escribe lo pendiente."""
+        self._stop_event.set()
+        if self._flush_thread:
+            self._flush_thread.join()
+        self.flush()
+
+    # --- Ingesta de lotes externos (HTTP) ---
+
+    @staticmethod
+    def _validate_telemetry(payload: Dict[str, Any], farm_id: Optional[int]) -> Optional[str]:
+        """Valida un documento ya normalizado. Devuelve el motivo del rechazo o None."""
+        if not isinstance(payload.get("turbine_id"), int):
+            return "turbine_id ausente o no entero"
+        if not isinstance(payload.get("farm_id"), int):
+            return "farm_id ausente o no entero"
+        if farm_id is not None and payload["farm_id"] != farm_id:
+            return f"farm_id {payload['farm_id']} no coincide con {farm_id}"
+        return None
+
+    def insert_telemetry_batch(self, items: List[Any], farm_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Normaliza, valida y escribe un lote completo con un solo insert_many unordered
+        (sin pasar por el buffer: el llamador espera el resultado).
+        farm_id: farm del lote; se asigna a los items que no lo traen y se rechazan los que difieren.
+        Devuelve un estado por item, en el mismo orden:
+            {"index": i, "status": "ok" | "duplicate" | "invalid" | "error"[, "error": motivo]}
+        """
+        results: List[Dict[str, Any]] = [{"index": i, "status": "ok"} for i in range(len(items))]
+        valid: List[Dict[str, Any]] = []
+        valid_idx: List[int] = []
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[i].update(status="invalid", error="se esperaba un objeto JSON")
+                continue
+            if farm_id is not None:
+                item.setdefault("farm_id", farm_id)
+            payload = self._normalize_telemetry(item)
+            reason = self._validate_telemetry(payload, farm_id)
+            if reason:
+                results[i].update(status="invalid", error=reason)
+                continue
+            valid.append(payload)
+            valid_idx.append(i)
+
+        if not valid:
+            return results
+
+        failed, duplicates = set(), 0
+        self._m_batch_size.observe(len(valid))
+        started = time.perf_counter()
+        try:
+            self.mongo.insert_many(self.collection_name, [self._storage_document(d) for d in valid], ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                res = results[valid_idx[err["index"]]]
+                if err.get("code") == DUPLICATE_KEY_ERROR:
+                    res["status"] = "duplicate"  # ya persistido (reintento del emisor)
+                    duplicates += 1
+                else:
+                    res.update(status="error", error=err.get("errmsg", "write error"))
+                failed.add(err["index"])
+        except PyMongoError as e:
+            self._m_insert_many.observe(time.perf_counter() - started)
+            self._m_failed.inc(len(valid))
+            for i in valid_idx:
+                results[i].update(status="error", error=str(e))
+            return results
+        self._m_insert_many.observe(time.perf_counter() - started)
+
+        inserted = [d for j, d in enumerate(valid) if j not in failed]
+        self._m_inserted.inc(len(inserted))
+        self._m_duplicate.inc(duplicates)
+        self._m_failed.inc(len(failed) - duplicates)
+        if self.aggregator is not None:
+            for d in inserted:
+                self.aggregator.add(d)
+        if self.maintain_rollups and inserted:
+            self.rollups.ingest(inserted)
+        return results
 
-        
-    
     @staticmethod
     def _compute_energy_kwh(sum_power_kw: float, count: int, window_minutes: int) -> float:
         if not count:
@@ -129,6 +556,18 @@ class TelemetryDB:
         delta_h = window_minutes / (count * 60.0)
         return float(sum_power_kw) * delta_h
 
+    @classmethod
+    def _group_energy_kwh(cls, group: dict, window_minutes: int) -> float:
+        """
+        Energia de un grupo por turbina: la integrada en la turbina por los resumenes (energy_kwh)
+        mas la estimada con las muestras crudas sobre el resto de la ventana.
+        """
+        raw_count = int(group.get("raw_samples", group.get("sample_count", 0)))
+        raw_minutes = max(window_minutes - (group.get("covered_s") or 0.0) / 60.0, 0.0)
+        raw_kwh = cls._compute_energy_kwh(sum_power_kw=group.get("sum_power_kw") or 0.0, count=raw_count,
+                                          window_minutes=raw_minutes)
+        return float(group.get("energy_kwh") or 0.0) + raw_kwh
+
     @staticmethod
     def _compute_availability(active_count: int, count: int) -> Optional[float]:
         if not count:
@@ -158,43 +597,97 @@ class TelemetryDB:
         - availability_pct (samples operational / total samples) * 100
         - avg_power_coefficient_cp (Cp calculado con avg_power & avg_wind)
         """
+        groups = self._turbine_groups(farm_id=farm_id, minutes=minutes)
+        return self._turbine_metrics_from_groups(groups, minutes=minutes, rotor_radius_m=rotor_radius_m)
+
+    def _turbine_groups(self, farm_id: int, minutes: int) -> List[dict]:
+        """
+        Documentos agrupados por turbina para la ventana (ver _turbine_groups_pipeline).
+        Usa el agregador en memoria si cubre la ventana; si no, el pipeline en Mongo.
+        """
+        if self.aggregator is not None:
+            started = time.perf_counter()
+            groups = self.aggregator.turbine_groups(farm_id, minutes)
+            if groups is not None:
+                DB_AGGREGATION_SECONDS.labels("memory").observe(time.perf_counter() - started)
+                return groups
+
         since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
 
+        try:
+            col = self.mongo.get_collection(self.collection_name)
+            with DB_AGGREGATION_SECONDS.labels("mongo").time():
+                return list(col.aggregate(self._turbine_groups_pipeline(farm_id, since)))
+        except PyMongoError:
+            raise
+
+    def _turbine_groups_pipeline(self, farm_id: int, since: datetime) -> List[dict]:
         # Pipeline: match por farm y ventana; ordenar por timestamp para usar $last; agrupar por turbine
-        pipeline = [
-            {"$match": {"farm_id": farm_id, "timestamp": {"$gte": since}}},
+        # (en modo timeseries farm_id/turbine_id viven en el metaField)
+        # Resumenes de la turbina (modo summary): traen energy_kwh y pesan window_s segundos;
+        # las muestras crudas pesan 1 y su energia se estima con sum_power_kw. Transitorios fuera.
+        summary = {"$isNumber": "$energy_kwh"}
+        weight = {"$ifNull": ["$window_s", 1]}
+        return [
+            {"$match": {self._farm_field: farm_id, "timestamp": {"$gte": since}, "transient": {"$exists": False}}},
             {"$sort": {"timestamp": 1}},  # necesario para $last funcione como "último" en la ventana
             {"$group": {
-                "_id": "$turbine_id",
+                "_id": f"${self._turbine_field}",
                 "avg_wind": {"$avg": "$wind_speed_mps"},
                 "avg_power_kw": {"$avg": "$active_power_kw"},
-                "sum_power_kw": {"$sum": "$active_power_kw"},
+                "sum_power_kw": {"$sum": {"$cond": [summary, 0, "$active_power_kw"]}},
                 "sample_count": {"$sum": 1},
-                "active_samples": {"$sum": {"$cond": [{"$eq": ["$operational_state", "operational"]}, 1, 0]}},
+                "raw_samples": {"$sum": {"$cond": [summary, 0, 1]}},
+                "weight": {"$sum": weight},
+                "active_samples": {"$sum": {"$multiply": [weight, {"$ifNull": [
+                    "$active_fraction",
+                    {"$cond": [{"$eq": ["$operational_state", "operational"]}, 1, 0]}
+                ]}]}},
+                "energy_kwh": {"$sum": "$energy_kwh"},
+                "covered_s": {"$sum": {"$cond": [summary, weight, 0]}},
                 "last_state": {"$last": "$operational_state"},
                 "avg_capacity_mw": {"$avg": "$capacity_mw"}  # si existe
             }},
             {"$sort": {"_id": 1}}
         ]
 
-        try:
-            col = self.mongo.get_collection("telemetry")
-            cursor = list(col.aggregate(pipeline))
-        except PyMongoError:
-            raise
+    def query_pipelines(self, farm_id: int, minutes: int = 5) -> Dict[str, tuple]:
+        """
+        Pipelines que TelemetryDB ejecuta contra Mongo: {nombre: (coleccion, pipeline)}.
+        Los usa explain_queries.py para verificar que ninguno haga COLLSCAN.
+        """
+        now = datetime.now(timezone.utc)
+        since = now - timedelta(minutes=minutes)
+        rollup_1m = self.rollups.collection_for(self.rollups.levels[0][0])
+        return {
+            "turbine_groups": (self.collection_name, self._turbine_groups_pipeline(farm_id, since)),
+            "raw_history_turbine": (self.collection_name, self._raw_history_pipeline(farm_id, since, now, turbine_id=1)),
+            "raw_history_farm": (self.collection_name, self._raw_history_pipeline(farm_id, since, now)),
+            "raw_history_farm_page": (self.collection_name,
+                                      self._raw_history_pipeline(farm_id, since, now, after=(since, 1, ObjectId()))),
+            "rollup_history_turbine": (rollup_1m, RollupManager.history_pipeline(farm_id, since, now, turbine_id=1)),
+            "rollup_history_farm": (rollup_1m, RollupManager.history_pipeline(farm_id, since, now, scope="farm")),
+            "rollup_history_page": (rollup_1m, RollupManager.history_pipeline(farm_id, since, now, after=(since, 1, None))),
+            "bucketed_window": (self.collection_name,
+                                self._bucketed_pipeline(farm_id, since, now, 60, ROLLUP_FIELDS)),
+            "rollup_backfill": (self.collection_name,
+                                RollupManager.backfill_pipeline(60, farm_id, since, now, "turbine",
+                                                                self._farm_field, self._turbine_field)),
+        }
 
+    def _turbine_metrics_from_groups(self, groups: List[dict], minutes: int,
+                                     rotor_radius_m: Optional[float]) -> Dict[int, dict]:
         out: Dict[int, dict] = {}
-        for doc in cursor:
+        for doc in groups:
             tid = doc["_id"]
             avg_wind = doc.get("avg_wind")
             avg_power = doc.get("avg_power_kw")
-            sum_power = doc.get("sum_power_kw") or 0.0
-            sample_count = int(doc.get("sample_count", 0))
-            active_samples = int(doc.get("active_samples", 0))
+            weight = float(doc.get("weight", doc.get("sample_count", 0)))
+            active_samples = float(doc.get("active_samples", 0))
             avg_capacity_mw = doc.get("avg_capacity_mw")  # puede ser None
 
-            # energy_kwh: usar helper (usa sum_power en kW y sample_count para estimar intervalo)
-            energy_kwh = self._compute_energy_kwh(sum_power_kw=sum_power, count=sample_count, window_minutes=minutes)
+            # energy_kwh: la de los resumenes + estimada con las muestras crudas (ver _group_energy_kwh)
+            energy_kwh = self._group_energy_kwh(doc, minutes)
 
             # capacity factor: energy / (capacity_kw * window_hours) * 100
             if avg_capacity_mw:
@@ -208,8 +701,8 @@ class TelemetryDB:
                 capacity_factor_pct = None
 
             availability_pct = None
-            if sample_count > 0:
-                availability_pct = round((active_samples / sample_count) * 100.0, 2)
+            if weight > 0:
+                availability_pct = round((active_samples / weight) * 100.0, 2)
 
             cp_avg = self._compute_cp(p_avg_kw=avg_power, v_avg=avg_wind, rotor_radius_m=rotor_radius_m)
 
@@ -225,6 +718,19 @@ class TelemetryDB:
         return out
 
 
+    def get_metrics(self, farm_id: int, minutes: int = 5,
+                    rotor_radius_m: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Métricas por turbina y del farm en UNA sola pasada sobre la ventana:
+        un único pipeline (o el agregador en memoria) da los grupos por turbina y las
+        métricas farm-level se derivan de esos grupos en Python.
+        Devuelve {"turbine_metrics": {...}, "farm_metrics": {...}}.
+        """
+        groups = self._turbine_groups(farm_id=farm_id, minutes=minutes)
+        per_turbine = self._turbine_metrics_from_groups(groups, minutes=minutes, rotor_radius_m=rotor_radius_m)
+        farm = self._farm_metrics_from_totals(self._farm_totals_from_groups(groups, minutes), per_turbine, minutes)
+        return {"turbine_metrics": per_turbine, "farm_metrics": farm}
+
     def get_metrics_farm(self, farm_id: int, minutes: int = 5,
                                 rotor_radius_m: Optional[float] = None) -> Dict[str, Any]:
         """
@@ -235,46 +741,34 @@ class TelemetryDB:
         - farm_capacity_factor_pct (total energy / total_capacity *100) (si capacity_mw existe)
         - farm_availability_pct (percent of turbines whose last_state == 'operational')
         - farm_cp_weighted (Cp promedio ponderado por energy)
+        Si se necesitan también las métricas por turbina, usar get_metrics().
         """
-        since = datetime.now(timezone.utc) - timedelta(minutes=minutes)
+        return self.get_metrics(farm_id=farm_id, minutes=minutes, rotor_radius_m=rotor_radius_m)["farm_metrics"]
 
-        # Pipeline en dos etapas: primero agrupar por turbine para obtener sum/count/last_state/avg capacity,
-        # luego agrupar todo para farm-level aggregations.
-        pipeline = [
-            {"$match": {"farm_id": farm_id, "timestamp": {"$gte": since}}},
-            {"$sort": {"timestamp": 1}},
-            {"$group": {
-                "_id": "$turbine_id",
-                "avg_wind": {"$avg": "$wind_speed_mps"},
-                "avg_power_kw": {"$avg": "$active_power_kw"},
-                "sum_power_kw": {"$sum": "$active_power_kw"},
-                "sample_count": {"$sum": 1},
-                "active_samples": {"$sum": {"$cond": [{"$eq": ["$operational_state", "operational"]}, 1, 0]}},
-                "last_state": {"$last": "$operational_state"},
-                "avg_capacity_mw": {"$avg": "$capacity_mw"}
-            }},
-            # Segundo group: sumar/contar a nivel farm
-            {"$group": {
-                "_id": None,
-                "avg_wind_farm": {"$avg": "$avg_wind"},
-                "avg_power_kw_farm": {"$avg": "$avg_power_kw"},
-                "sum_power_kw_farm": {"$sum": "$sum_power_kw"},
-                "total_samples": {"$sum": "$sample_count"},
-                "total_active_samples": {"$sum": "$active_samples"},
-                "turbine_count": {"$sum": 1},
-                "turbines_operational_now": {"$sum": {"$cond": [{"$eq": ["$last_state", "operational"]}, 1, 0]}},
-                "total_capacity_mw": {"$sum": {"$ifNull": ["$avg_capacity_mw", 0]}},
-                # Also pass arrays of (avg_cp_estimate * energy) if needed later — but we cannot compute Cp here easily
-            }}
-        ]
-
-        try:
-            col = self.mongo.get_collection("telemetry")
-            res = list(col.aggregate(pipeline))
-        except PyMongoError:
-            raise
+    @classmethod
+    def _farm_totals_from_groups(cls, groups: List[dict], minutes: int) -> Optional[dict]:
+        """
+        Totales farm-level a partir de los grupos por turbina (equivale a un segundo $group:
+        promedio de promedios por turbina, sumas de muestras/energia, turbinas operativas ahora).
+        """
+        if not groups:
+            return None
+        winds = [g["avg_wind"] for g in groups if g.get("avg_wind") is not None]
+        powers = [g["avg_power_kw"] for g in groups if g.get("avg_power_kw") is not None]
+        return {
+            "avg_wind_farm": sum(winds) / len(winds) if winds else None,
+            "avg_power_kw_farm": sum(powers) / len(powers) if powers else None,
+            "total_energy_kwh": sum(cls._group_energy_kwh(g, minutes) for g in groups),
+            "total_samples": sum(g.get("sample_count", 0) for g in groups),
+            "total_active_samples": sum(g.get("active_samples", 0) for g in groups),
+            "turbine_count": len(groups),
+            "turbines_operational_now": sum(1 for g in groups if g.get("last_state") == "operational"),
+            "total_capacity_mw": sum(g.get("avg_capacity_mw") or 0 for g in groups),
+        }
 
-        if not res:
+    def _farm_metrics_from_totals(self, doc: Optional[dict], per_turbine: Dict[int, dict],
+                                  minutes: int) -> Dict[str, Any]:
+        if not doc:
             return {
                 "avg_wind_speed_mps": None,
                 "total_energy_kwh": 0.0,
@@ -284,23 +778,13 @@ class TelemetryDB:
                 "farm_cp_weighted": None
             }
 
-        doc = res[0]
         avg_wind_farm = doc.get("avg_wind_farm")
         avg_power_kw_farm = doc.get("avg_power_kw_farm")
-        sum_power_kw_farm = doc.get("sum_power_kw_farm") or 0.0
-        total_samples = int(doc.get("total_samples", 0))
-        total_active_samples = int(doc.get("total_active_samples", 0))
+        total_energy_kwh = float(doc.get("total_energy_kwh") or 0.0)
         turbine_count = int(doc.get("turbine_count", 0))
         turbines_operational_now = int(doc.get("turbines_operational_now", 0))
         total_capacity_mw = float(doc.get("total_capacity_mw") or 0.0)
 
-        # total energy (kWh) aproximado para el farm usando la suma de potencia de muestras
-        # energy_kwh = sum_power_kw_farm * (window_minutes / (total_samples * 60))  -- solo si total_samples>0
-        if total_samples > 0:
-            total_energy_kwh = self._compute_energy_kwh(sum_power_kw=sum_power_kw_farm, count=total_samples, window_minutes=minutes)
-        else:
-            total_energy_kwh = 0.0
-
         # farm capacity factor: total_energy_kwh / (total_capacity_kw * window_hours) * 100
         if total_capacity_mw and total_energy_kwh > 0:
             total_capacity_kw = total_capacity_mw * 1000.0
@@ -315,8 +799,6 @@ class TelemetryDB:
         if turbine_count > 0:
             farm_availability_pct = round((turbines_operational_now / turbine_count) * 100.0, 2)
 
-        # avg cp weighted: to compute properly we need per-turbine avg_power & avg_wind -> get with get_metrics_per_turbine_plus
-        per_turbine = self.get_metrics_per_turbine(farm_id=farm_id, minutes=minutes, rotor_radius_m=rotor_radius_m)
         # compute cp weighted by turbine energy
         weighted_num = 0.0
         weighted_den = 0.0
@@ -341,3 +823,104 @@ class TelemetryDB:
 
         return result
 
+    # --- Historial ---
+
+    def get_history(self, farm_id: int, start: datetime, end: datetime, turbine_id: Optional[int] = None,
+                    max_points: int = DEFAULT_HISTORY_POINTS, resolution_s: Optional[int] = None,
+                    scope: str = "turbine", max_rows: Optional[int] = None,
+                    after: Optional[tuple] = None) -> Tuple[str, Iterator[dict]]:
+        """
+        Historial en [start, end) con la resolucion pedida (resolution_s o rango / max_points).
+        Elige automaticamente el rollup mas grueso que la satisface; si ninguno alcanza
+        (resolucion < 1 min) usa la telemetria cruda.
+        max_rows: en cambio, el rollup mas fino con a lo sumo max_rows puntos por serie (acota
+        lo leido; nunca la telemetria cruda).
+        scope='turbine' (una turbina o todas si turbine_id es None) | 'farm' (serie del parque).
+        Puntos en orden keyset (timestamp, turbine_id, _id); after = esa tupla del ultimo punto
+        emitido retoma justo despues (paginacion: los rollups no tienen '_id' en el punto).
+        Devuelve (resolucion usada: '1m' | '1h' | '1d' | 'raw', iterador de puntos).
+        """
+        level = self.rollups.choose_level(start, end, max_points=max_points, resolution_s=resolution_s,
+                                          max_rows=max_rows)
+        if level is None and scope == "farm":
+            level = self.rollups.levels[0]  # no hay serie cruda por farm: usar el rollup mas fino
+        if level is not None:
+            name = level[0]
+            return name, self.rollups.query_history(name, farm_id, start, end, turbine_id=turbine_id,
+                                                    scope=scope, after=after)
+        return "raw", self._raw_history(farm_id, start, end, turbine_id, after)
+
+    def backfill_rollups(self, farm_id: int, start: datetime, end: datetime,
+                         levels: Optional[List[Tuple[str, int]]] = None) -> int:
+        """Reconstruye los rollups de [start, end) desde la coleccion cruda (ver RollupManager.backfill)."""
+        return self.rollups.backfill(self.collection_name, farm_id, start, end, farm_field=self._farm_field,
+                                     turbine_field=self._turbine_field, levels=levels)
+
+    def _raw_history_pipeline(self, farm_id: int, start: datetime, end: datetime,
+                              turbine_id: Optional[int] = None, after: Optional[tuple] = None) -> List[dict]:
+        # orden keyset total (timestamp, turbine_id, _id): muestras duplicadas comparten timestamp
+        # (turbine_id se omite si es fijo)
+        match = {self._farm_field: farm_id, "timestamp": {"$gte": start, "$lt": end}}
+        if turbine_id is not None:
+            match[self._turbine_field] = turbine_id
+            keys, slots = ["timestamp", "_id"], (0, 2)
+        else:
+            keys, slots = ["timestamp", self._turbine_field, "_id"], (0, 1, 2)
+        if after is not None:
+            match["timestamp"]["$gte"] = max(start, after[0])
+            match.update(keyset_after(keys, [after[i] for i in slots]))
+        project = {"timestamp": 1, "turbine_id": f"${self._turbine_field}", "operational_state": 1}
+        project.update({f: 1 for f in ROLLUP_FIELDS})
+        return [{"$match": match}, {"$sort": {k: 1 for k in keys}}, {"$project": project}]
+
+    def _bucketed_pipeline(self, farm_id: int, start: datetime, end: datetime, bucket_s: int,
+                           fields: Iterable[str]) -> List[dict]:
+        # promedio por (bucket, turbina) calculado en el servidor; bucket = epoch ms truncado
+        # (aritmetica sobre $toLong: no requiere $dateTrunc de MongoDB 5.0)
+        # Igual que _turbine_groups_pipeline: transitorios fuera y cada documento pesa window_s
+        # (resumen de turbina) o 1 (muestra cruda); como $avg, se ignoran valores no numericos
+        bucket_ms = int(bucket_s * 1000)
+        ts_ms = {"$toLong": "$timestamp"}
+        weight = {"$ifNull": ["$window_s", 1]}
+        group = {"_id": {"t": {"$subtract": [ts_ms, {"$mod": [ts_ms, bucket_ms]}]},
+                         "turbine_id": f"${self._turbine_field}"}}
+        project = {"_id": 0, "t": "$_id.t", "turbine_id": "$_id.turbine_id"}
+        for f in fields:
+            numeric = {"$isNumber": f"${f}"}
+            group[f"{f}__sum"] = {"$sum": {"$cond": [numeric, {"$multiply": [weight, f"${f}"]}, 0]}}
+            group[f"{f}__w"] = {"$sum": {"$cond": [numeric, weight, 0]}}
+            project[f] = {"$cond": [{"$gt": [f"${f}__w", 0]}, {"$divide": [f"${f}__sum", f"${f}__w"]}, None]}
+        return [
+            {"$match": {self._farm_field: farm_id, "timestamp": {"$gte": start, "$lt": end},
+                        "transient": {"$exists": False}}},
+            {"$group": group},
+            {"$project": project},
+        ]
+
+    def query_bucketed(self, farm_id: int, start: datetime, end: datetime, bucket_s: int,
+                       fields: Iterable[str]) -> Iterator[dict]:
+        """Promedios (ponderados por window_s, sin transitorios) de 'fields' por turbina y bucket de
+        bucket_s segundos: {t (epoch ms), turbine_id, campos}."""
+        col = self.mongo.get_collection(self.collection_name)
+        return col.aggregate(self._bucketed_pipeline(farm_id, start, end, bucket_s, tuple(fields)),
+                             allowDiskUse=True)
+
+    def _raw_history(self, farm_id: int, start: datetime, end: datetime,
+                     turbine_id: Optional[int], after: Optional[tuple] = None) -> Iterator[dict]:
+        # mismo formato de punto que los rollups (una muestra: promedio = min = max) + _id para el keyset
+        col = self.mongo.get_collection(self.collection_name)
+        for doc in col.aggregate(self._raw_history_pipeline(farm_id, start, end, turbine_id, after)):
+            operational = doc.get("operational_state") == "operational"
+            point = {
+                "_id": doc["_id"],
+                "timestamp": doc["timestamp"],
+                "turbine_id": doc.get("turbine_id"),
+                "count": 1,
+                "operational_pct": 100.0 if operational else 0.0,
+                "operational_state": doc.get("operational_state"),
+            }
+            for f in ROLLUP_FIELDS:
+                v = doc.get(f)
+                if v is not None:
+                    point[f] = point[f"{f}_min"] = point[f"{f}_max"] = v
+            yield point
@@ -0,0 +1,71 @@
+# Backfill de rollups (1m / 1h / 1d) desde la telemetria cruda
+"""
+Los rollups se mantienen con cada lote ingerido (TelemetryDB(maintain_rollups=True)); la
+telemetria anterior a activarlos, o ingerida por una instancia sin rollups, no esta en
+ellos y get_history devolveria huecos. Este job los reconstruye para un rango:
+
+- Por farm, nivel y tramo de BACKFILL_CHUNK_BUCKETS buckets, Mongo agrega la coleccion cruda
+  (RollupManager.backfill_pipeline: mismas reglas que la ingesta) y cada bucket resultante
+  reemplaza al existente (upsert): se puede repetir o cortar y volver a correr sin duplicar.
+- El rango se amplia a buckets enteros de cada nivel. Conviene un rango ya cerrado: un bucket
+  que recibe ingesta mientras se recalcula puede perder los incrementos de ese intervalo.
+
+Uso:
+    python -m StatNode.DB.backfill_rollups --db test_db --farms 1-10 --from 2025-10-01 --to 2025-10-25
+"""
+import argparse
+import sys
+from datetime import datetime, timezone
+
+from Shared.GenericMongoClient import DEFAULT_DB_NAME, DEFAULT_URI, GenericMongoClient
+from Shared.Logging import get_logger, setup_logging
+from StatNode.DB.RollupManager import ROLLUP_LEVELS
+from StatNode.DB.TelemetryDB import STORAGE_MODES, TelemetryDB, default_storage_mode
+from StatNode.FarmRange import parse_farms
+
+log = get_logger(__name__)
+
+
+def _parse_time(value: str) -> datetime:
+    # fromisoformat de python 3.8 no acepta el sufijo 'Z'
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+def main(argv=None) -> int:
+    level_names = [name for name, _ in ROLLUP_LEVELS]
+    parser = argparse.ArgumentParser(description="Reconstruye los rollups desde la telemetria cruda")
+    parser.add_argument("--uri", default=DEFAULT_URI)
+    parser.add_argument("--db", default=DEFAULT_DB_NAME)
+    parser.add_argument("--farms", default="1", help="lista o rangos de farms, p.ej. '1-10,12'")
+    parser.add_argument("--storage-mode", default=default_storage_mode(), choices=STORAGE_MODES)
+    parser.add_argument("--from", dest="start", required=True, help="ISO 8601 (UTC si no trae zona)")
+    parser.add_argument("--to", dest="end", default=None, help="ISO 8601 (default: ahora)")
+    parser.add_argument("--levels", default=",".join(level_names), help="subconjunto de " + ",".join(level_names))
+    args = parser.parse_args(argv)
+    try:
+        farms = parse_farms(args.farms)
+        start = _parse_time(args.start)
+        end = _parse_time(args.end) if args.end else datetime.now(timezone.utc)
+    except ValueError as e:
+        parser.error(str(e))
+    levels = [lv for lv in ROLLUP_LEVELS if lv[0] in args.levels.split(",")]
+    if not levels:
+        parser.error(f"--levels debe incluir alguno de {level_names}")
+    if end <= start:
+        parser.error("--to debe ser posterior a --from")
+    setup_logging()
+
+    mongo = GenericMongoClient(uri=args.uri, db_name=args.db)
+    mongo.connect()
+    try:
+        db = TelemetryDB(mongo_client=mongo, storage_mode=args.storage_mode)
+        total = sum(db.backfill_rollups(farm_id, start, end, levels=levels) for farm_id in farms)
+        log.info("%s buckets de rollup reconstruidos en %s farms", total, len(farms))
+    finally:
+        mongo.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
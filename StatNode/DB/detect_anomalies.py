@@ -0,0 +1,301 @@
+# Deteccion de anomalias estadisticas sobre el historial de telemetria (job batch, NumPy)
+"""
+Complementa a las reglas de umbral (StatNode.Alerts): marca turbinas que se alejan de su
+propio comportamiento o del de sus pares, p.ej. temperatura de rodamiento subiendo de a poco
+o vibracion mayor que la de turbinas con viento similar.
+
+Por farm y ventana:
+1. Mongo promedia cada variable por (turbina, bucket de bucket_s), ponderando por window_s y sin
+   muestras transitorias (TelemetryDB.query_bucketed),
+   y el job arma matrices densas tiempo x turbina (columnar, NaN donde no hubo muestras).
+2. z de pares: por bucket y rango de viento (WIND_BIN_MPS), z robusto contra la mediana y
+   el MAD de las demas turbinas; 'drift' es su EWMA (desvio persistente, no un pico).
+3. z propio: EWMA de media y varianza por turbina (todas a la vez, una iteracion por
+   bucket) sobre el residuo contra la mediana de pares, asi los cambios de viento que
+   mueven a todo el farm no cuentan; z = (residuo - media previa) / desvio previo.
+4. Se registran en 'anomalies' los puntos con z >= Z_THRESHOLD o drift >= DRIFT_THRESHOLD
+   (solo hacia arriba: en estas variables mas alto es peor), upsert por
+   (farm, turbina, variable, bucket): re-ejecutar es idempotente.
+
+Incremental: el checkpoint por farm (coleccion 'analytics_checkpoints') guarda el ultimo
+bucket procesado y el estado EWMA de cada turbina, asi cada corrida solo lee lo nuevo
+(buckets completos) y continua las medias donde quedaron. Ventanas largas se procesan en
+tramos de CHUNK_S con checkpoint despues de cada uno. Un bucket solo se procesa cuando
+cerro hace al menos allowed_lateness_s (ALLOWED_LATENESS_S por defecto): las muestras que
+llegan tarde (outbox de un publicador que reconecta, QoS 1 reenviado) todavia entran en su
+bucket; las que llegan despues de ese margen no se puntuan.
+
+numpy es requerido por este modulo.
+
+Uso:
+    python -m StatNode.DB.detect_anomalies --db test_db --farms 1-10
+    python -m StatNode.DB.detect_anomalies --farms 3 --lookback-hours 72   # primera corrida
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pymongo import UpdateOne
+
+from Shared.GenericMongoClient import DEFAULT_DB_NAME, DEFAULT_URI, GenericMongoClient
+from Shared.Logging import get_logger, setup_logging
+from StatNode.DB.TelemetryDB import STORAGE_MODES, TelemetryDB, default_storage_mode
+from StatNode.FarmRange import parse_farms
+
+ANOMALIES_COLLECTION = "anomalies"
+CHECKPOINTS_COLLECTION = "analytics_checkpoints"
+ANOMALY_FIELDS = ("bearing_temperature_c", "gear_temperature_c", "vibrations_mms")
+WIND_FIELD = "wind_speed_mps"
+
+DEFAULT_BUCKET_S = 300            # 5 min: 288 puntos por turbina y dia
+DEFAULT_LOOKBACK_H = 24           # ventana de la primera corrida (sin checkpoint)
+ALLOWED_LATENESS_S = 900          # margen para muestras tardias antes de cerrar un bucket
+CHUNK_S = 86_400                  # tramo maximo por lectura (memoria acotada)
+EWMA_HALFLIFE_S = 6 * 3600        # memoria de la media / varianza propias
+DRIFT_HALFLIFE_S = 3600           # suavizado del z de pares
+MIN_HISTORY = 12                  # buckets observados antes de puntuar el z propio
+MIN_PEERS = 5                     # turbinas por rango de viento para un z de pares
+WIND_BIN_MPS = 2.0
+MAD_SCALE = 1.4826                # MAD -> desvio para datos normales
+MIN_STD = 1e-3                    # evita z infinitos en series constantes
+Z_THRESHOLD = 4.0
+DRIFT_THRESHOLD = 2.5
+ANOMALY_INDEXES = [
+    ([("farm_id", 1), ("turbine_id", 1), ("field", 1), ("bucket", 1)], {"name": "farm_turbine_field_bucket",
+                                                                         "unique": True}),
+    ([("farm_id", 1), ("bucket", -1)], {"name": "farm_bucket"}),
+]
+
+log = get_logger(__name__)
+
+
+def to_matrix(rows: List[dict], fields=ANOMALY_FIELDS + (WIND_FIELD,)) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """Filas {t, turbine_id, campos} -> (tiempos ms, turbine_ids, {campo: matriz T x N con NaN})."""
+    t = np.fromiter((r["t"] for r in rows), dtype=np.int64, count=len(rows))
+    tid = np.fromiter((r["turbine_id"] for r in rows), dtype=np.int64, count=len(rows))
+    times, ti = np.unique(t, return_inverse=True)
+    turbines, ni = np.unique(tid, return_inverse=True)
+    out = {}
+    for f in fields:
+        m = np.full((len(times), len(turbines)), np.nan)
+        m[ti, ni] = np.fromiter((np.nan if r.get(f) is None else r[f] for r in rows), dtype=float, count=len(rows))
+        out[f] = m
+    return times, turbines, out
+
+
+class EwmaState:
+    """Media / varianza EWMA, observaciones y drift por turbina (vectores alineados con turbine_ids)."""
+
+    def __init__(self, turbine_ids: np.ndarray):
+        n = len(turbine_ids)
+        self.turbine_ids = turbine_ids
+        self.mean = np.full(n, np.nan)
+        self.var = np.zeros(n)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.drift = np.zeros(n)
+
+    @classmethod
+    def from_doc(cls, doc: Optional[dict], turbine_ids: np.ndarray) -> "EwmaState":
+        st = cls(turbine_ids)
+        if doc:
+            for i, tid in enumerate(turbine_ids.tolist()):
+                saved = doc.get(str(tid))
+                if saved:
+                    st.mean[i], st.var[i], st.count[i], st.drift[i] = saved
+        return st
+
+    def to_doc(self, previous: Optional[dict] = None) -> dict:
+        doc = dict(previous or {})  # conserva turbinas que no reportaron en este tramo
+        for i, tid in enumerate(self.turbine_ids.tolist()):
+            if self.count[i]:
+                doc[str(tid)] = [float(self.mean[i]), float(self.var[i]), int(self.count[i]), float(self.drift[i])]
+        return doc
+
+
+def self_zscores(x: np.ndarray, st: EwmaState, alpha: float) -> np.ndarray:
+    """z de cada punto contra la EWMA previa de su turbina; actualiza st. x: T x N (residuos)."""
+    z = np.full(x.shape, np.nan)
+    for k in range(x.shape[0]):
+        v = x[k]
+        seen = ~np.isnan(v)
+        first = seen & (st.count == 0)
+        ready = seen & (st.count >= MIN_HISTORY)
+        # la varianza arranca en 0: corregir el sesgo de las primeras actualizaciones
+        weight = 1.0 - (1.0 - alpha) ** np.maximum(st.count - 1, 1)
+        std = np.sqrt(np.maximum(st.var / weight, MIN_STD ** 2))
+        z[k, ready] = (v[ready] - st.mean[ready]) / std[ready]
+        # actualizacion EWMA (West): var <- (1 - a) * (var + a * d^2)
+        upd = seen & ~first
+        d = v[upd] - st.mean[upd]
+        st.mean[upd] += alpha * d
+        st.var[upd] = (1 - alpha) * (st.var[upd] + alpha * d * d)
+        st.mean[first] = v[first]
+        st.count[seen] += 1
+    return z
+
+
+def peer_zscores(x: np.ndarray, wind: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    z robusto de cada turbina contra las del mismo bucket y rango de viento, y el residuo
+    (x - mediana de pares). x, wind: T x N; NaN donde no hay pares suficientes.
+    """
+    z = np.full(x.shape, np.nan)
+    residual = np.full(x.shape, np.nan)
+    bins = np.floor(wind / WIND_BIN_MPS)
+    valid = ~np.isnan(x) & ~np.isnan(bins)
+    for b in np.unique(bins[valid]):
+        mask = valid & (bins == b)
+        peers = np.where(mask, x, np.nan)
+        enough = mask.sum(axis=1) >= MIN_PEERS
+        if not enough.any():
+            continue
+        rows = peers[enough]
+        med = np.nanmedian(rows, axis=1, keepdims=True)
+        mad = np.nanmedian(np.abs(rows - med), axis=1, keepdims=True)
+        sel = mask[enough]
+        for out, values in ((residual, rows - med), (z, (rows - med) / np.maximum(mad * MAD_SCALE, MIN_STD))):
+            block = out[enough]
+            block[sel] = values[sel]
+            out[enough] = block
+    return z, residual
+
+
+def drift_scores(zp: np.ndarray, st: EwmaState, alpha: float) -> np.ndarray:
+    """EWMA del z de pares por turbina (continua desde st.drift)."""
+    out = np.full(zp.shape, np.nan)
+    for k in range(zp.shape[0]):
+        seen = ~np.isnan(zp[k])
+        st.drift[seen] += alpha * (zp[k, seen] - st.drift[seen])
+        out[k, seen] = st.drift[seen]
+    return out
+
+
+def score_window(times: np.ndarray, turbines: np.ndarray, columns: Dict[str, np.ndarray], states: Dict[str, dict],
+                 bucket_s: int) -> Tuple[List[dict], Dict[str, dict]]:
+    """
+    Puntua una ventana ya en forma de matrices. states: {campo: doc de EwmaState} del checkpoint.
+    Devuelve (anomalias, nuevos states).
+    """
+    alpha = 1.0 - 0.5 ** (bucket_s / EWMA_HALFLIFE_S)
+    drift_alpha = 1.0 - 0.5 ** (bucket_s / DRIFT_HALFLIFE_S)
+    wind = columns[WIND_FIELD]
+    anomalies, new_states = [], {}
+    for field in ANOMALY_FIELDS:
+        x = columns[field]
+        st = EwmaState.from_doc(states.get(field), turbines)
+        zp, residual = peer_zscores(x, wind)
+        z = self_zscores(residual, st, alpha)
+        drift = drift_scores(zp, st, drift_alpha)
+        new_states[field] = st.to_doc(states.get(field))
+        with np.errstate(invalid="ignore"):
+            flagged = (z >= Z_THRESHOLD) | (drift >= DRIFT_THRESHOLD)
+        for k, n in zip(*np.nonzero(flagged)):
+            zk, dk = z[k, n], drift[k, n]
+            kinds = [name for name, hit in (("self", zk >= Z_THRESHOLD), ("peer", dk >= DRIFT_THRESHOLD)) if hit]
+            anomalies.append({
+                "turbine_id": int(turbines[n]),
+                "field": field,
+                "bucket": datetime.fromtimestamp(times[k] / 1000.0, tz=timezone.utc),
+                "value": round(float(x[k, n]), 3),
+                "z_score": None if np.isnan(zk) else round(float(zk), 2),
+                "peer_z": None if np.isnan(zp[k, n]) else round(float(zp[k, n]), 2),
+                "drift": None if np.isnan(dk) else round(float(dk), 2),
+                "score": round(float(np.nanmax([zk, dk])), 2),
+                "kind": "+".join(kinds),
+            })
+    return anomalies, new_states
+
+
+def _floor(ts: datetime, bucket_s: int) -> datetime:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % bucket_s, tz=timezone.utc)
+
+
+def run_farm(db: TelemetryDB, farm_id: int, bucket_s: int = DEFAULT_BUCKET_S,
+             lookback_h: float = DEFAULT_LOOKBACK_H, now: datetime = None,
+             allowed_lateness_s: float = ALLOWED_LATENESS_S) -> int:
+    """Procesa los buckets cerrados (y fuera del margen de atraso) desde el checkpoint del farm. Devuelve anomalias escritas."""
+    mongo = db.mongo
+    checkpoints = mongo.get_collection(CHECKPOINTS_COLLECTION)
+    job_id = f"anomalies:{db.collection_name}:{farm_id}:{bucket_s}"
+    checkpoint = checkpoints.find_one({"_id": job_id}) or {}
+    # solo buckets cerrados hace mas de allowed_lateness_s: el checkpoint no pasa por encima de muestras tardias
+    end = _floor((now or datetime.now(timezone.utc)) - timedelta(seconds=allowed_lateness_s), bucket_s)
+    start = checkpoint.get("last_bucket")
+    if start is None:
+        start = _floor(end - timedelta(hours=lookback_h), bucket_s)
+    elif start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)  # pymongo devuelve datetimes naive (UTC)
+    states = checkpoint.get("states", {})
+
+    written = 0
+    while start < end:
+        chunk_end = min(end, start + timedelta(seconds=CHUNK_S))
+        started = time.monotonic()
+        rows = list(db.query_bucketed(farm_id, start, chunk_end, bucket_s, ANOMALY_FIELDS + (WIND_FIELD,)))
+        fetched = time.monotonic()
+        anomalies = []
+        if rows:
+            times, turbines, columns = to_matrix(rows)
+            anomalies, states = score_window(times, turbines, columns, states, bucket_s)
+        if anomalies:
+            run_at = datetime.now(timezone.utc)
+            mongo.bulk_write(ANOMALIES_COLLECTION, [
+                UpdateOne({"farm_id": farm_id, "turbine_id": a["turbine_id"], "field": a["field"],
+                           "bucket": a["bucket"]},
+                          {"$set": {**a, "farm_id": farm_id, "detected_at": run_at}}, upsert=True)
+                for a in anomalies
+            ], ordered=False)
+            written += len(anomalies)
+        checkpoints.update_one({"_id": job_id}, {"$set": {"last_bucket": chunk_end, "states": states}}, upsert=True)
+        log.info("farm %s [%s, %s): %s puntos, %s anomalias (lectura %.2fs, calculo %.2fs)", farm_id,
+                 start.isoformat(), chunk_end.isoformat(), len(rows), len(anomalies),
+                 fetched - started, time.monotonic() - fetched)
+        start = chunk_end
+    return written
+
+
+def ensure_indexes(mongo: GenericMongoClient):
+    for keys, options in ANOMALY_INDEXES:
+        mongo.create_index(ANOMALIES_COLLECTION, keys, **options)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Anomalias estadisticas (EWMA / pares) sobre la telemetria")
+    parser.add_argument("--uri", default=DEFAULT_URI)
+    parser.add_argument("--db", default=DEFAULT_DB_NAME)
+    parser.add_argument("--farms", default="1", help="lista o rangos de farms, p.ej. '1-10,12'")
+    parser.add_argument("--storage-mode", default=default_storage_mode(), choices=STORAGE_MODES)
+    parser.add_argument("--bucket-s", type=int, default=DEFAULT_BUCKET_S)
+    parser.add_argument("--lookback-hours", type=float, default=DEFAULT_LOOKBACK_H,
+                        help="ventana de la primera corrida de cada farm (sin checkpoint)")
+    parser.add_argument("--allowed-lateness-s", type=float, default=ALLOWED_LATENESS_S,
+                        help="espera tras el cierre de un bucket antes de puntuarlo (muestras tardias)")
+    args = parser.parse_args(argv)
+    try:
+        farms = parse_farms(args.farms)
+    except ValueError as e:
+        parser.error(str(e))
+    setup_logging()
+
+    # lecturas pesadas a un secundario si hay replica set; resultados con mayoria
+    mongo = GenericMongoClient(uri=args.uri, db_name=args.db, read_profile="secondary_preferred",
+                               write_profile="majority")
+    mongo.connect()
+    try:
+        ensure_indexes(mongo)
+        db = TelemetryDB(mongo_client=mongo, storage_mode=args.storage_mode)
+        total = sum(run_farm(db, farm_id, bucket_s=args.bucket_s, lookback_h=args.lookback_hours,
+                             allowed_lateness_s=args.allowed_lateness_s)
+                    for farm_id in farms)
+        log.info("%s anomalias registradas en %s farms", total, len(farms))
+    finally:
+        mongo.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
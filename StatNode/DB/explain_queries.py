@@ -0,0 +1,72 @@
+# Diagnostico de planes de consulta
+"""
+Ejecuta 'explain' sobre cada pipeline de TelemetryDB (TelemetryDB.query_pipelines) y de
+AlertEngine (upsert por alert_id) y falla (exit code 1) si alguno recorre la coleccion
+completa (COLLSCAN).
+Tambien avisa si el plan ganador necesita un SORT en memoria.
+
+Uso:
+    python -m StatNode.DB.explain_queries --farm-id 1 --db test_db
+"""
+import argparse
+import sys
+
+from Shared.GenericMongoClient import GenericMongoClient
+from StatNode.Alerts import AlertEngine
+from StatNode.DB.TelemetryDB import TelemetryDB
+
+
+def _plan_stages(node, stages: list):
+    """Recolecta los 'stage' del plan ganador (ignora rejectedPlans)."""
+    if isinstance(node, dict):
+        if "stage" in node:
+            stages.append(node["stage"])
+        for key, value in node.items():
+            if key != "rejectedPlans":
+                _plan_stages(value, stages)
+    elif isinstance(node, list):
+        for item in node:
+            _plan_stages(item, stages)
+    return stages
+
+
+def explain_pipelines(db: TelemetryDB, farm_id: int, minutes: int) -> dict:
+    """Devuelve {nombre: [stages del plan ganador]} para cada pipeline declarado."""
+    out = {}
+    pipelines = {**db.query_pipelines(farm_id, minutes), **AlertEngine.query_pipelines()}
+    for name, (collection_name, pipeline) in pipelines.items():
+        plan = db.mongo.db.command("aggregate", collection_name, pipeline=pipeline,
+                                   explain=True, cursor={})
+        out[name] = _plan_stages(plan, [])
+    return out
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Verifica que las consultas de TelemetryDB usen indices")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="test_db")
+    parser.add_argument("--farm-id", type=int, default=1)
+    parser.add_argument("--minutes", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    mongo = GenericMongoClient(uri=args.uri, db_name=args.db)
+    mongo.connect()
+    db = TelemetryDB(mongo_client=mongo)  # asegura los indices antes de explicar
+    AlertEngine.ensure_indexes(mongo)
+
+    failed = False
+    for name, stages in explain_pipelines(db, args.farm_id, args.minutes).items():
+        if "COLLSCAN" in stages:
+            failed = True
+            print(f"[FAIL] {name}: COLLSCAN -> {stages}")
+        elif "SORT" in stages:
+            print(f"[WARN] {name}: sort en memoria -> {stages}")
+        else:
+            print(f"[OK]   {name}: {stages}")
+
+    mongo.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# Migracion telemetry (plana) -> telemetry_ts (time-series)
+"""
+Copia en bloque la coleccion plana 'telemetry' a la coleccion time-series que usa
+TelemetryDB(storage_mode='timeseries'), convirtiendo cada documento con
+to_timeseries_document (identidad en el metaField, sin campos redundantes).
+
+- Recorre la origen por _id (keyset) en lotes y escribe con insert_many unordered; los
+  documentos destino conservan el _id de origen.
+- Checkpoint en la coleccion 'migrations': antes de cada lote se registra su ultimo _id
+  como 'pending' y despues del insert se avanza last_id y se borra 'pending'. Si la
+  ejecucion se corto en medio, al retomar se borran del destino los documentos de ese
+  rango antes de volver a copiarlo, asi no quedan duplicados (las colecciones time-series
+  no tienen indice unico). El borrado filtra por _id: requiere MongoDB 7.0+ (borrados con
+  filtros fuera del metaField en colecciones time-series).
+
+Uso:
+    python -m StatNode.DB.migrate_timeseries --db test_db --batch-size 5000
+"""
+import argparse
+import sys
+import time
+
+from Shared.GenericMongoClient import GenericMongoClient
+from Shared.Logging import get_logger, setup_logging
+from StatNode.DB.TelemetryDB import (TELEMETRY_COLLECTION, TS_GRANULARITIES,
+                                     TelemetryDB, to_timeseries_document)
+
+MIGRATIONS_COLLECTION = "migrations"
+DEFAULT_MIGRATION_BATCH = 5000
+
+log = get_logger(__name__)
+
+
+def migrate(mongo: GenericMongoClient, source: str = TELEMETRY_COLLECTION, granularity: str = "seconds",
+            batch_size: int = DEFAULT_MIGRATION_BATCH) -> int:
+    # crea la coleccion time-series destino con sus indices
+    target_db = TelemetryDB(mongo_client=mongo, storage_mode="timeseries", ts_granularity=granularity)
+    target = target_db.collection_name
+    checkpoints = mongo.get_collection(MIGRATIONS_COLLECTION)
+    migration_id = f"{source}->{target}"
+
+    checkpoint = checkpoints.find_one({"_id": migration_id}) or {}
+    last_id = checkpoint.get("last_id")
+    copied = int(checkpoint.get("copied", 0))
+    if last_id is not None:
+        log.info("Retomando %s desde _id=%s (%s ya copiados)", migration_id, last_id, copied)
+    pending = checkpoint.get("pending")
+    if pending is not None:
+        # lote interrumpido: pudo quedar escrito en parte, se descarta y se vuelve a copiar
+        id_range = {"$lte": pending["to"]}
+        if last_id is not None:
+            id_range["$gt"] = last_id
+        deleted = mongo.get_collection(target).delete_many({"_id": id_range}).deleted_count
+        log.warning("%s: lote interrumpido (_id hasta %s), %s documentos parciales borrados",
+                    migration_id, pending["to"], deleted)
+        checkpoints.update_one({"_id": migration_id}, {"$unset": {"pending": ""}})
+
+    source_col = mongo.get_collection(source)
+    started = time.monotonic()
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(source_col.find(query).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+
+        docs = [to_timeseries_document(doc) for doc in batch
+                if doc.get("timestamp") is not None]  # timeField obligatorio
+        checkpoints.update_one({"_id": migration_id},
+                               {"$set": {"pending": {"to": batch[-1]["_id"]}}}, upsert=True)
+        mongo.insert_many(target, docs, ordered=False)
+        last_id = batch[-1]["_id"]
+        copied += len(docs)
+
+        checkpoints.update_one({"_id": migration_id},
+                               {"$set": {"last_id": last_id, "copied": copied}, "$unset": {"pending": ""}},
+                               upsert=True)
+        rate = copied / max(time.monotonic() - started, 1e-6)
+        log.info("%s documentos copiados (%.0f docs/s)", copied, rate)
+
+    log.info("%s completa: %s documentos", migration_id, copied)
+    return copied
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Migra telemetry plana a coleccion time-series")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="test_db")
+    parser.add_argument("--source", default=TELEMETRY_COLLECTION)
+    parser.add_argument("--granularity", default="seconds", choices=TS_GRANULARITIES)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_MIGRATION_BATCH)
+    args = parser.parse_args(argv)
+    setup_logging()
+
+    mongo = GenericMongoClient(uri=args.uri, db_name=args.db)
+    mongo.connect()
+    try:
+        migrate(mongo, source=args.source, granularity=args.granularity, batch_size=args.batch_size)
+    finally:
+        mongo.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
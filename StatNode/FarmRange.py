@@ -0,0 +1,22 @@
+# Rangos de farms de la linea de comandos ('1-4,7'); sin dependencias para que cualquier job lo use
+from typing import List
+
+
+def parse_farms(spec: str) -> List[int]:
+    """'1-4,7,10-11' -> [1, 2, 3, 4, 7, 10, 11] (sin repetidos, ordenados)."""
+    farms = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition("-")
+        try:
+            lo, hi = int(first), int(last) if sep else int(first)
+        except ValueError:
+            raise ValueError(f"rango de farms invalido: '{part}'")
+        if hi < lo:
+            raise ValueError(f"rango de farms invalido: '{part}'")
+        farms.update(range(lo, hi + 1))
+    if not farms:
+        raise ValueError("no se indico ningun farm")
+    return sorted(farms)
@@ -0,0 +1,347 @@
+# Supervisor multi-farm: pipelines de ingesta y publicacion repartidos en un pool de procesos
+"""
+Un solo punto de entrada (StatNode/main.py) para N farms:
+
+- Los farms se reparten entre `processes` workers (por defecto, uno por core). Cada worker
+  corre, por farm, un RawTelemetrySuscriber y un ProcessedTelemetryPublisher que comparten
+  el TelemetryDB (y su RollingWindowAggregator); todos los farms del worker comparten una
+  conexion MQTT 5 y el pool Mongo del proceso (MongoConnectionManager).
+- Sesion MQTT persistente por worker: el client id incluye un hash de los farms asignados,
+  asi un worker reiniciado con la misma asignacion retoma lo que el broker encolo (QoS 1)
+  y una asignacion distinta arranca limpia (sin suscripciones de farms que ya no le tocan).
+- Un worker que muere se reinicia con backoff exponencial; si supera max_restarts dentro de
+  restart_window_s se retira y sus farms se reparten entre los demas (el ultimo nunca se
+  retira). Un broker caido no cuenta como caida: el worker reintenta la conexion.
+- resize(n) (o SIGUSR1 / SIGUSR2 sobre el supervisor: +1 / -1 worker) rebalancea moviendo
+  la menor cantidad de farms: solo se reinician los workers cuya asignacion cambia. Un farm
+  que cambia de worker deja de ingerirse unos segundos (desuscripcion -> nueva suscripcion).
+"""
+import multiprocessing as mp
+import os
+import signal
+import socket
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Dict, List, Sequence
+
+from Shared.GenericMQTTClient import BROKER_HOST, BROKER_PORT, GenericMQTTClient
+from Shared.Logging import get_logger, setup_logging
+from Shared.Metrics import REGISTRY, serve_metrics
+from Shared.MongoConnectionManager import MongoConnectionManager
+from StatNode.Alerts.AlertEngine import AlertEngine, load_rules
+from StatNode.DB.RollingAggregator import RollingWindowAggregator
+from StatNode.MQTT.telemetry_pub import (DEADBAND_PCT, METRICS_WINDOW_MINUTES, SNAPSHOT_INTERVAL_S,
+                                         ProcessedTelemetryPublisher)
+from StatNode.MQTT.telemetry_sub import (INGEST_BATCH_SIZE, INGEST_SESSION_EXPIRY_S, INGEST_WORKERS,
+                                         STATS_LOG_INTERVAL_S, RawTelemetrySuscriber)
+
+# --- Supervision ---
+CHECK_INTERVAL_S = 1.0
+MAX_RESTARTS = 5               # reinicios tolerados por worker dentro de la ventana
+RESTART_WINDOW_S = 300
+RESTART_BACKOFF_S = 1.0        # 1, 2, 4, ... segundos
+RESTART_BACKOFF_MAX_S = 30.0
+STOP_TIMEOUT_S = 15.0          # drenaje de colas y flush antes de terminate()
+
+# opciones de cada worker (picklables: los procesos se crean con 'spawn')
+DEFAULT_OPTIONS = {
+    "broker_host": BROKER_HOST,
+    "broker_port": BROKER_PORT,
+    "mongo_uri": "mongodb://localhost:27017",
+    "db_name": "test_db",
+    "mongo_pool_size": None,   # maxPoolSize por worker (None: default de pymongo)
+    "mongo_compressors": None, # p.ej. "zstd,zlib"
+    "publish_interval": 30,
+    "window_minutes": METRICS_WINDOW_MINUTES,
+    "publish_mode": "full",
+    "deadband_pct": DEADBAND_PCT,
+    "snapshot_interval": SNAPSHOT_INTERVAL_S,
+    "ingest_workers": INGEST_WORKERS,
+    "batch_size": INGEST_BATCH_SIZE,
+    "session_expiry_s": INGEST_SESSION_EXPIRY_S,
+    "manual_ack": True,        # PUBACK recien con la telemetria escrita en Mongo
+    "alerts": True,            # motor de alertas sobre la ingesta (uno por worker)
+    "alert_rules": None,       # JSON con reglas (default: AlertEngine.DEFAULT_RULES)
+    "metrics_port": None,      # supervisor en metrics_port, worker k en metrics_port + 1 + k
+    "node_id": socket.gethostname(),
+}
+
+log = get_logger(__name__)
+
+# --- Metricas (registro del supervisor; cada worker expone el suyo) ---
+SUPERVISOR_WORKERS = REGISTRY.gauge("supervisor_workers", "Workers vivos")
+SUPERVISOR_RESTARTS = REGISTRY.counter("supervisor_worker_restarts_total", "Caidas de workers", ("slot",))
+SUPERVISOR_REBALANCES = REGISTRY.counter("supervisor_rebalances_total", "Reasignaciones de farms entre workers")
+
+
+def rebalance(current: Dict[int, List[int]], farm_ids: Sequence[int], slots: Sequence[int]) -> Dict[int, List[int]]:
+    """
+    Asignacion slot -> farms para los slots dados conservando la actual donde se pueda:
+    cada slot queda con a lo sumo ceil(farms / slots) y la diferencia entre slots es <= 1.
+    """
+    slots = sorted(slots)
+    if not slots:
+        return {}
+    farms = set(farm_ids)
+    out = {s: [f for f in current.get(s, ()) if f in farms] for s in slots}
+    placed = {f for fs in out.values() for f in fs}
+    pending = [f for f in sorted(farms) if f not in placed]
+    cap = -(-len(farms) // len(slots))
+    for s in slots:
+        while len(out[s]) > cap:
+            pending.append(out[s].pop())
+    for f in pending:
+        out[min(slots, key=lambda s: (len(out[s]), s))].append(f)
+    while True:
+        hi = max(slots, key=lambda s: len(out[s]))
+        lo = min(slots, key=lambda s: len(out[s]))
+        if len(out[hi]) - len(out[lo]) <= 1:
+            break
+        out[lo].append(out[hi].pop())
+    return {s: sorted(fs) for s, fs in out.items()}
+
+
+def worker_client_id(node_id: str, slot: int, farm_ids: Sequence[int]) -> str:
+    # misma asignacion -> mismo id (y sesion); crc32 es estable entre procesos
+    digest = zlib.crc32(",".join(str(f) for f in sorted(farm_ids)).encode("ascii"))
+    return f"StatNode-{node_id}-w{slot}-{digest:08x}"
+
+
+def run_farm_worker(slot: int, farm_ids: List[int], options: dict, stop_event, leave_event):
+    """Proceso worker: pipelines de sus farms sobre una conexion MQTT y un cliente Mongo compartidos."""
+    setup_logging()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C lo maneja el supervisor
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    opts = dict(DEFAULT_OPTIONS, **options)
+    if opts["metrics_port"]:
+        serve_metrics(opts["metrics_port"] + 1 + slot)
+
+    client_id = worker_client_id(opts["node_id"], slot, farm_ids)
+    # un pool Mongo por proceso: los TelemetryDB toman de aqui la URI y la base
+    MongoConnectionManager.configure(uri=opts["mongo_uri"], db_name=opts["db_name"],
+                                     max_pool_size=opts["mongo_pool_size"], compressors=opts["mongo_compressors"],
+                                     appname=client_id)
+    mqtt_client = GenericMQTTClient(client_id=client_id, broker_host=opts["broker_host"],
+                                    broker_port=opts["broker_port"], mqtt_v5=True, clean_session=False,
+                                    session_expiry_s=opts["session_expiry_s"], manual_ack=opts["manual_ack"])
+    alerts = None
+    if opts["alerts"]:
+        rules = load_rules(opts["alert_rules"]) if opts["alert_rules"] else None
+        alerts = AlertEngine(rules, mqtt_client=mqtt_client)
+    subs, pubs = [], []
+    for farm_id in farm_ids:
+        aggregator = RollingWindowAggregator(window_minutes=opts["window_minutes"])
+        sub = RawTelemetrySuscriber(farm_id, batch_size=opts["batch_size"], workers=opts["ingest_workers"],
+                                    aggregator=aggregator, mqtt_client=mqtt_client, alert_engine=alerts,
+                                    manual_ack=opts["manual_ack"])
+        pubs.append(ProcessedTelemetryPublisher(farm_id, publish_interval=opts["publish_interval"],
+                                                db_service=sub.db_service, window_minutes=opts["window_minutes"],
+                                                mqtt_client=mqtt_client, mode=opts["publish_mode"],
+                                                deadband_pct=opts["deadband_pct"],
+                                                snapshot_interval=opts["snapshot_interval"]))
+        subs.append(sub)
+
+    if alerts is not None:
+        alerts.start()
+    # callbacks registrados antes de conectar: la sesion retomada puede entregar apenas conecta
+    for sub in subs:
+        sub.start(block=False)
+    # broker caido no es una caida del worker: se reintenta aqui (las caidas cuentan para retirarlo)
+    delay = RESTART_BACKOFF_S
+    while True:
+        try:
+            mqtt_client.connect()
+            break
+        except OSError as e:
+            log.warning("broker %s:%s no disponible (%s): reintento en %.0fs", opts["broker_host"],
+                        opts["broker_port"], e, delay)
+            if stop_event.wait(delay):
+                for sub in subs:
+                    sub.stop(leave_group=False)
+                if alerts is not None:
+                    alerts.stop()
+                return
+            delay = min(RESTART_BACKOFF_MAX_S, delay * 2)
+    for pub in pubs:
+        pub.start(block=False)
+    log.info("worker %s: farms %s", slot, farm_ids, extra={"client_id": client_id})
+
+    while not stop_event.wait(STATS_LOG_INTERVAL_S):
+        stats = [sub.stats() for sub in subs]
+        log.info("colas de ingesta", extra={"slot": slot, "depth": sum(s["depth"] for s in stats),
+                                             "dropped": sum(s["dropped"] for s in stats)})
+
+    for pub in pubs:
+        pub.stop()
+    if leave_event.is_set():
+        # los farms pasan a otro worker: la sesion deja de acumular sus mensajes
+        for sub in subs:
+            mqtt_client.unsubscribe(sub.subscription_topic())
+    # con la conexion abierta: los PUBACK del drenaje (manual_ack) y las alertas salen antes de cerrar
+    for sub in subs:
+        sub.stop(leave_group=False)  # drena la cola y hace flush del buffer
+    if alerts is not None:
+        alerts.stop()  # publica y persiste las del drenaje
+    mqtt_client.disconnect()
+    log.info("worker %s detenido", slot)
+
+
+class _Worker:
+    def __init__(self, slot: int, farm_ids: List[int]):
+        self.slot = slot
+        self.farm_ids = farm_ids
+        self.process = None
+        self.stop_event = None
+        self.leave_event = None
+        self.failures = deque()  # instantes de caida (monotonic) dentro de la ventana
+        self.next_start = 0.0
+
+
+class FarmSupervisor:
+    def __init__(self, farm_ids: Sequence[int], processes: int = None, options: dict = None,
+                 max_restarts: int = MAX_RESTARTS, restart_window_s: float = RESTART_WINDOW_S,
+                 check_interval: float = CHECK_INTERVAL_S):
+        """
+        processes: workers (default os.cpu_count(), nunca mas que farms).
+        options: ver DEFAULT_OPTIONS (broker, Mongo, intervalo de publicacion, ...).
+        """
+        self.farm_ids = sorted(set(farm_ids))
+        if not self.farm_ids:
+            raise ValueError("farm_ids vacio")
+        self.processes = max(1, min(processes or os.cpu_count() or 1, len(self.farm_ids)))
+        self.options = dict(DEFAULT_OPTIONS, **(options or {}))
+        self.max_restarts = max_restarts
+        self.restart_window_s = restart_window_s
+        self.check_interval = check_interval
+        self._ctx = mp.get_context("spawn")  # sin heredar hilos (logging, paho) del supervisor
+        self._workers: Dict[int, _Worker] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._resize_to = None  # pedido por senal, se aplica en el loop
+        SUPERVISOR_WORKERS.set_function(self.alive)
+
+    def assignment(self) -> Dict[int, List[int]]:
+        return {slot: list(w.farm_ids) for slot, w in self._workers.items()}
+
+    def alive(self) -> int:
+        return sum(1 for w in list(self._workers.values()) if w.process is not None and w.process.is_alive())
+
+    def start(self):
+        with self._lock:
+            self._apply(rebalance({}, self.farm_ids, range(self.processes)))
+        log.info("supervisor: %s farms en %s workers", len(self.farm_ids), self.processes)
+
+    def _spawn(self, worker: _Worker):
+        worker.stop_event = self._ctx.Event()
+        worker.leave_event = self._ctx.Event()
+        worker.process = self._ctx.Process(target=run_farm_worker, name=f"statnode-w{worker.slot}",
+                                           args=(worker.slot, worker.farm_ids, self.options,
+                                                 worker.stop_event, worker.leave_event))
+        worker.process.start()
+        log.info("worker %s arrancado (pid %s): farms %s", worker.slot, worker.process.pid, worker.farm_ids)
+
+    def _stop_workers(self, workers: List[_Worker], leave: bool):
+        # aviso a todos primero: drenan en paralelo
+        for w in workers:
+            if w.process is not None:
+                if leave:
+                    w.leave_event.set()
+                w.stop_event.set()
+        deadline = time.monotonic() + STOP_TIMEOUT_S
+        for w in workers:
+            if w.process is None:
+                continue
+            w.process.join(max(0.0, deadline - time.monotonic()))
+            if w.process.is_alive():
+                log.warning("worker %s no termino en %ss: terminate()", w.slot, STOP_TIMEOUT_S)
+                w.process.terminate()
+                w.process.join()
+            w.process = None
+
+    def _apply(self, target: Dict[int, List[int]]):
+        """Lleva el pool a la asignacion target reiniciando solo los workers que cambian."""
+        changed = [self._workers[s] for s in self._workers
+                   if s not in target or self._workers[s].farm_ids != target[s]]
+        self._stop_workers(changed, leave=True)
+        for w in changed:
+            del self._workers[w.slot]
+        for slot, farm_ids in sorted(target.items()):
+            if slot not in self._workers:
+                self._workers[slot] = w = _Worker(slot, farm_ids)
+                self._spawn(w)
+
+    def resize(self, processes: int):
+        """Cambia la cantidad de workers y rebalancea los farms."""
+        processes = max(1, min(processes, len(self.farm_ids)))
+        with self._lock:
+            slots = sorted(self._workers)[:processes]
+            free = (s for s in range(len(self._workers) + processes) if s not in self._workers)
+            while len(slots) < processes:
+                slots.append(next(free))
+            target = rebalance(self.assignment(), self.farm_ids, slots)
+            if target != self.assignment():
+                SUPERVISOR_REBALANCES.inc()
+                self._apply(target)
+            self.processes = processes
+        log.info("supervisor: %s workers", processes, extra={"assignment": self.assignment()})
+
+    def check(self):
+        """Una pasada de supervision: reinicia caidos (con backoff) y retira los que no se recuperan."""
+        with self._lock:
+            now = time.monotonic()
+            retired = []
+            for w in list(self._workers.values()):
+                if w.process is None:
+                    if now >= w.next_start:
+                        self._spawn(w)
+                    continue
+                if w.process.is_alive():
+                    continue
+                exitcode = w.process.exitcode
+                w.process = None
+                SUPERVISOR_RESTARTS.labels(w.slot).inc()
+                w.failures.append(now)
+                while w.failures and now - w.failures[0] > self.restart_window_s:
+                    w.failures.popleft()
+                if len(w.failures) > self.max_restarts and len(self._workers) - len(retired) > 1:
+                    log.error("worker %s: %s caidas en %ss, se retira", w.slot, len(w.failures),
+                              self.restart_window_s, extra={"farms": w.farm_ids})
+                    retired.append(w.slot)
+                    continue
+                delay = min(RESTART_BACKOFF_MAX_S, RESTART_BACKOFF_S * 2 ** (len(w.failures) - 1))
+                w.next_start = now + delay
+                log.warning("worker %s termino (exitcode %s): reinicio en %.0fs", w.slot, exitcode, delay)
+
+            if retired:
+                for slot in retired:
+                    del self._workers[slot]
+                SUPERVISOR_REBALANCES.inc()
+                self._apply(rebalance(self.assignment(), self.farm_ids, list(self._workers)))
+                self.processes = len(self._workers)
+
+    def run(self):
+        """Arranca y supervisa hasta SIGTERM / Ctrl+C (SIGUSR1 / SIGUSR2: +1 / -1 worker)."""
+        signal.signal(signal.SIGTERM, lambda *_: self._stop_event.set())
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: setattr(self, "_resize_to", self.processes + 1))
+            signal.signal(signal.SIGUSR2, lambda *_: setattr(self, "_resize_to", self.processes - 1))
+        self.start()
+        try:
+            while not self._stop_event.wait(self.check_interval):
+                if self._resize_to is not None:
+                    processes, self._resize_to = self._resize_to, None
+                    self.resize(processes)
+                self.check()
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self):
+        """Detiene todos los workers (sin abandonar las sesiones: un reinicio las retoma)."""
+        self._stop_event.set()
+        with self._lock:
+            self._stop_workers(list(self._workers.values()), leave=False)
+            self._workers.clear()
+        log.info("supervisor detenido")
@@ -1,77 +1,233 @@
 import threading
 import time
+from collections import deque
+
 from Shared.GenericMQTTClient import GenericMQTTClient
+from Shared.Logging import get_logger, setup_logging
+from Shared.Metrics import REGISTRY
 from StatNode.DB.TelemetryDB import TelemetryDB
 
 """
 Responsabilidades de este fichero: 
 
 Publicaciones de: 
-1. Estadisticas por turbina y por parque eolico cada cierto intervalo de tiempo (ProcessedTelemetryPublisher)
-2. Alertas si es necesario (no implementado) --> Otra clase 
+1. Estadisticas por turbina y por parque eolico cada cierto intervalo de tiempo (ProcessedTelemetryPublisher):
+   modo 'full' (un retenido con todo el farm) o 'delta' (retenido por turbina con banda muerta,
+   resumen del farm y snapshot completo periodico)
+2. Alertas --> StatNode.Alerts.AlertEngine (evaluadas en la ingesta) 
 
 """
 # --- PLANTILLA TOPICOS MQTT ---
-PROC_TELEMETRY_TOPIC = "farms/{farm_id}/proc_telemetry"
+PROC_TELEMETRY_TOPIC = "farms/{farm_id}/proc_telemetry"                         # payload completo (modo full / snapshots)
+PROC_TURBINE_TOPIC = "farms/{farm_id}/turbines/{turbine_id}/proc_telemetry"     # modo delta, retenido por turbina
+PROC_SUMMARY_TOPIC = "farms/{farm_id}/proc_telemetry/summary"                   # modo delta, metricas del farm
+
+# --- Modo de publicacion ---
+PUBLISH_MODES = ("full", "delta")
+DEADBAND_PCT = 1.0            # % de cambio respecto de lo ultimo publicado para reenviar una turbina
+SNAPSHOT_INTERVAL_S = 300     # modo delta: cada cuanto se reenvia todo (payload completo + todas las turbinas)
+
+METRICS_WINDOW_MINUTES = 3  # ventana de las estadisticas publicadas
+ROTOR_RADIUS_M = 40.0       # Radio constante
+INITIAL_DELAY_S = 10        # espera inicial para que haya datos en DB
+CYCLE_HISTORY = 1000        # duraciones de ciclo recientes que se conservan
+
+log = get_logger(__name__)
+
+# --- Metricas ---
+PUBLISH_CYCLE_SECONDS = REGISTRY.histogram("publish_cycle_seconds", "Duracion del ciclo (consulta + publish)",
+                                           ("farm_id",))
+PUBLISH_LAG_SECONDS = REGISTRY.histogram("publish_lag_seconds", "Atraso del inicio del ciclo respecto de la agenda",
+                                         ("farm_id",))
+PROC_MESSAGES = REGISTRY.counter("proc_messages_published_total", "Mensajes de telemetria procesada publicados",
+                                 ("farm_id", "kind"))
+PUBLISH_FAILURES = REGISTRY.counter("publish_cycle_failures_total",
+                                    "Ciclos fallidos (consulta a Mongo o publish); se reintenta en el siguiente",
+                                    ("farm_id",))
+PROC_SUPPRESSED = REGISTRY.counter("proc_turbine_updates_suppressed_total",
+                                   "Turbinas no reenviadas por estar dentro de la banda muerta", ("farm_id",))
+
+
+def exceeds_deadband(previous: dict, current: dict, pct: float = DEADBAND_PCT, absolute: dict = None) -> bool:
+    """
+    True si algun campo numerico cambio mas que la banda muerta: max(absolute[campo], pct% de lo previo).
+    Un campo que aparece, desaparece o pasa a/desde None cuenta como cambio.
+    """
+    absolute = absolute or {}
+    if previous is None or previous.keys() != current.keys():
+        return True
+    for key, value in current.items():
+        prev = previous[key]
+        if value is None or prev is None:
+            if value is not prev:
+                return True
+            continue
+        band = max(absolute.get(key, 0.0), abs(prev) * pct / 100.0)
+        if abs(value - prev) > band:
+            return True
+    return False
+
 
 class ProcessedTelemetryPublisher:
-    def __init__(self, farm_id: int, publish_interval: int = 30):
+    def __init__(self, farm_id: int, publish_interval: int = 30, db_service: TelemetryDB = None,
+                 initial_delay: float = INITIAL_DELAY_S, window_minutes: int = METRICS_WINDOW_MINUTES,
+                 mqtt_client: GenericMQTTClient = None, mode: str = "full", deadband_pct: float = DEADBAND_PCT,
+                 deadband_abs: dict = None, snapshot_interval: float = SNAPSHOT_INTERVAL_S):
+        """
+        db_service: permite compartir el TelemetryDB del RawTelemetrySuscriber del mismo proceso;
+        si este tiene un RollingWindowAggregator, las metricas se calculan sin consultar Mongo.
+        mqtt_client: conexion compartida (ver StatNode.FarmSupervisor); el dueño conecta / desconecta.
+        mode: 'full' publica todo el farm en un retenido por ciclo; 'delta' publica un retenido por
+        turbina (solo si sale de la banda muerta: deadband_pct % o deadband_abs {campo: valor}) y
+        el resumen del farm, y cada snapshot_interval s reenvia todo (incluido el payload completo)
+        para que los retenidos no queden desfasados.
+        """
+        if mode not in PUBLISH_MODES:
+            raise ValueError(f"mode debe ser uno de {PUBLISH_MODES}")
         self.farm_id = farm_id
         self.publish_interval = publish_interval
-        self.mqtt_client = GenericMQTTClient(client_id=f"pub-stats-{farm_id}")
-        self.db_service = TelemetryDB()  # usa el mismo conector singleton
+        self.initial_delay = initial_delay
+        self.window_minutes = window_minutes
+        self.mode = mode
+        self.deadband_pct = deadband_pct
+        self.deadband_abs = deadband_abs or {}
+        self.snapshot_interval = snapshot_interval
+        self._published = {}          # turbine_id -> metricas publicadas (referencia de la banda muerta)
+        self._last_snapshot = None
+        self._owns_client = mqtt_client is None
+        self.mqtt_client = mqtt_client or GenericMQTTClient(client_id=f"pub-stats-{farm_id}")
+        self.db_service = db_service or TelemetryDB()  # usa el mismo conector singleton
         self._stop_event = threading.Event()
+        self._thread = None
+        self.cycle_durations = deque(maxlen=CYCLE_HISTORY)  # segundos por ciclo (consulta + publish)
+        self._m_cycle = PUBLISH_CYCLE_SECONDS.labels(farm_id)
+        self._m_lag = PUBLISH_LAG_SECONDS.labels(farm_id)
+        self._m_failures = PUBLISH_FAILURES.labels(farm_id)
+        self._m_full = PROC_MESSAGES.labels(farm_id, "full")
+        self._m_turbine = PROC_MESSAGES.labels(farm_id, "turbine")
+        self._m_summary = PROC_MESSAGES.labels(farm_id, "summary")
+        self._m_suppressed = PROC_SUPPRESSED.labels(farm_id)
 
     # metodo para obtener el topic
     def get_topic_telem_proc(self) -> str:
         return PROC_TELEMETRY_TOPIC.format(farm_id=self.farm_id)
 
+    def get_topic_turbine_proc(self, turbine_id) -> str:
+        return PROC_TURBINE_TOPIC.format(farm_id=self.farm_id, turbine_id=turbine_id)
+
+    def get_topic_summary_proc(self) -> str:
+        return PROC_SUMMARY_TOPIC.format(farm_id=self.farm_id)
+
     # hilo ppal publicacion
-    def start(self):
-        self.mqtt_client.connect()
-        thread = threading.Thread(target=self._publish_loop, daemon=True)
-        thread.start()
-        print(f"[Publisher] Comienzo publisher telemetria procesada - Farm-{self.farm_id}\n")
+    def start(self, block: bool = True):
+        """block=False: arranca el hilo de publicacion y vuelve (el caller llama stop())."""
+        if self._owns_client:
+            self.mqtt_client.connect()
+        self._thread = threading.Thread(target=self._publish_loop, daemon=True)
+        self._thread.start()
+        log.info("Comienzo publisher telemetria procesada - Farm-%s", self.farm_id)
+        if not block:
+            return
         try:
             while not self._stop_event.is_set():
                 time.sleep(1)
         except KeyboardInterrupt:
-            print("[Publisher] Stopping...")
-            self._stop_event.set()
+            self.stop()
+
+    def stop(self):
+        log.info("Stopping...", extra={"farm_id": self.farm_id})
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+        if self._owns_client:
             self.mqtt_client.disconnect()
 
     def _publish_loop(self):
-        time.sleep(10)  # espera inicial para que haya datos en DB
+        if self._stop_event.wait(self.initial_delay):  # espera inicial para que haya datos en DB
+            return
+        # agenda absoluta (un ciclo cada publish_interval desde el primero): un ciclo lento
+        # atrasa al siguiente pero no desplaza la agenda
+        scheduled = time.monotonic()
         while not self._stop_event.is_set():
-            
-            turbine_metrics = self.db_service.get_metrics_per_turbine(
-                farm_id=self.farm_id,
-                minutes=3,
-                rotor_radius_m=40.0 # Radio constante
-            )
-            
-            farm_metrics = self.db_service.get_metrics_farm(
-                farm_id=self.farm_id,
-                minutes=3,
-                rotor_radius_m=40.0 # Radio constante
-            )
-
-            payload = {
-                "farm_id": self.farm_id,
-                "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "turbine_metrics": turbine_metrics,
-                "farm_metrics": farm_metrics
-            }
-
-            topic = self.get_topic_telem_proc()
-            self.mqtt_client.publish(topic, payload, qos=1, retain=True)
-
-            print(f"[Publisher] Published processed metrics to '{topic}' at {payload['generated_at']}")
-
-            time.sleep(self.publish_interval)
+            started = time.perf_counter()
+            self._m_lag.observe(max(time.monotonic() - scheduled, 0.0))
+
+            try:
+                # una sola consulta para metricas por turbina y del farm
+                metrics = self.db_service.get_metrics(
+                    farm_id=self.farm_id,
+                    minutes=self.window_minutes,
+                    rotor_radius_m=ROTOR_RADIUS_M
+                )
+
+                generated_at = time.strftime("%Y-%m-%d %H:%M:%S")
+                if self.mode == "delta":
+                    self._publish_delta(metrics, generated_at)
+                else:
+                    self._publish_full(metrics, generated_at)
+            except Exception as e:
+                # un error transitorio (Mongo, broker) no debe matar el hilo: el worker sigue vivo
+                # y el supervisor no lo reiniciaria. Se reintenta en el proximo ciclo de la agenda
+                self._m_failures.inc()
+                log.error("Ciclo de publicacion fallido: %s", e, extra={"farm_id": self.farm_id}, exc_info=True)
+
+            elapsed = time.perf_counter() - started
+            self.cycle_durations.append(elapsed)
+            self._m_cycle.observe(elapsed)
+
+            scheduled += self.publish_interval
+            if time.monotonic() - scheduled > self.publish_interval:
+                scheduled = time.monotonic()  # atrasado mas de un ciclo: se resincroniza sin rafaga
+            self._stop_event.wait(max(scheduled - time.monotonic(), 0))
+
+    def _publish_full(self, metrics: dict, generated_at: str):
+        payload = {
+            "farm_id": self.farm_id,
+            "generated_at": generated_at,
+            "turbine_metrics": metrics["turbine_metrics"],
+            "farm_metrics": metrics["farm_metrics"]
+        }
+        topic = self.get_topic_telem_proc()
+        self.mqtt_client.publish(topic, payload, qos=1, retain=True)
+        self._m_full.inc()
+        log.info("Published processed metrics to '%s' at %s", topic, generated_at)
+
+    def _publish_delta(self, metrics: dict, generated_at: str):
+        now = time.monotonic()
+        snapshot = self._last_snapshot is None or now - self._last_snapshot >= self.snapshot_interval
+        turbine_metrics = metrics["turbine_metrics"]
+
+        sent = 0
+        for turbine_id, values in turbine_metrics.items():
+            if not snapshot and not exceeds_deadband(self._published.get(turbine_id), values,
+                                                     self.deadband_pct, self.deadband_abs):
+                self._m_suppressed.inc()
+                continue
+            payload = {"farm_id": self.farm_id, "turbine_id": turbine_id, "generated_at": generated_at, **values}
+            self.mqtt_client.publish(self.get_topic_turbine_proc(turbine_id), payload, qos=1, retain=True)
+            self._published[turbine_id] = values
+            sent += 1
+        self._m_turbine.inc(sent)
+
+        # turbina sin datos en la ventana: se borra su retenido
+        for turbine_id in [t for t in self._published if t not in turbine_metrics]:
+            self.mqtt_client.clear_retained(self.get_topic_turbine_proc(turbine_id))
+            del self._published[turbine_id]
+
+        summary = {"farm_id": self.farm_id, "generated_at": generated_at, "turbines": len(turbine_metrics),
+                   "farm_metrics": metrics["farm_metrics"]}
+        self.mqtt_client.publish(self.get_topic_summary_proc(), summary, qos=1, retain=True)
+        self._m_summary.inc()
+
+        if snapshot:
+            self._publish_full(metrics, generated_at)
+            self._last_snapshot = now
+        log.info("Delta publicado: %s/%s turbinas", sent, len(turbine_metrics),
+                 extra={"farm_id": self.farm_id, "snapshot": snapshot})
 
 
 if __name__ == "__main__":
     # Una instancia por parque eolico 
+    setup_logging()
     publisher = ProcessedTelemetryPublisher(farm_id=1)
     publisher.start()
\ No newline at end of file
@@ -3,61 +3,284 @@
 1. Suscripcion a Topico telemetria datos crudos
 2. Formateo de datos 
 3. Guardado en BD - Colecciones por Parques/Wind_Farms 
+
+Escalado horizontal (MQTT 5 shared subscriptions): N suscriptores identicos con el mismo
+share_group se suscriben a $share/<grupo>/farms/<farm|+>/turbines/+/raw_telemetry y el
+broker reparte los mensajes entre ellos (mismo host o nodos distintos).
+- QoS 1 + sesion persistente (member_id estable): un miembro que se reinicia recupera
+  lo que el broker le encolo mientras no estaba. stop() por defecto abandona el grupo
+  (unsubscribe) antes de drenar, asi el broker pasa a repartir entre los que quedan.
+- Confirmacion: por defecto paho responde el PUBACK apenas el callback encola el mensaje,
+  asi que solo un stop() ordenado (drena la cola y hace flush) no pierde nada; si el
+  proceso muere, lo encolado o en el buffer de TelemetryDB se pierde. Con manual_ack=True
+  el PUBACK sale recien cuando el documento esta escrito en Mongo (o se descarto a
+  proposito) y el broker reenvia lo no confirmado al retomar la sesion (al menos una vez).
+  Las reentregas no se duplican: en modo flat el _id es deterministico (TelemetryDB.telemetry_id)
+  y la clave duplicada se confirma sin contarla en rollups; AlertEngine ignora muestras no
+  posteriores a la ultima evaluada de la turbina. stop() desconecta recien despues del
+  drenaje y el flush, para que esos PUBACK salgan. La ventana de in-flight del broker pasa a ser el backpressure
+  (EMQX mqtt.max_inflight, mosquitto max_inflight_messages): para no esperar flush_interval
+  con la ventana llena, cada worker hace flush en cuanto la cola de su farm queda vacia.
+- Orden por turbina: dentro del proceso, la cola esta particionada por topic (una turbina
+  -> un worker). Entre miembros depende de la estrategia del broker: con EMQX usar
+  broker.shared_subscription_strategy = hash_topic (o sticky) para que cada turbina vaya
+  siempre al mismo miembro; round_robin reparte sin garantia de orden.
 """
-import json
+import functools
+import os
+import socket
 import threading
 import time
 
+from Shared.BoundedWorkQueue import BoundedWorkQueue
 from Shared.GenericMQTTClient import GenericMQTTClient
+from Shared.Logging import get_logger, setup_logging
+from Shared.Metrics import REGISTRY, serve_metrics
 from Shared.MongoSingleton import MongoSingleton
-from StatNode.DB.TelemetryDB import TelemetryDB 
+from Shared.PayloadCodecs import decode_payload
+from StatNode.Alerts.AlertEngine import AlertEngine
+from StatNode.DB.RollingAggregator import RollingWindowAggregator
+from StatNode.DB.TelemetryDB import STORAGE_MODE_ENV, STORAGE_MODES, TelemetryDB, default_storage_mode
 
 # --- PLANTILLA TOPICOS MQTT ---
 RAW_TURBINE_TELEMETRY_TOPIC = "farms/{farm_id}/turbines/+/raw_telemetry" # suscription topic
+ALL_FARMS = "+"
+
+# --- Suscripcion compartida / sesion ---
+INGEST_QOS = 1
+INGEST_SESSION_EXPIRY_S = 300  # el broker conserva la sesion (y encola QoS 1) durante un reinicio
+
+# --- Configuracion ingesta por lotes ---
+INGEST_BATCH_SIZE = 500        # documentos por insert_many
+INGEST_FLUSH_INTERVAL_S = 1.0  # latencia maxima antes de escribir un lote incompleto
+INGEST_ROLLUPS = True          # mantener rollups 1m/1h/1d para el historial
+
+# --- Configuracion cola de ingesta (hilo MQTT -> workers) ---
+INGEST_QUEUE_MAXSIZE = 20_000
+INGEST_WORKERS = 4
+INGEST_WORKER_MODE = "thread"      # 'thread' | 'process'
+INGEST_BACKPRESSURE = "block"      # 'block' | 'drop_oldest' | 'spill'
+INGEST_SPILL_PATH = "/tmp/raw_telemetry_{member}.spill"
+STATS_LOG_INTERVAL_S = 10
+METRICS_PORT = 9101                # /metrics de este proceso (el API Flask expone el suyo)
+
+log = get_logger(__name__, rate_limit=5)  # payloads invalidos pueden llegar en rafaga
+
+# --- Metricas (label topic = filtro de suscripcion, no el topico de cada turbina) ---
+MESSAGES_RECEIVED = REGISTRY.counter("mqtt_messages_received_total", "Mensajes MQTT recibidos", ("topic",))
+MESSAGES_DECODED = REGISTRY.counter("mqtt_messages_decoded_total", "Mensajes decodificados e ingeridos", ("topic",))
+DECODE_FAILURES = REGISTRY.counter("mqtt_decode_failures_total", "Payloads invalidos descartados", ("topic",))
+INGEST_QUEUE_DEPTH = REGISTRY.gauge("ingest_queue_depth", "Mensajes esperando en la cola de ingesta", ("farm_id",))
+
+
+class _IngestHandler:
+    """Handler de los workers: decodifica el mensaje crudo (json/msgpack/cbor/struct) y lo inserta via TelemetryDB."""
+    def __init__(self, db_service: TelemetryDB = None, topic_label: str = "", alert_engine: AlertEngine = None,
+                 idle=None, **db_kwargs):
+        """idle: con manual_ack, callable que indica que la cola quedo vacia (flush para liberar la ventana)."""
+        # en modo proceso cada worker crea su propio TelemetryDB (y conexion a Mongo)
+        # (y sus metricas quedan en el registro de ese proceso)
+        self.db_service = db_service or TelemetryDB(**db_kwargs)
+        self.alert_engine = alert_engine
+        self._idle = idle
+        self._m_decoded = MESSAGES_DECODED.labels(topic_label)
+        self._m_failures = DECODE_FAILURES.labels(topic_label)
+
+    def __call__(self, topic: str, payload: bytes, content_type: str = None, ack=None):
+        try:
+            # codec segun Content-Type (MQTT 5) o detectado por el primer byte
+            data: dict = decode_payload(payload, content_type)
+        except Exception:
+            data = None
+        if not isinstance(data, dict):
+            self._m_failures.inc()
+            log.warning("Payload invalido descartado", extra={"topic": topic})
+            if ack is not None:
+                ack()  # no hay nada que guardar: que el broker no lo reenvie
+            return
+        self._m_decoded.inc()
+        log.debug("Recibido en '%s': %s", topic, data)  # se formatea solo en DEBUG
+        doc = self.db_service.insert_telemetry(data, on_persisted=ack) # Insercion para historial
+        if self.alert_engine is not None:
+            self.alert_engine.evaluate(doc)
+        if self._idle is not None and self._idle():
+            self.db_service.flush()  # sin mas mensajes en cola: confirmar lo acumulado ya
+
+    def close(self):
+        self.db_service.close()
+
+
+def _item_topic(item) -> str:
+    # clave de particion de la cola: el topic identifica a la turbina
+    return item[0]
+
 
-# Se asume 1 instancia Suscriptor por Farm  
+# Una instancia por Farm, o N miembros de un share_group (farm_id=None: todos los farms)
 class RawTelemetrySuscriber:  
-    def __init__(self, farm_id: int):
+    def __init__(self, farm_id: int = None, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL_S, on_flush_error: str = "retry",
+                 queue_maxsize: int = INGEST_QUEUE_MAXSIZE, workers: int = INGEST_WORKERS,
+                 worker_mode: str = INGEST_WORKER_MODE, backpressure: str = INGEST_BACKPRESSURE,
+                 spill_path: str = None, aggregator: RollingWindowAggregator = None,
+                 maintain_rollups: bool = INGEST_ROLLUPS, share_group: str = None, member_id: str = None,
+                 qos: int = INGEST_QOS, session_expiry_s: int = INGEST_SESSION_EXPIRY_S,
+                 ordered: bool = True, mqtt_client: GenericMQTTClient = None, alert_engine: AlertEngine = None,
+                 manual_ack: bool = False):
+        """
+        aggregator: agregador de ventana deslizante alimentado por esta ingesta. Compartiendo
+        self.db_service con ProcessedTelemetryPublisher (mismo proceso) las metricas salen de memoria.
+        Solo disponible con worker_mode='thread' (en 'process' cada worker tiene su propia memoria)
+        y sin share_group (cada miembro ve solo una parte de los mensajes).
+        share_group: nombre del grupo de suscripcion compartida (None = suscripcion normal).
+        member_id: identidad estable del miembro (client id y sesion persistente); por defecto
+        host-pid, que no se reutiliza entre reinicios.
+        ordered: particiona la cola por topic para conservar el orden por turbina.
+        mqtt_client: conexion compartida entre farms del mismo proceso (MQTT 5, ver StatNode.FarmSupervisor);
+        el suscriptor solo registra su filtro con message_callback_add y el dueño conecta / desconecta.
+        alert_engine: evalua las reglas de alerta sobre cada muestra ingerida (requiere worker_mode='thread'
+        y ordered=True: el estado por turbina supone muestras en orden); el caller lo arranca y detiene.
+        manual_ack: PUBACK recien con el documento en Mongo (ver docstring del modulo). Requiere
+        worker_mode='thread' y backpressure='block' (un item descartado o derramado no se confirmaria);
+        una mqtt_client compartida debe haberse creado con manual_ack=True.
+        """
+        if share_group and aggregator is not None:
+            raise ValueError("aggregator no es compatible con share_group (metricas parciales)")
+        if alert_engine is not None and (worker_mode != "thread" or not ordered):
+            raise ValueError("alert_engine requiere worker_mode='thread' y ordered=True")
+        if manual_ack and (worker_mode != "thread" or backpressure != "block"):
+            raise ValueError("manual_ack requiere worker_mode='thread' y backpressure='block'")
+        if manual_ack and mqtt_client is not None and not mqtt_client.manual_ack:
+            raise ValueError("manual_ack requiere una mqtt_client creada con manual_ack=True")
+        self.manual_ack = manual_ack
         self.farm_id = farm_id 
-        self.mqtt_client = GenericMQTTClient(client_id="RawTelemSub-Farm"+str(farm_id)) 
-        self.db_service = TelemetryDB() # Servicio DB  
-        # ---> Resto de la configuracion
+        self.share_group = share_group
+        self.qos = qos
+        self.member_id = member_id or f"{socket.gethostname()}-{os.getpid()}"
+        if share_group:
+            client_id = f"RawTelemSub-{share_group}-{self.member_id}"
+        else:
+            client_id = f"RawTelemSub-Farm{farm_id if farm_id is not None else 'All'}"
+        # MQTT 5 para recibir el Content-Type de cada mensaje (formato del payload) y para $share;
+        # sesion persistente solo con identidad estable (si no, cada arranque dejaria una huerfana)
+        persistent = member_id is not None or not share_group
+        self._owns_client = mqtt_client is None
+        if mqtt_client is None:
+            mqtt_client = GenericMQTTClient(client_id=client_id, mqtt_v5=True, clean_session=not persistent,
+                                            session_expiry_s=session_expiry_s if persistent else 0,
+                                            manual_ack=manual_ack)
+        self.mqtt_client = mqtt_client
+        topic_label = self.subscription_topic()
+        self._m_received = MESSAGES_RECEIVED.labels(topic_label)
+        db_kwargs = dict(batch_size=batch_size, flush_interval=flush_interval, on_flush_error=on_flush_error,
+                         maintain_rollups=maintain_rollups)
+
+        if worker_mode == "process":
+            if aggregator is not None:
+                raise ValueError("aggregator requiere worker_mode='thread'")
+            # sin TelemetryDB en el proceso padre: cada worker abre el suyo
+            self.db_service = None
+            handler_factory = functools.partial(_IngestHandler, topic_label=topic_label, **db_kwargs)
+        else:
+            self.db_service = TelemetryDB(aggregator=aggregator, **db_kwargs) # Servicio DB (modo batch), compartido por los hilos
+            handler_factory = functools.partial(_IngestHandler, self.db_service, topic_label, alert_engine,
+                                                idle=self._queue_empty if manual_ack else None)
+
+        # el callback MQTT solo encola; parseo e insercion ocurren en los workers
+        self.work_queue = BoundedWorkQueue(
+            handler_factory,
+            maxsize=queue_maxsize,
+            workers=workers,
+            mode=worker_mode,
+            policy=backpressure,
+            spill_path=spill_path or INGEST_SPILL_PATH.format(member=client_id),
+            partition_key=_item_topic if ordered else None
+        )
+        INGEST_QUEUE_DEPTH.labels(farm_id if farm_id is not None else ALL_FARMS).set_function(self.work_queue.depth)
     
-    # telemetria todas las turbinas para ese farm_id
-    def get_topic_telem_raw(self, farm_id: int) -> str: 
-        return RAW_TURBINE_TELEMETRY_TOPIC.format(farm_id=farm_id)
+    # telemetria todas las turbinas para ese farm_id (None: todos los farms)
+    def get_topic_telem_raw(self, farm_id: int = None) -> str: 
+        return RAW_TURBINE_TELEMETRY_TOPIC.format(farm_id=farm_id if farm_id is not None else ALL_FARMS)
+
+    def subscription_topic(self) -> str:
+        topic = self.get_topic_telem_raw(self.farm_id)
+        return GenericMQTTClient.shared_topic(self.share_group, topic) if self.share_group else topic
+
+    def _queue_empty(self) -> bool:
+        return self.work_queue.depth() == 0
+
+    def stats(self) -> dict:
+        """Profundidad de la cola y descartes (saturacion de la ingesta)."""
+        return self.work_queue.stats()
     
-    def start(self):
-        self.mqtt_client.connect()
-       
-        self.mqtt_client.subscribe(
-            self.get_topic_telem_raw(self.farm_id), 
-            self._message_callback
-        )
-        
+    def start(self, block: bool = True):
+        """block=False: arranca y vuelve (el caller llama stop()); si no, corre hasta Ctrl+C."""
+        self.work_queue.start()
+        if self._owns_client:
+            self.mqtt_client.connect()
+            self.mqtt_client.subscribe(
+                self.subscription_topic(), 
+                self._message_callback,
+                qos=self.qos
+            )
+        else:
+            # conexion compartida: callback propio por filtro (si no conecto aun, suscribe al conectar)
+            self.mqtt_client.message_callback_add(self.subscription_topic(), self._message_callback, qos=self.qos)
+        if not block:
+            return
+
         try:
             while True:
-                time.sleep(1)
+                time.sleep(STATS_LOG_INTERVAL_S)
+                log.info("cola de ingesta", extra={"farm_id": self.farm_id, **self.stats()})
         except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self, leave_group: bool = None):
+        """
+        leave_group: desuscribe antes de desconectar (el broker deja de asignarle mensajes y
+        la sesion no acumula); False para un reinicio rapido que retoma la sesion persistente.
+        Por defecto True solo con share_group (un suscriptor unico conserva su suscripcion).
+        """
+        if leave_group is None:
+            leave_group = bool(self.share_group)
+        if leave_group:
+            self.mqtt_client.unsubscribe(self.subscription_topic())
+        self.work_queue.stop() # procesa lo encolado y cierra los workers
+        if self.db_service:
+            self.db_service.close() # flush de lo pendiente en buffer
+        if self._owns_client:
+            # recien ahora: con manual_ack los PUBACK del drenaje y del flush salen por esta conexion
             self.mqtt_client.disconnect()
     
     
     def _message_callback(self, client, userdata, msg):
-        payload = msg.payload.decode()
-        try:
-            data: dict = json.loads(payload)
-            print(f"\nRecibido en '{msg.topic}': {data} \n******")
-        
-            self.db_service.insert_telemetry(data) # Insercion para historial
-            
-        except json.JSONDecodeError:
-            data = payload
-        except Exception as e:
-            print(f"Error genérico: {e}\n")
+        # corre en el hilo de red de paho: solo encolar, nada bloqueante
+        self._m_received.inc()
+        if self.manual_ack:
+            ack = functools.partial(self.mqtt_client.ack, msg.mid, msg.qos)
+            self.work_queue.put((msg.topic, msg.payload, GenericMQTTClient.content_type(msg), ack))
+        else:
+            self.work_queue.put((msg.topic, msg.payload, GenericMQTTClient.content_type(msg)))
         
     
 if __name__ == '__main__':
-    # Se asume 1 instancia por Farm
-    sub = RawTelemetrySuscriber(farm_id=1)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Suscriptor de telemetria cruda -> MongoDB")
+    parser.add_argument("--farm-id", type=int, default=None, help="farm a ingerir (default: todos)")
+    parser.add_argument("--share-group", default=None, help="grupo $share: N instancias se reparten la carga")
+    parser.add_argument("--member-id", default=None, help="identidad estable del miembro (sesion persistente)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--manual-ack", action="store_true",
+                        help="PUBACK recien con el documento escrito en Mongo (sobrevive a una caida)")
+    parser.add_argument("--storage-mode", choices=STORAGE_MODES, default=default_storage_mode(),
+                        help=f"coleccion de telemetria (default: ${STORAGE_MODE_ENV} o 'flat')")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT)
+    args = parser.parse_args()
+
+    setup_logging()
+    os.environ[STORAGE_MODE_ENV] = args.storage_mode  # TelemetryDB del proceso y de sus workers
+    serve_metrics(args.metrics_port)
+    sub = RawTelemetrySuscriber(farm_id=args.farm_id, share_group=args.share_group,
+                                member_id=args.member_id, workers=args.workers, manual_ack=args.manual_ack)
     sub.start()
-    
\ No newline at end of file
@@ -0,0 +1,94 @@
+import argparse
+import os
+
+from Shared.Logging import get_logger, setup_logging
+from Shared.Metrics import serve_metrics
+from StatNode.Alerts.AlertEngine import load_rules
+from StatNode.FarmRange import parse_farms
+from StatNode.FarmSupervisor import DEFAULT_OPTIONS, MAX_RESTARTS, FarmSupervisor
+from StatNode.DB.TelemetryDB import STORAGE_MODE_ENV, STORAGE_MODES, default_storage_mode
+from StatNode.MQTT.telemetry_pub import PUBLISH_MODES
+
+log = get_logger("StatNode.main")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="StatNode: ingesta y publicacion de estadisticas para N farms")
+    parser.add_argument("--farms", default="1", help="lista o rangos de farms, p.ej. '1-10,12'")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="workers del pool (default: cores; nunca mas que farms)")
+    parser.add_argument("--broker", default=f"{DEFAULT_OPTIONS['broker_host']}:{DEFAULT_OPTIONS['broker_port']}")
+    parser.add_argument("--mongo-uri", default=DEFAULT_OPTIONS["mongo_uri"])
+    parser.add_argument("--db-name", default=DEFAULT_OPTIONS["db_name"])
+    parser.add_argument("--mongo-pool-size", type=int, default=DEFAULT_OPTIONS["mongo_pool_size"],
+                        help="conexiones maximas del pool Mongo por worker")
+    parser.add_argument("--mongo-compressors", default=DEFAULT_OPTIONS["mongo_compressors"],
+                        help="compresion de red con Mongo, p.ej. 'zstd,zlib' (se negocia con el servidor)")
+    parser.add_argument("--publish-interval", type=float, default=DEFAULT_OPTIONS["publish_interval"],
+                        help="segundos entre publicaciones de estadisticas por farm")
+    parser.add_argument("--publish-mode", choices=PUBLISH_MODES, default=DEFAULT_OPTIONS["publish_mode"],
+                        help="full: un retenido por farm | delta: retenido por turbina con banda muerta")
+    parser.add_argument("--deadband-pct", type=float, default=DEFAULT_OPTIONS["deadband_pct"],
+                        help="modo delta: %% de cambio minimo para reenviar una turbina")
+    parser.add_argument("--snapshot-interval", type=float, default=DEFAULT_OPTIONS["snapshot_interval"],
+                        help="modo delta: segundos entre snapshots completos")
+    parser.add_argument("--ingest-workers", type=int, default=DEFAULT_OPTIONS["ingest_workers"],
+                        help="hilos de ingesta por farm")
+    parser.add_argument("--alert-rules", default=None, help="JSON con reglas de alerta (default: reglas incluidas)")
+    parser.add_argument("--storage-mode", choices=STORAGE_MODES, default=default_storage_mode(),
+                        help=f"coleccion de telemetria: flat | timeseries (default: ${STORAGE_MODE_ENV} o 'flat'); "
+                             "la API debe correr con el mismo valor")
+    parser.add_argument("--no-manual-ack", action="store_true",
+                        help="PUBACK al recibir (no espera a Mongo: una caida pierde lo no escrito)")
+    parser.add_argument("--no-alerts", action="store_true", help="desactiva el motor de alertas")
+    parser.add_argument("--max-restarts", type=int, default=MAX_RESTARTS)
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="/metrics del supervisor; el worker k usa metrics-port + 1 + k")
+    parser.add_argument("--log-level", default=None)
+    args = parser.parse_args(argv)
+    try:
+        args.farms = parse_farms(args.farms)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.alert_rules:
+        try:
+            load_rules(args.alert_rules)
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"--alert-rules: {e}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging(level=args.log_level)
+    if args.log_level:
+        os.environ["LOG_LEVEL"] = args.log_level  # los workers (spawn) configuran su logging desde el entorno
+    os.environ[STORAGE_MODE_ENV] = args.storage_mode  # idem: cada worker crea su TelemetryDB
+    host, _, port = args.broker.partition(":")
+    options = {
+        "broker_host": host,
+        "broker_port": int(port or DEFAULT_OPTIONS["broker_port"]),
+        "mongo_uri": args.mongo_uri,
+        "db_name": args.db_name,
+        "mongo_pool_size": args.mongo_pool_size,
+        "mongo_compressors": args.mongo_compressors,
+        "publish_interval": args.publish_interval,
+        "publish_mode": args.publish_mode,
+        "deadband_pct": args.deadband_pct,
+        "snapshot_interval": args.snapshot_interval,
+        "ingest_workers": args.ingest_workers,
+        "manual_ack": not args.no_manual_ack,
+        "alerts": not args.no_alerts,
+        "alert_rules": args.alert_rules,
+        "metrics_port": args.metrics_port,
+    }
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    supervisor = FarmSupervisor(args.farms, processes=args.processes, options=options,
+                                max_restarts=args.max_restarts)
+    log.info("StatNode: farms %s. Ctrl+C para detener.", args.farms)
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
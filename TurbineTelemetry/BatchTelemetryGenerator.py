@@ -0,0 +1,198 @@
+# Generacion vectorizada de telemetria (un tick para N turbinas con NumPy)
+"""
+Alternativa a WindTurbine.get_telemetry_data para simular flotas grandes: cada tick
+produce todas las variables de N turbinas como arrays, con un modelo fisico simple:
+
+- Viento por farm: proceso AR(1) gaussiano (correlacion temporal exp(-dt/tau)) llevado a
+  marginal Weibull(k, c) por transformacion de cuantiles; cada turbina agrega turbulencia
+  local (otro AR(1)). La direccion del viento por farm es una caminata aleatoria.
+- Potencia: curva cut-in / rated / cut-out (cubica entre cut-in y rated).
+- Estado operativo: cadena de Markov por turbina (STATE_TRANSITIONS), no un sorteo
+  independiente en cada tick.
+- Temperaturas de caja y rodamiento con inercia (primer orden hacia la temperatura de regimen).
+
+Reproducible: mismo seed => misma secuencia. numpy es requerido por este modulo.
+"""
+import math
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+STATES = ("operational", "maintenance", "standby", "fault", "stopped")
+OPERATIONAL = 0
+
+# Probabilidad de transicion por tick (dt = 10 s); filas = estado actual
+STATE_TRANSITIONS = np.array([
+    #  oper    maint   standby fault   stopped
+    [0.9970, 0.0005, 0.0015, 0.0005, 0.0005],  # operational
+    [0.0100, 0.9900, 0.0000, 0.0000, 0.0000],  # maintenance
+    [0.0300, 0.0000, 0.9700, 0.0000, 0.0000],  # standby
+    [0.0000, 0.0200, 0.0000, 0.9800, 0.0000],  # fault -> mantenimiento
+    [0.0200, 0.0000, 0.0000, 0.0000, 0.9800],  # stopped
+])
+INITIAL_STATE_P = np.array([0.85, 0.05, 0.05, 0.025, 0.025])
+
+# Curva de potencia (turbina ~2.5 MW)
+CUT_IN_MPS = 3.0
+RATED_MPS = 12.0
+CUT_OUT_MPS = 25.0
+RATED_RPM = 16.0
+MIN_RPM = 6.0
+
+# Viento
+WEIBULL_K = 2.0
+WEIBULL_C_MPS = 8.5
+WIND_TAU_S = 900.0            # tiempo de correlacion del viento del farm
+TURBULENCE_INTENSITY = 0.08   # desvio relativo local por turbina
+TURBULENCE_TAU_S = 60.0
+WIND_DIR_STEP_DEG = 2.0       # desvio de la caminata de direccion por tick
+
+VOLTAGE_V = 400.0
+POWER_FACTOR = 0.95
+AMBIENT_C = 25.0
+TEMP_TAU_S = 600.0
+
+_SQRT3 = math.sqrt(3)
+
+
+def power_curve_kw(wind_mps: np.ndarray, capacity_kw: float) -> np.ndarray:
+    """Potencia (kW) segun curva cut-in / rated / cut-out."""
+    frac = (wind_mps ** 3 - CUT_IN_MPS ** 3) / (RATED_MPS ** 3 - CUT_IN_MPS ** 3)
+    frac = np.clip(frac, 0.0, 1.0)
+    frac[(wind_mps < CUT_IN_MPS) | (wind_mps >= CUT_OUT_MPS)] = 0.0
+    return capacity_kw * frac
+
+
+def _norm_cdf(z: np.ndarray) -> np.ndarray:
+    # sin scipy: erf escalar (el array es de un valor por farm)
+    return np.array([0.5 * (1.0 + math.erf(v / math.sqrt(2.0))) for v in z])
+
+
+class BatchTelemetryGenerator:
+    def __init__(self, farm_ids: Sequence[int], turbine_ids: Sequence[int], seed: int = None,
+                 dt_s: float = 10.0, capacity_mw: float = 2.5):
+        """
+        farm_ids / turbine_ids: identidad de cada turbina (mismo largo, una fila por turbina).
+        dt_s: segundos simulados por tick (escala las correlaciones temporales).
+        """
+        self.farm_ids = np.asarray(farm_ids, dtype=np.int64)
+        self.turbine_ids = np.asarray(turbine_ids, dtype=np.int64)
+        if self.farm_ids.shape != self.turbine_ids.shape:
+            raise ValueError("farm_ids y turbine_ids deben tener el mismo largo")
+        self.n = len(self.turbine_ids)
+        self.dt_s = dt_s
+        self.capacity_mw = capacity_mw
+        self.capacity_kw = capacity_mw * 1000.0
+        self.rng = np.random.default_rng(seed)
+
+        # farm de cada turbina como indice 0..F-1
+        self.farms, self._farm_idx = np.unique(self.farm_ids, return_inverse=True)
+        n_farms = len(self.farms)
+
+        self._phi_wind = math.exp(-dt_s / WIND_TAU_S)
+        self._phi_turb = math.exp(-dt_s / TURBULENCE_TAU_S)
+        self._temp_alpha = 1.0 - math.exp(-dt_s / TEMP_TAU_S)
+
+        self._wind_z = self.rng.standard_normal(n_farms)
+        self._wind_dir = self.rng.uniform(0.0, 360.0, n_farms)
+        self._turb = self.rng.standard_normal(self.n)
+        self._yaw_offset = self.rng.normal(0.0, 3.0, self.n)
+        self._state = self.rng.choice(len(STATES), size=self.n, p=INITIAL_STATE_P)
+        self._gear_t = np.full(self.n, AMBIENT_C + 20.0)
+        self._bearing_t = np.full(self.n, AMBIENT_C + 15.0)
+        self._cum_p = np.cumsum(STATE_TRANSITIONS, axis=1)
+
+    def _step_wind(self) -> np.ndarray:
+        # AR(1) gaussiano por farm -> marginal Weibull
+        eps = self.rng.standard_normal(len(self.farms))
+        self._wind_z = self._phi_wind * self._wind_z + math.sqrt(1.0 - self._phi_wind ** 2) * eps
+        u = np.clip(_norm_cdf(self._wind_z), 1e-9, 1.0 - 1e-9)
+        farm_wind = WEIBULL_C_MPS * (-np.log1p(-u)) ** (1.0 / WEIBULL_K)
+        self._wind_dir = (self._wind_dir + self.rng.normal(0.0, WIND_DIR_STEP_DEG, len(self.farms))) % 360.0
+
+        # turbulencia local por turbina (AR(1))
+        eps_t = self.rng.standard_normal(self.n)
+        self._turb = self._phi_turb * self._turb + math.sqrt(1.0 - self._phi_turb ** 2) * eps_t
+        return np.maximum(farm_wind[self._farm_idx] * (1.0 + TURBULENCE_INTENSITY * self._turb), 0.0)
+
+    def _step_states(self):
+        u = self.rng.random(self.n)[:, None]
+        self._state = (u > self._cum_p[self._state]).sum(axis=1)
+        np.minimum(self._state, len(STATES) - 1, out=self._state)
+
+    def tick(self) -> Dict[str, np.ndarray]:
+        """Avanza un paso y devuelve columnas (un valor por turbina)."""
+        wind = self._step_wind()
+        self._step_states()
+        active = self._state == OPERATIONAL
+
+        power = np.where(active, power_curve_kw(wind, self.capacity_kw), 0.0)
+        producing = active & (power > 0)
+        rotor = np.where(producing, np.clip(MIN_RPM + (RATED_RPM - MIN_RPM) * wind / RATED_MPS, MIN_RPM, RATED_RPM), 0.0)
+        # pitch: 0 en region parcial, crece sobre rated para limitar potencia; bandera (90) si no opera
+        pitch = np.where(active, np.clip((wind - RATED_MPS) * 2.0, 0.0, 30.0), 90.0)
+        vibration = np.where(producing, 0.3 + 0.15 * rotor + self.rng.gamma(2.0, 0.15, self.n), 0.05)
+
+        load = power / self.capacity_kw
+        self._gear_t += self._temp_alpha * (AMBIENT_C + 10.0 + 35.0 * load - self._gear_t)
+        self._bearing_t += self._temp_alpha * (AMBIENT_C + 8.0 + 28.0 * load - self._bearing_t)
+
+        voltage = np.where(active, VOLTAGE_V, 0.0)
+        current = np.where(producing, power * 1000.0 / (VOLTAGE_V * _SQRT3 * POWER_FACTOR), 0.0)
+        wind_dir = self._wind_dir[self._farm_idx]
+
+        return {
+            "farm_id": self.farm_ids,
+            "turbine_id": self.turbine_ids,
+            "wind_speed_mps": wind,
+            "wind_direction_deg": np.floor(wind_dir),
+            "rotor_speed_rpm": rotor,
+            "blade_pitch_angle_deg": pitch,
+            "yaw_position_deg": (wind_dir + self._yaw_offset) % 360.0,
+            "vibrations_mms": vibration,
+            "gear_temperature_c": self._gear_t.copy(),
+            "bearing_temperature_c": self._bearing_t.copy(),
+            "output_voltage_v": voltage,
+            "generated_current_a": current,
+            "active_power_kw": power,
+            "reactive_power_kvar": power * 0.3,
+            "state": self._state.copy(),
+        }
+
+    def payloads(self, columns: Dict[str, np.ndarray], timestamp_ms: int = None,
+                 compact: bool = True) -> List[dict]:
+        """
+        Columnas -> un dict por turbina (mismo esquema que WindTurbine.get_telemetry_data).
+        Redondeo y conversion se hacen por columna (tolist), no por valor.
+        """
+        if timestamp_ms is None:
+            timestamp_ms = int(time.time() * 1000)
+        lists = {}
+        for key, values in columns.items():
+            if key in ("farm_id", "turbine_id", "state", "wind_direction_deg"):
+                continue
+            decimals = 1 if key in ("gear_temperature_c", "bearing_temperature_c", "output_voltage_v") else 2
+            lists[key] = np.round(values, decimals).tolist()
+        lists["wind_direction_deg"] = columns["wind_direction_deg"].astype(np.int64).tolist()
+        lists["operational_state"] = [STATES[s] for s in columns["state"].tolist()]
+        keys = list(lists)
+        farm_ids = columns["farm_id"].tolist()
+        turbine_ids = columns["turbine_id"].tolist()
+
+        if compact:
+            timestamp = timestamp_ms
+        else:
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp_ms / 1000.0))
+
+        out = []
+        for i, row in enumerate(zip(*(lists[k] for k in keys))):
+            doc = {"farm_id": farm_ids[i], "turbine_id": turbine_ids[i]}
+            if not compact:
+                doc["farm_name"] = f"Farm-{farm_ids[i]:03d}"
+                doc["turbine_name"] = f"T-{turbine_ids[i]:03d}"
+            doc["timestamp"] = timestamp
+            doc.update(zip(keys, row))
+            doc["capacity_mw"] = self.capacity_mw
+            out.append(doc)
+        return out
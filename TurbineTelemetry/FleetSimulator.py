@@ -0,0 +1,225 @@
+# Simulador de flota: miles de turbinas virtuales sobre pocas conexiones MQTT
+"""
+Un unico event loop asyncio programa N turbinas virtuales (WindTurbine sin hilo propio)
+y las reparte sobre un pool chico de conexiones MQTT (turbina i -> conexion i % pool_size).
+
+- Cada turbina publica en su topico farms/{farm}/turbines/{id}/raw_telemetry.
+- Arranques escalonados: la turbina i arranca en (i / N) * intervalo, asi la carga
+  sobre el broker es pareja en vez de llegar en rafagas.
+- generator='numpy': los payloads salen de BatchTelemetryGenerator (un tick vectorizado
+  para toda la flota por intervalo, viento correlacionado y curva de potencia) en vez de
+  WindTurbine.get_telemetry_data por turbina.
+- Estado por conexion (retenido) en fleet/{conn_id}/status con la lista de turbinas que
+  transporta: MQTT define un solo LWT por conexion, asi que el estado se publica a ese
+  nivel y los dashboards lo cruzan con la lista de turbinas. 'online' es el mensaje de
+  nacimiento (se repite en cada reconexion), 'offline' el LWT (el broker lo publica si la
+  conexion se cae); al detener limpio se borra el retenido. Cada conexion tiene su topic,
+  asi un LWT no pisa al de otra conexion.
+- mqtt_client='async': el pool usa AsyncMQTTClient (red dentro del mismo event loop, sin
+  hilos de paho); publish espera lugar en la ventana de in-flight, asi con QoS 1 el broker
+  marca el ritmo en vez de acumular mensajes sin confirmar.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List
+
+from Shared.AsyncMQTTClient import AsyncMQTTClient
+from Shared.GenericMQTTClient import GenericMQTTClient
+from Shared.Logging import get_logger
+from TurbineTelemetry.WindTurbine import WIRE_FORMATS, WindTurbine, wire_codec
+
+FLEET_STATUS_TOPIC = "fleet/{conn_id}/status"
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_PUBLISH_INTERVAL_S = 10.0
+STATS_LOG_INTERVAL_S = 10
+STOP_FLUSH_TIMEOUT_S = 5.0
+GENERATORS = ("random", "numpy")
+MQTT_CLIENTS = ("threaded", "async")
+
+log = get_logger(__name__)
+
+
+class FleetSimulator:
+    def __init__(self, farms: int = 1, turbines_per_farm: int = 3,
+                 publish_interval: float = DEFAULT_PUBLISH_INTERVAL_S, pool_size: int = DEFAULT_POOL_SIZE,
+                 wire_format: str = "json", qos: int = 0, generator: str = "random", seed: int = None,
+                 mqtt_client: str = "threaded", max_inflight: int = None):
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"wire_format debe ser uno de {WIRE_FORMATS}")
+        if generator not in GENERATORS:
+            raise ValueError(f"generator debe ser uno de {GENERATORS}")
+        if mqtt_client not in MQTT_CLIENTS:
+            raise ValueError(f"mqtt_client debe ser uno de {MQTT_CLIENTS}")
+        self.publish_interval = publish_interval
+        self.qos = qos
+        total = farms * turbines_per_farm
+        self.pool_size = max(1, min(pool_size, total))
+
+        compact = wire_format != "json"
+        self.async_client = mqtt_client == "async"
+        self.conn_ids = [f"sim-fleet-{os.getpid()}-{i}" for i in range(self.pool_size)]
+        if self.async_client:
+            extra = {"max_inflight": max_inflight} if max_inflight else {}
+            self.pool = [
+                AsyncMQTTClient(client_id=conn_id, codec=wire_codec(wire_format),
+                                mqtt_v5=compact, log_publishes=False, **extra)
+                for conn_id in self.conn_ids
+            ]
+        else:
+            self.pool: List[GenericMQTTClient] = [
+                GenericMQTTClient(client_id=conn_id, codec=wire_codec(wire_format),
+                                  mqtt_v5=compact, log_publishes=False)
+                for conn_id in self.conn_ids
+            ]
+
+        self.turbines: List[WindTurbine] = []
+        carried: Dict[int, list] = {i: [] for i in range(self.pool_size)}
+        for farm_id in range(1, farms + 1):
+            for turbine_id in range(1, turbines_per_farm + 1):
+                conn = len(self.turbines) % self.pool_size
+                self.turbines.append(WindTurbine(farm_id, turbine_id, wire_format=wire_format,
+                                                 mqtt_client=self.pool[conn]))
+                carried[conn].append({"farm_id": farm_id, "turbine_id": turbine_id})
+
+        # estado por conexion: todas las turbinas que viajan por ella (nacimiento online / LWT offline)
+        for conn, turbines in carried.items():
+            topic = self.status_topic(conn)
+            self.pool[conn].set_birth(topic, self._status_payload(conn, "online", turbines), qos=1, retain=True)
+            self.pool[conn].set_lwt(topic, self._status_payload(conn, "offline", turbines), qos=1, retain=True)
+
+        self.compact = compact
+        self.batch_generator = None
+        self._batch_rows: List[dict] = []
+        if generator == "numpy":
+            from TurbineTelemetry.BatchTelemetryGenerator import BatchTelemetryGenerator  # requiere numpy
+            self.batch_generator = BatchTelemetryGenerator(
+                [t.farm_id for t in self.turbines], [t.turbine_id for t in self.turbines],
+                seed=seed, dt_s=publish_interval
+            )
+
+        self.published = 0
+        self.late = 0  # publicaciones que salieron con mas de un intervalo de atraso
+        self._stop = None
+
+    def status_topic(self, conn: int) -> str:
+        return FLEET_STATUS_TOPIC.format(conn_id=self.conn_ids[conn])
+
+    async def _publish(self, client, topic: str, payload, qos: int, retain: bool = False):
+        # async: espera lugar en la ventana y devuelve el future del ACK; threaded: MQTTMessageInfo
+        if self.async_client:
+            return await client.publish(topic, payload, qos=qos, retain=retain)
+        return client.publish(topic, payload, qos=qos, retain=retain)
+
+    def _status_payload(self, conn: int, state: str, turbines: List[dict]) -> str:
+        # estado siempre en JSON (el codec de la conexion puede ser binario/struct)
+        return json.dumps({"conn_id": self.conn_ids[conn], "state": state, "turbines": turbines})
+
+    def _advance_batch(self):
+        columns = self.batch_generator.tick()
+        self._batch_rows = self.batch_generator.payloads(columns, compact=self.compact)
+
+    async def _run_batch_ticks(self):
+        # un tick vectorizado por intervalo; cada turbina publica su fila en su turno
+        loop = asyncio.get_running_loop()
+        next_at = loop.time()
+        while not self._stop.is_set():
+            next_at += self.publish_interval
+            await asyncio.sleep(max(next_at - loop.time(), 0))
+            self._advance_batch()
+
+    def _telemetry(self, index: int, turbine: WindTurbine) -> dict:
+        if self.batch_generator is None:
+            return turbine.get_telemetry_data()
+        payload = self._batch_rows[index]
+        # timestamp al momento de publicar (las turbinas estan escalonadas dentro del tick)
+        if self.compact:
+            payload["timestamp"] = int(time.time() * 1000)
+        else:
+            payload["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        return payload
+
+    async def _run_turbine(self, index: int, turbine: WindTurbine, offset: float):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(offset)
+        next_at = loop.time()
+        while not self._stop.is_set():
+            await self._publish(turbine.mqtt_client, turbine.telemetry_topic, self._telemetry(index, turbine),
+                                qos=self.qos)
+            self.published += 1
+            # agenda absoluta: el intervalo no acumula deriva con la carga
+            next_at += self.publish_interval
+            delay = next_at - loop.time()
+            if delay < -self.publish_interval:
+                self.late += 1
+                next_at = loop.time()  # atrasado mas de un ciclo: se resincroniza sin rafaga
+                delay = 0
+            await asyncio.sleep(max(delay, 0))
+
+    async def _log_stats(self):
+        last, last_t = 0, time.monotonic()
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), STATS_LOG_INTERVAL_S)
+            except asyncio.TimeoutError:
+                pass
+            now = time.monotonic()
+            rate = (self.published - last) / max(now - last_t, 1e-6)
+            last, last_t = self.published, now
+            log.info("turbinas=%s conexiones=%s publicados=%s (%.0f msg/s) atrasados=%s",
+                     len(self.turbines), self.pool_size, self.published, rate, self.late)
+
+    async def run(self, duration: float = None):
+        """Conecta el pool y corre hasta duration segundos (None = hasta cancelar / Ctrl+C)."""
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for client in self.pool:
+            if self.async_client:
+                await client.connect()
+            else:
+                await loop.run_in_executor(None, client.connect)
+
+        n = len(self.turbines)
+        tasks = []
+        if self.batch_generator is not None:
+            self._advance_batch()
+            tasks.append(asyncio.create_task(self._run_batch_ticks()))
+        tasks += [asyncio.create_task(self._run_turbine(i, t, (i / n) * self.publish_interval))
+                  for i, t in enumerate(self.turbines)]
+        tasks.append(asyncio.create_task(self._log_stats()))
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                await asyncio.sleep(duration)
+        finally:
+            self._stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.async_client:
+                await self._stop_async()
+            else:
+                self.stop()
+
+    async def _stop_async(self):
+        pending = [await client.publish(self.status_topic(conn), b"", qos=1, retain=True)
+                   for conn, client in enumerate(self.pool)]
+        await asyncio.wait(pending, timeout=STOP_FLUSH_TIMEOUT_S)
+        for client in self.pool:
+            await client.disconnect(timeout=0)
+
+    def stop(self):
+        """Borra el estado retenido de cada conexion (cierre limpio) y desconecta el pool."""
+        pending = [client.publish(self.status_topic(conn), b"", qos=1, retain=True)
+                   for conn, client in enumerate(self.pool)]
+        deadline = time.monotonic() + STOP_FLUSH_TIMEOUT_S
+        for info in pending:  # QoS 1: esperar el PUBACK antes de cortar el loop de red
+            try:
+                info.wait_for_publish(max(deadline - time.monotonic(), 0.01))
+            except (RuntimeError, ValueError):
+                pass  # conexion caida: el LWT ya dejo la conexion offline
+        for client in self.pool:
+            client.disconnect()
@@ -1,36 +1,134 @@
 import math
+import os
 import random
 import threading
 import time
 
+import paho.mqtt.client as mqtt
+
+from Shared.DiskOutbox import DEFAULT_MAX_BYTES, DiskOutbox
 from Shared.GenericMQTTClient import GenericMQTTClient
+from Shared.Logging import get_logger
+from TurbineTelemetry.WindowSummary import WindowSummary
 
 
 # TOPIC_TELEMETRY = "farms/{farm_id}/turbines/+/raw_telemetry"  
 #TOPIC_TELEMETRY = "farms/1/turbines/+/raw_telemetry" # Para pruebas
 TOPIC_STATUS = "farm/turbine/status"
 
+# Formato de la telemetria publicada:
+#   'json'          payload completo legible (nombres + timestamp string local), el que consume el frontend
+#   'json-compact' / 'msgpack' / 'cbor' / 'struct'
+#                   sin farm_name/turbine_name y timestamp en epoch ms UTC (menos bytes y sin strptime
+#                   en el StatNode); se publica con MQTT 5 + Content-Type del codec
+WIRE_FORMATS = ("json", "json-compact", "msgpack", "cbor", "struct")
+
+# Modo de telemetria:
+#   'sample'   una muestra instantanea cada publish_interval
+#   'summary'  muestreo interno a sample_rate_hz y un resumen por publish_interval (ver WindowSummary);
+#              los transitorios (cambio de estado, vibracion que cruza el umbral) se publican al instante
+#              como muestra instantanea con el campo 'transient' (el StatNode los guarda y los evalua en
+#              alertas, pero no entran en metricas ni rollups: el resumen ya cubre ese tiempo).
+#              No disponible con 'struct' (esquema fijo).
+TELEMETRY_MODES = ("sample", "summary")
+SAMPLE_RATE_HZ = 1.0
+VIBRATION_TRANSIENT_MMS = 4.9
+STATE_HOLD_P = 0.995  # modo summary: a 1 Hz el estado se mantiene ~200 s en promedio
+
+# Store-and-forward (outbox_dir): sin conexion las muestras van a disco y se reenvian al reconectar
+REPLAY_RATE = 200.0        # mensajes/s maximos del reenvio (deja lugar al trafico en vivo)
+REPLAY_BATCH = 100         # mensajes por rafaga; se confirman en disco cuando el broker los acepto (QoS 1)
+REPLAY_ACK_TIMEOUT_S = 10.0
+REPLAY_IDLE_S = 1.0
+
+log = get_logger(__name__)
+
+STATES = ["operational", "maintenance", "standby", "fault", "stopped"]
+STATE_WEIGHTS = [0.8, 0.08, 0.06, 0.03, 0.03]
+
+
+def turbine_client_id(farm_id: int, turbine_id: int) -> str:
+    return f"F{farm_id}-T{turbine_id:03d}"  # F1-T001, F2-T001, ...
+
+
+def wire_codec(wire_format: str) -> str:
+    return "json" if wire_format in ("json", "json-compact") else wire_format
+
+
 class WindTurbine:
-    def __init__(self, farm_id: int, turbine_id: int):
+    def __init__(self, farm_id: int, turbine_id: int, wire_format: str = "json",
+                 mqtt_client: GenericMQTTClient = None, mode: str = "sample",
+                 sample_rate_hz: float = SAMPLE_RATE_HZ, outbox_dir: str = None,
+                 outbox_max_bytes: int = DEFAULT_MAX_BYTES, replay_rate: float = REPLAY_RATE):
+        """
+        mqtt_client: conexion compartida (p.ej. FleetSimulator); si no se pasa, la turbina
+        abre la suya con client_id unico F{farm}-T{turbine}.
+        mode: 'sample' | 'summary' (ver TELEMETRY_MODES); sample_rate_hz solo aplica a 'summary'.
+        outbox_dir: activa el store-and-forward (ver Shared.DiskOutbox) en outbox_dir/F{farm}-T{turbine}:
+        sin broker la turbina arranca igual, guarda en disco y al reconectar reenvia a replay_rate msg/s.
+        """
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"wire_format debe ser uno de {WIRE_FORMATS}")
+        if mode not in TELEMETRY_MODES:
+            raise ValueError(f"mode debe ser uno de {TELEMETRY_MODES}")
+        if mode == "summary" and wire_format == "struct":
+            raise ValueError("mode='summary' no es compatible con wire_format='struct'")
+        if sample_rate_hz <= 0:
+            raise ValueError("sample_rate_hz debe ser > 0")
         self.turbine_id = turbine_id
         self.farm_id = farm_id
+        self.wire_format = wire_format
+        self.compact = wire_format != "json"
         
         self.telemetry_topic = f"farms/{farm_id}/turbines/{turbine_id}/raw_telemetry"
         # self.status_topic = TOPIC_STATUS
         
-        # cliente mqtt con id unico
-        str_turbine_id = f"T-00{self.turbine_id}" # T-001, T-002, etc 
-        self.mqtt_client = GenericMQTTClient(client_id=str_turbine_id) 
+        # cliente mqtt con id unico en el broker (incluye farm: T-001 se repite entre parques)
+        if mqtt_client is None:
+            mqtt_client = GenericMQTTClient(client_id=turbine_client_id(farm_id, turbine_id),
+                                            codec=wire_codec(wire_format), mqtt_v5=self.compact)
+        self.mqtt_client = mqtt_client
         self.publish_interval = 10 # segundos
+        self.mode = mode
+        self.sample_rate_hz = sample_rate_hz
+        self._summary = WindowSummary() if mode == "summary" else None
+        self._state = None            # ultimo estado generado (persistente en modo summary)
+        self._vibration_high = False  # flanco de subida del transitorio de vibracion
+        self.outbox = None
+        if outbox_dir:
+            self.outbox = DiskOutbox(os.path.join(outbox_dir, turbine_client_id(farm_id, turbine_id)),
+                                     max_bytes=outbox_max_bytes)
+        self.replay_rate = replay_rate
         self._stop_event = threading.Event()
         self._thread = None
+        self._replay_thread = None
+
+    def _next_state(self) -> str:
+        if self.mode == "summary" and self._state is not None and random.random() < STATE_HOLD_P:
+            return self._state
+        return random.choices(STATES, weights=STATE_WEIGHTS, k=1)[0]
+
+    def _identity(self) -> dict:
+        if self.compact:
+            # sin nombres legibles; timestamp en epoch ms UTC
+            return {
+                "farm_id": self.farm_id,
+                "turbine_id": self.turbine_id,
+                "timestamp": int(time.time() * 1000),
+            }
+        return {
+            "farm_id": self.farm_id,
+            "farm_name": f"Farm-{self.farm_id:03d}",
+            "turbine_id": self.turbine_id,
+            "turbine_name": f"T-{self.turbine_id:03d}",
+
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
 
     def get_telemetry_data(self) -> dict:
         capacity_mw: float = 2.5
         
-        states = ["operational", "maintenance", "standby", "fault", "stopped"]
-        weights = [0.8, 0.08, 0.06, 0.03, 0.03]
-        state = random.choices(states, weights=weights, k=1)[0]
+        state = self._next_state()
         is_active = state == "operational"
 
         # Entorno
@@ -62,12 +160,7 @@ class WindTurbine:
 
         return {
             # Identificacion
-            "farm_id": self.farm_id,
-            "farm_name": f"Farm-00{self.farm_id}",
-            "turbine_id": self.turbine_id,
-            "turbine_name": f"T-00{self.turbine_id}",
-
-            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            **self._identity(),
 
             # Variables
             "wind_speed_mps": wind_speed_mps,
@@ -102,27 +195,122 @@ class WindTurbine:
         lwt_payload = {"turbine_id": self.turbine_id, "state": "offline"}
         self.mqtt_client.set_lwt(TOPIC_STATUS, lwt_payload, qos=1, retain=True)
 
-        self.mqtt_client.connect()
+        # con outbox no se exige broker al arrancar: paho reintenta y mientras tanto se guarda en disco
+        self.mqtt_client.connect(wait=self.outbox is None)
        
         # arrancar hilo que publica telemetría
         if self._thread is None or not self._thread.is_alive():
             self._stop_event.clear()
-            self._thread = threading.Thread(target=self._send_telemetry, daemon=True)
+            target = self._send_summaries if self.mode == "summary" else self._send_telemetry
+            self._thread = threading.Thread(target=target, daemon=True)
             self._thread.start()
+            if self.outbox is not None:
+                self._replay_thread = threading.Thread(target=self._replay_outbox, daemon=True)
+                self._replay_thread.start()
+
+    def _publish(self, topic: str, payload, qos: int = 0):
+        """Publica en vivo; con outbox, si no hay conexion (o paho no lo acepta) lo guarda en disco."""
+        if self.outbox is None:
+            self.mqtt_client.publish(topic, payload, qos=qos, retain=False)
+            return
+        if self.mqtt_client.is_connected():
+            # sin conexion no se llama a publish: paho encolaria QoS>0 en memoria sin limite
+            info = self.mqtt_client.publish(topic, payload, qos=qos, retain=False)
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                return
+        if not isinstance(payload, (str, bytes)):
+            payload = self.mqtt_client.codec.encode(payload)
+        elif isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self.outbox.append(topic, payload)
+
+    def _replay_outbox(self):
+        # reenvio en rafagas de REPLAY_BATCH a replay_rate msg/s; el cursor avanza solo con el PUBACK
+        while not self._stop_event.is_set():
+            if not self.outbox.pending or not self.mqtt_client.is_connected():
+                self._stop_event.wait(REPLAY_IDLE_S)
+                continue
+            records, token = self.outbox.read_batch(REPLAY_BATCH)
+            infos = [self.mqtt_client.publish(topic, payload, qos=1) for topic, payload in records]
+            acked = all(info.rc == mqtt.MQTT_ERR_SUCCESS for info in infos)
+            try:
+                for info in infos if acked else ():
+                    info.wait_for_publish(REPLAY_ACK_TIMEOUT_S)
+                    if not info.is_published():
+                        acked = False
+                        break
+            except (RuntimeError, ValueError):  # desconectado a mitad del lote
+                acked = False
+            if acked:
+                self.outbox.commit(token)
+                if not self.outbox.pending:
+                    log.info("outbox vaciado", extra={"turbine": turbine_client_id(self.farm_id, self.turbine_id),
+                                                      **self.outbox.stats()})
+            else:
+                # se reintenta el mismo lote (entrega al menos una vez: puede haber duplicados)
+                self._stop_event.wait(REPLAY_IDLE_S)
+                continue
+            self._stop_event.wait(len(records) / self.replay_rate)
 
     def _send_telemetry(self):
         while not self._stop_event.is_set():
             data: dict = self.get_telemetry_data()
             # el payload lo crea la entidad; el cliente solo publica en el topic que se le pasa
             # conversion data a JSON lo hace mqtt_client 
-            self.mqtt_client.publish(self.telemetry_topic, data, qos=0, retain=False)
+            self._publish(self.telemetry_topic, data, qos=0)
             self._stop_event.wait(self.publish_interval)
 
+    def _send_summaries(self):
+        period = 1.0 / self.sample_rate_hz
+        last = window_start = time.monotonic()
+        next_tick = last + period
+        while not self._stop_event.wait(max(next_tick - time.monotonic(), 0.0)):
+            now = time.monotonic()
+            sample = self.get_telemetry_data()
+            self._summary.add(sample, now - last)
+            last = now
+
+            reason = self._transient(sample)
+            if reason:
+                self._publish(self.telemetry_topic, {**sample, "transient": reason}, qos=1)
+            if now - window_start >= self.publish_interval:
+                self._publish_summary(sample)
+                window_start = now
+
+            next_tick += period
+            if now - next_tick > period:
+                next_tick = now + period  # atrasado mas de un periodo: se resincroniza sin rafaga
+        if self._summary.samples:
+            self._publish_summary(None)  # intervalo parcial al detener
+
+    def _transient(self, sample: dict):
+        """Motivo si la muestra es un transitorio a publicar ya (solo en el flanco, no mientras dura)."""
+        state = sample["operational_state"]
+        reason = None
+        if self._state is not None and state != self._state:
+            reason = f"state:{self._state}->{state}"
+        vibration_high = sample["vibrations_mms"] >= VIBRATION_TRANSIENT_MMS
+        if vibration_high and not self._vibration_high and reason is None:
+            reason = "vibrations_mms"
+        self._state, self._vibration_high = state, vibration_high
+        return reason
+
+    def _publish_summary(self, last_sample):
+        payload = {**self._identity(), **self._summary.to_payload(), "capacity_mw": 2.5}
+        if last_sample is not None:
+            payload["wind_direction_deg"] = last_sample["wind_direction_deg"]  # angular: ultimo valor
+        self._summary.reset()
+        self._publish(self.telemetry_topic, payload, qos=0)
+
     def stop(self):
         """Detiene el hilo, limpia retained status y desconecta (todo desde la entidad)."""
         self._stop_event.set()
         if self._thread:
             self._thread.join()
+        if self._replay_thread:
+            self._replay_thread.join()
+        if self.outbox is not None:
+            self.outbox.close()  # lo pendiente queda en disco para el proximo arranque
         # limpiar retained status 
         self.mqtt_client.clear_retained(TOPIC_STATUS)
         self.mqtt_client.disconnect()
\ No newline at end of file
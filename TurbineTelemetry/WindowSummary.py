@@ -0,0 +1,97 @@
+# Resumen por intervalo de muestras tomadas en la turbina (modo summary de WindTurbine)
+"""
+La turbina muestrea a alta frecuencia (p.ej. 1 Hz) y publica un mensaje por intervalo:
+
+- estadisticas por variable (min, max, mean, std) con Welford: O(1) por muestra, sin
+  guardar las muestras y numericamente estable;
+- segundos en cada estado operativo y fraccion del intervalo en 'operational';
+- energia integrada en origen (kWh = sum(P_kW * dt) / 3600).
+
+El payload conserva la forma de una muestra instantanea (variables con su valor medio,
+estado dominante) para que el StatNode lo ingiera sin cambios; el detalle va en 'stats'.
+"""
+import math
+from typing import Dict, Optional, Sequence
+
+# variables numericas resumidas (las de get_telemetry_data salvo la direccion del viento,
+# que es angular y su media aritmetica no tiene sentido)
+SUMMARY_FIELDS = (
+    "wind_speed_mps", "rotor_speed_rpm", "blade_pitch_angle_deg", "yaw_position_deg",
+    "vibrations_mms", "gear_temperature_c", "bearing_temperature_c", "output_voltage_v",
+    "generated_current_a", "active_power_kw", "reactive_power_kvar",
+)
+
+
+class RunningStats:
+    """min / max / media / desvio (poblacional) incrementales (algoritmo de Welford)."""
+    __slots__ = ("count", "mean", "m2", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def as_dict(self, digits: int = 3) -> Optional[Dict[str, float]]:
+        if not self.count:
+            return None
+        return {"min": round(self.min, digits), "max": round(self.max, digits),
+                "mean": round(self.mean, digits), "std": round(self.std, digits)}
+
+
+class WindowSummary:
+    def __init__(self, fields: Sequence[str] = SUMMARY_FIELDS):
+        self.fields = tuple(fields)
+        self.reset()
+
+    def reset(self):
+        self.stats = {f: RunningStats() for f in self.fields}
+        self.state_durations: Dict[str, float] = {}
+        self.energy_kwh = 0.0
+        self.duration_s = 0.0
+        self.samples = 0
+
+    def add(self, sample: dict, dt_s: float):
+        """Agrega una muestra que representa los dt_s segundos previos (retencion de orden cero)."""
+        self.samples += 1
+        self.duration_s += dt_s
+        for f in self.fields:
+            v = sample.get(f)
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                self.stats[f].add(float(v))
+        state = sample.get("operational_state")
+        self.state_durations[state] = self.state_durations.get(state, 0.0) + dt_s
+        power = sample.get("active_power_kw")
+        if isinstance(power, (int, float)):
+            self.energy_kwh += power * dt_s / 3600.0
+
+    def to_payload(self) -> dict:
+        """Campos del mensaje de resumen (sin identidad ni timestamp, los agrega la turbina)."""
+        dominant = max(self.state_durations, key=self.state_durations.get) if self.state_durations else None
+        out = {f: round(st.mean, 2) for f, st in self.stats.items() if st.count}
+        out.update({
+            "operational_state": dominant,
+            "active_fraction": (round(self.state_durations.get("operational", 0.0) / self.duration_s, 4)
+                                if self.duration_s else None),
+            "energy_kwh": round(self.energy_kwh, 5),
+            "window_s": round(self.duration_s, 3),
+            "samples": self.samples,
+            "state_durations_s": {s: round(d, 3) for s, d in self.state_durations.items()},
+            "stats": {f: st.as_dict() for f, st in self.stats.items() if st.count},
+        })
+        return out
@@ -1,23 +1,96 @@
+import argparse
+import asyncio
 import time
 
-from TurbineTelemetry.WindTurbine import WindTurbine
+from Shared.Logging import get_logger, setup_logging
+from TurbineTelemetry.FleetSimulator import DEFAULT_POOL_SIZE, MQTT_CLIENTS, FleetSimulator
+from TurbineTelemetry.WindTurbine import SAMPLE_RATE_HZ, TELEMETRY_MODES, WIRE_FORMATS, WindTurbine
 
-if __name__ == "__main__":
-    # -- Turbinas simuluacion 
-    turbine1 = WindTurbine(farm_id=1, turbine_id=1)
-    turbine2 = WindTurbine(farm_id=1, turbine_id=2)
-    turbine3 = WindTurbine(farm_id=1, turbine_id=3)
-    # arranque turbina (conexion mqtt y envio de telemetria)
-    turbine1.start() 
-    turbine2.start()
-    turbine3.start()
-    print("Simulador corriendo. Presiona Ctrl+C para detener.")
-    
+log = get_logger("TurbineTelemetry.main")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador de turbinas eolicas (telemetria MQTT)")
+    parser.add_argument("--mode", choices=("threads", "fleet"), default="threads",
+                        help="threads: un hilo y una conexion por turbina | fleet: asyncio + pool de conexiones")
+    parser.add_argument("--farms", type=int, default=1)
+    parser.add_argument("--turbines-per-farm", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=0.1,
+                        help="mensajes por segundo por turbina (0.1 = uno cada 10 s)")
+    parser.add_argument("--connections", type=int, default=DEFAULT_POOL_SIZE,
+                        help="conexiones MQTT del pool (solo modo fleet)")
+    parser.add_argument("--mqtt-client", choices=MQTT_CLIENTS, default="threaded",
+                        help="async: pool de AsyncMQTTClient en el event loop, ventana de in-flight (solo modo fleet)")
+    parser.add_argument("--wire-format", choices=WIRE_FORMATS, default="json")
+    parser.add_argument("--telemetry-mode", choices=TELEMETRY_MODES, default="sample",
+                        help="summary: muestreo interno a --sample-rate y un resumen por intervalo (solo modo threads)")
+    parser.add_argument("--sample-rate", type=float, default=SAMPLE_RATE_HZ,
+                        help="muestras por segundo internas del modo summary")
+    parser.add_argument("--generator", choices=("random", "numpy"), default="random",
+                        help="numpy: ticks vectorizados con curva de potencia y viento correlacionado (solo modo fleet)")
+    parser.add_argument("--seed", type=int, default=None, help="semilla del generador numpy (reproducible)")
+    parser.add_argument("--outbox-dir", default=None,
+                        help="store-and-forward en disco mientras no hay broker (solo modo threads)")
+    parser.add_argument("--duration", type=float, default=None, help="segundos de simulacion (default: hasta Ctrl+C)")
+    parser.add_argument("--log-level", default=None,
+                        help="DEBUG incluye cada payload publicado (default: LOG_LEVEL o INFO)")
+    args = parser.parse_args(argv)
+    if args.rate <= 0:
+        parser.error("--rate debe ser > 0")
+    if args.telemetry_mode == "summary" and args.mode != "threads":
+        parser.error("--telemetry-mode summary solo esta disponible con --mode threads")
+    if args.outbox_dir and args.mode != "threads":
+        parser.error("--outbox-dir solo esta disponible con --mode threads")
+    if args.telemetry_mode == "summary" and args.wire_format == "struct":
+        parser.error("--telemetry-mode summary no es compatible con --wire-format struct")
+    return args
+
+
+def run_threads(args):
+    # -- Turbinas simuluacion (una conexion y un hilo por turbina)
+    turbines = [
+        WindTurbine(farm_id=farm_id, turbine_id=turbine_id, wire_format=args.wire_format,
+                    mode=args.telemetry_mode, sample_rate_hz=args.sample_rate, outbox_dir=args.outbox_dir)
+        for farm_id in range(1, args.farms + 1)
+        for turbine_id in range(1, args.turbines_per_farm + 1)
+    ]
+    for turbine in turbines:
+        turbine.publish_interval = 1.0 / args.rate
+        # arranque turbina (conexion mqtt y envio de telemetria)
+        turbine.start()
+    log.info("Simulador corriendo. Presiona Ctrl+C para detener.")
+
+    started = time.monotonic()
     try:
-        # Mantener el hilo principal vivo mientras la turbina publica
-        while True:
+        # Mantener el hilo principal vivo mientras las turbinas publican
+        while args.duration is None or time.monotonic() - started < args.duration:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("\nDeteniendo turbina...")
-        turbine1.stop()
-        print("Turbina detenida. Saliendo.")
\ No newline at end of file
+        pass
+    log.info("Deteniendo turbinas...")
+    for turbine in turbines:
+        turbine.stop()
+    log.info("Turbinas detenidas. Saliendo.")
+
+
+def run_fleet(args):
+    sim = FleetSimulator(farms=args.farms, turbines_per_farm=args.turbines_per_farm,
+                         publish_interval=1.0 / args.rate, pool_size=args.connections,
+                         wire_format=args.wire_format, generator=args.generator, seed=args.seed,
+                         mqtt_client=args.mqtt_client)
+    log.info("Simulador de flota: %s turbinas sobre %s conexiones. Ctrl+C para detener.",
+             len(sim.turbines), sim.pool_size)
+    try:
+        asyncio.run(sim.run(duration=args.duration))
+    except KeyboardInterrupt:
+        pass
+    log.info("Flota detenida. Saliendo.")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    setup_logging(level=args.log_level)
+    if args.mode == "fleet":
+        run_fleet(args)
+    else:
+        run_threads(args)
@@ -0,0 +1,251 @@
+# Dobles en proceso para los benchmarks (broker MQTT y Mongo en memoria)
+"""
+- InProcessBroker: reemplazo del broker para medir la cadena sin red. Los clientes paho de
+  cada GenericMQTTClient se sustituyen con attach(); un hilo despachador entrega los
+  mensajes a los suscriptores (como el hilo de red de paho), con matching de wildcards.
+  Suscripciones compartidas ($share/grupo/filtro): un miembro por mensaje, elegido por
+  hash del topic (como la estrategia hash_topic de EMQX).
+- MemoryMongoClient: GenericMongoClient que solo cuenta escrituras (sumidero). No soporta
+  lecturas: las metricas deben salir del RollingWindowAggregator.
+- LatencyRecorder: envuelve cualquier GenericMongoClient y registra, para cada documento
+  escrito, la latencia publicacion -> persistencia (a partir de su 'timestamp').
+"""
+import queue
+import threading
+import time
+import zlib
+from array import array
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+from Shared.GenericMongoClient import GenericMongoClient
+
+
+class _Message:
+    __slots__ = ("topic", "payload", "qos", "retain", "properties", "mid")
+
+    def __init__(self, topic, payload, qos, retain, properties):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = properties
+        self.mid = 0
+
+
+class _PublishInfo:
+    rc = mqtt.MQTT_ERR_SUCCESS
+
+    def wait_for_publish(self, timeout=None):
+        return None
+
+    def is_published(self) -> bool:
+        return True
+
+
+class InProcessClient:
+    """Subconjunto de paho.mqtt.client.Client que usa GenericMQTTClient."""
+    def __init__(self, broker: "InProcessBroker", client_id: str):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_message = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self._callbacks = []  # (filtro, callback) de message_callback_add
+
+    def will_set(self, topic, payload=None, qos=0, retain=False, properties=None):
+        pass  # el broker en proceso no se cae: el LWT nunca se dispara
+
+    def connect(self, host, port=1883, keepalive=60, **kwargs):
+        if self.on_connect:
+            self.on_connect(self, None, {}, 0, None)
+        return mqtt.MQTT_ERR_SUCCESS
+
+    def connect_async(self, host, port=1883, keepalive=60, **kwargs):
+        self.connect(host, port, keepalive, **kwargs)
+
+    def loop_start(self):
+        pass
+
+    def is_connected(self) -> bool:
+        return True
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self, *args, **kwargs):
+        self.broker.unsubscribe_all(self)
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.broker.route(topic, payload, qos, retain, properties)
+        return _PublishInfo()
+
+    def subscribe(self, topic, qos=0, **kwargs):
+        self.broker.subscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, 0
+
+    def unsubscribe(self, topic, **kwargs):
+        self.broker.unsubscribe(self, topic)
+        return mqtt.MQTT_ERR_SUCCESS, 0
+
+    def message_callback_add(self, sub, callback):
+        self._callbacks.append((sub, callback))
+
+    def message_callback_remove(self, sub):
+        self._callbacks = [(s, cb) for s, cb in self._callbacks if s != sub]
+
+    def _deliver(self, msg: _Message):
+        for sub, callback in self._callbacks:
+            if mqtt.topic_matches_sub(sub, msg.topic):
+                callback(self, None, msg)
+                return
+        if self.on_message:
+            self.on_message(self, None, msg)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        self._subs = []  # (cliente, filtro)
+        self._lock = threading.Lock()
+        self.routed = 0
+        self.delivered = 0
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def client(self, client_id: str = "") -> InProcessClient:
+        return InProcessClient(self, client_id)
+
+    def attach(self, generic_client):
+        """Reemplaza el cliente paho de un GenericMQTTClient por uno de este broker."""
+        fake = self.client(generic_client._client_id)
+        fake.on_connect = generic_client.client.on_connect
+        fake.on_disconnect = generic_client.client.on_disconnect
+        generic_client.client = fake
+        return fake
+
+    def subscribe(self, client: InProcessClient, topic: str):
+        with self._lock:
+            self._subs.append((client, topic))
+
+    def unsubscribe(self, client: InProcessClient, topic: str):
+        with self._lock:
+            self._subs = [(c, t) for c, t in self._subs if not (c is client and t == topic)]
+
+    def unsubscribe_all(self, client: InProcessClient):
+        with self._lock:
+            self._subs = [(c, t) for c, t in self._subs if c is not client]
+
+    def route(self, topic, payload, qos, retain, properties):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self.routed += 1
+        self._queue.put(_Message(topic, payload or b"", qos, retain, properties))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _dispatch(self):
+        while True:
+            msg = self._queue.get()
+            with self._lock:
+                subs = list(self._subs)
+            groups = {}  # (grupo, filtro) -> miembros
+            for client, sub in subs:
+                if sub.startswith("$share/"):
+                    _, group, real = sub.split("/", 2)
+                    if mqtt.topic_matches_sub(real, msg.topic):
+                        groups.setdefault((group, real), []).append(client)
+                elif mqtt.topic_matches_sub(sub, msg.topic):
+                    client._deliver(msg)
+                    self.delivered += 1
+            for members in groups.values():
+                members[zlib.crc32(msg.topic.encode("utf-8")) % len(members)]._deliver(msg)
+                self.delivered += 1
+
+
+class MemoryMongoClient(GenericMongoClient):
+    """Sumidero de escrituras: cuenta documentos y operaciones, no los guarda."""
+    def __init__(self, db_name: str = "bench_db"):
+        super().__init__(uri="memory://", db_name=db_name)
+        self.inserted = 0
+        self.bulk_ops = 0
+        self._lock = threading.Lock()
+
+    def connect(self):
+        pass
+
+    def get_collection(self, collection_name: str):
+        raise NotImplementedError("MemoryMongoClient no soporta lecturas (usar --mongo-uri)")
+
+    def create_collection(self, collection_name: str, **options):
+        return None
+
+    def create_index(self, collection_name: str, keys: list, **kwargs) -> str:
+        return kwargs.get("name", "")
+
+    def drop_superseded_indexes(self, collection_name: str, superseded: list) -> list:
+        return []
+
+    def insert_one(self, collection_name: str, document: dict):
+        with self._lock:
+            self.inserted += 1
+            return self.inserted
+
+    def insert_many(self, collection_name: str, documents: list, ordered: bool = False):
+        with self._lock:
+            self.inserted += len(documents)
+        return len(documents)
+
+    def bulk_write(self, collection_name: str, operations: list, ordered: bool = False):
+        with self._lock:
+            self.bulk_ops += len(operations)
+        return None
+
+    def close(self):
+        pass
+
+
+def _ts_seconds(ts):
+    return ts.timestamp() if isinstance(ts, datetime) else None
+
+
+class LatencyRecorder:
+    """
+    Proxy de un GenericMongoClient: registra (instante de persistencia, latencia) de cada
+    documento escrito en la coleccion de telemetria. El resto de los metodos se delega.
+    """
+    def __init__(self, mongo: GenericMongoClient, collections=("telemetry", "telemetry_ts")):
+        self._mongo = mongo
+        self._collections = set(collections)
+        self._lock = threading.Lock()
+        self.persisted_at = array("d")
+        self.latencies = array("d")
+
+    def __getattr__(self, name):
+        return getattr(self._mongo, name)
+
+    def _record(self, docs):
+        now = time.time()
+        lats = [now - t for t in (_ts_seconds(d.get("timestamp")) for d in docs) if t is not None]
+        with self._lock:
+            self.latencies.extend(lats)
+            self.persisted_at.extend([now] * len(lats))
+
+    def insert_one(self, collection_name: str, document: dict):
+        result = self._mongo.insert_one(collection_name, document)
+        if collection_name in self._collections:
+            self._record([document])
+        return result
+
+    def insert_many(self, collection_name: str, documents: list, ordered: bool = False):
+        result = self._mongo.insert_many(collection_name, documents, ordered=ordered)
+        if collection_name in self._collections:
+            self._record(documents)
+        return result
+
+    def window(self, start: float, end: float):
+        """Latencias de los documentos persistidos en [start, end)."""
+        with self._lock:
+            return [lat for t, lat in zip(self.persisted_at, self.latencies) if start <= t < end]
@@ -0,0 +1,283 @@
+# Benchmark end-to-end de la ingesta: turbinas -> broker -> RawTelemetrySuscriber -> TelemetryDB
+#                                      -> ProcessedTelemetryPublisher
+"""
+Levanta la cadena completa en un proceso y la alimenta con FleetSimulator a tasa fija.
+Reporta (JSON, para comparar corridas):
+- msgs/s sostenidos persistidos en la ventana de medicion (despues del warmup)
+- latencia publicacion -> persistencia p50/p90/p99/max (timestamp epoch ms del payload)
+- duracion del ciclo de publicacion de metricas p50/p99/max y llegadas al topico procesado
+- profundidad maxima de la cola de ingesta, descartes, tiempo de drenado
+- CPU (user/sys, % de un core) y RSS maximo del proceso
+
+Por defecto todo en memoria (InProcessBroker + MemoryMongoClient; las metricas salen del
+RollingWindowAggregator). Con --broker / --mongo-uri usa EMQX/mosquitto y mongod locales.
+
+Uso:
+    python -m benchmarks.ingest_e2e --turbines 2000 --rate 1 --duration 30
+    python -m benchmarks.ingest_e2e --broker localhost:1883 --mongo-uri mongodb://localhost:27017
+    python -m benchmarks.ingest_e2e --farms 4 --shared-subscribers 3   # $share, todos los farms
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from Shared.GenericMongoClient import GenericMongoClient
+from Shared.GenericMQTTClient import GenericMQTTClient
+from Shared.Logging import setup_logging
+from Shared.MongoSingleton import MongoSingleton
+from StatNode.DB.RollingAggregator import RollingWindowAggregator
+from StatNode.MQTT.telemetry_pub import ProcessedTelemetryPublisher
+from StatNode.MQTT.telemetry_sub import RawTelemetrySuscriber
+from TurbineTelemetry.FleetSimulator import FleetSimulator
+from benchmarks.fakes import InProcessBroker, LatencyRecorder, MemoryMongoClient
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SAMPLE_INTERVAL_S = 0.5
+DRAIN_TIMEOUT_S = 60
+METRICS_WINDOW_MINUTES = 1
+
+
+def percentile(values, pct: float):
+    """Percentil por rango mas cercano (None si no hay muestras)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _summary(values, scale: float = 1000.0) -> dict:
+    # segundos -> ms
+    pick = lambda v: None if v is None else round(v * scale, 3)
+    return {
+        "count": len(values),
+        "p50_ms": pick(percentile(values, 50)),
+        "p90_ms": pick(percentile(values, 90)),
+        "p99_ms": pick(percentile(values, 99)),
+        "max_ms": pick(max(values) if values else None),
+    }
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _rusage():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime, ru.ru_stime, ru.ru_maxrss  # maxrss en KB (Linux)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end de ingesta de telemetria")
+    parser.add_argument("--farms", type=int, default=1)
+    parser.add_argument("--turbines", type=int, default=500, help="turbinas por farm")
+    parser.add_argument("--rate", type=float, default=1.0, help="mensajes/s por turbina")
+    parser.add_argument("--duration", type=float, default=30.0, help="segundos de medicion")
+    parser.add_argument("--warmup", type=float, default=5.0, help="segundos descartados al inicio")
+    parser.add_argument("--wire-format", choices=("json-compact", "msgpack", "cbor", "struct"), default="json-compact")
+    parser.add_argument("--generator", choices=("random", "numpy"), default="random")
+    parser.add_argument("--connections", type=int, default=8, help="conexiones MQTT del simulador")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--queue-maxsize", type=int, default=20_000)
+    parser.add_argument("--backpressure", choices=("block", "drop_oldest", "spill"), default="block")
+    parser.add_argument("--no-rollups", action="store_true")
+    parser.add_argument("--no-aggregator", action="store_true", help="metricas desde Mongo (requiere --mongo-uri)")
+    parser.add_argument("--shared-subscribers", type=int, default=0,
+                        help="N suscriptores en un grupo $share para todos los farms (default: uno por farm); "
+                             "sin agregador: metricas publicadas solo con --mongo-uri")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="segundos entre publicaciones de metricas")
+    parser.add_argument("--broker", default=None, help="host:puerto de un broker real (default: en proceso)")
+    parser.add_argument("--mongo-uri", default=None, help="mongod real (default: sumidero en memoria)")
+    parser.add_argument("--mongo-db", default="bench_db")
+    parser.add_argument("--out", default=None, help="archivo JSON de resultados (default: benchmarks/results/)")
+    parser.add_argument("--verbose", action="store_true", help="logs INFO de la cadena (default: solo WARNING)")
+    args = parser.parse_args(argv)
+    if args.no_aggregator and not args.mongo_uri:
+        parser.error("--no-aggregator requiere --mongo-uri (el sumidero en memoria no soporta lecturas)")
+    return args
+
+
+def _setup_mongo(args) -> LatencyRecorder:
+    if args.mongo_uri:
+        mongo = GenericMongoClient(uri=args.mongo_uri, db_name=args.mongo_db)
+        mongo.connect()
+    else:
+        mongo = MemoryMongoClient(db_name=args.mongo_db)
+    recorder = LatencyRecorder(mongo)
+    # TelemetryDB obtiene su conector del singleton
+    MongoSingleton._instance = recorder
+    return recorder
+
+
+def _wire(client: GenericMQTTClient, broker: InProcessBroker, broker_addr):
+    if broker is not None:
+        broker.attach(client)
+    else:
+        client.broker_host, client.broker_port = broker_addr
+
+
+def run(args) -> dict:
+    recorder = _setup_mongo(args)
+    broker = None if args.broker else InProcessBroker()
+    broker_addr = None
+    if args.broker:
+        host, _, port = args.broker.partition(":")
+        broker_addr = (host, int(port or 1883))
+
+    subs, pubs = [], []
+    for member in range(args.shared_subscribers):
+        sub = RawTelemetrySuscriber(None, batch_size=args.batch_size, queue_maxsize=args.queue_maxsize,
+                                    workers=args.workers, backpressure=args.backpressure,
+                                    maintain_rollups=not args.no_rollups, share_group="bench-ingest",
+                                    member_id=f"m{member}")
+        _wire(sub.mqtt_client, broker, broker_addr)
+        subs.append(sub)
+    for farm_id in range(1, args.farms + 1):
+        if args.shared_subscribers and not args.mongo_uri:
+            break  # el sumidero en memoria no responde consultas: sin publishers
+        if args.shared_subscribers:
+            pub = ProcessedTelemetryPublisher(farm_id, publish_interval=args.metrics_interval,
+                                              initial_delay=args.warmup, window_minutes=METRICS_WINDOW_MINUTES)
+            _wire(pub.mqtt_client, broker, broker_addr)
+            pubs.append(pub)
+            continue
+        aggregator = None
+        if not args.no_aggregator:
+            aggregator = RollingWindowAggregator(window_minutes=METRICS_WINDOW_MINUTES)
+            # sin historial previo: la ventana se considera cubierta desde el arranque
+            aggregator.started_at -= METRICS_WINDOW_MINUTES * 60
+        sub = RawTelemetrySuscriber(farm_id, batch_size=args.batch_size, queue_maxsize=args.queue_maxsize,
+                                    workers=args.workers, backpressure=args.backpressure,
+                                    aggregator=aggregator, maintain_rollups=not args.no_rollups)
+        pub = ProcessedTelemetryPublisher(farm_id, publish_interval=args.metrics_interval,
+                                          db_service=sub.db_service, initial_delay=args.warmup,
+                                          window_minutes=METRICS_WINDOW_MINUTES)
+        _wire(sub.mqtt_client, broker, broker_addr)
+        _wire(pub.mqtt_client, broker, broker_addr)
+        subs.append(sub)
+        pubs.append(pub)
+
+    # sonda: llegadas de telemetria procesada
+    arrivals = []
+    probe = GenericMQTTClient(client_id=f"bench-probe-{os.getpid()}", log_publishes=False)
+    _wire(probe, broker, broker_addr)
+
+    sim = FleetSimulator(farms=args.farms, turbines_per_farm=args.turbines, publish_interval=1.0 / args.rate,
+                         pool_size=args.connections, wire_format=args.wire_format, generator=args.generator)
+    for client in sim.pool:
+        _wire(client, broker, broker_addr)
+
+    for sub in subs:
+        sub.start(block=False)
+    for pub in pubs:
+        pub.start(block=False)
+    probe.connect()
+    probe.subscribe("farms/+/proc_telemetry", lambda c, u, msg: arrivals.append(time.time()))
+
+    sim_thread = threading.Thread(target=lambda: asyncio.run(sim.run(duration=args.warmup + args.duration)),
+                                  daemon=True)
+    t0 = time.time()
+    sim_thread.start()
+
+    # muestreo de profundidad de cola mientras corre
+    max_depth = 0
+    measure_start = measure_end = None
+    usage_start = None
+    published_start = 0
+    while sim_thread.is_alive():
+        time.sleep(SAMPLE_INTERVAL_S)
+        now = time.time()
+        max_depth = max([max_depth] + [s.work_queue.depth() for s in subs])
+        if measure_start is None and now - t0 >= args.warmup:
+            measure_start, usage_start, published_start = now, _rusage(), sim.published
+        if measure_end is None and now - t0 >= args.warmup + args.duration:
+            measure_end, usage_end, published_end = now, _rusage(), sim.published
+    sim_thread.join()
+    if measure_end is None:
+        measure_end, usage_end, published_end = time.time(), _rusage(), sim.published
+
+    # drenado: lo encolado se procesa y el buffer de TelemetryDB se escribe
+    drain_started = time.time()
+    while broker is not None and broker.pending() and time.time() - drain_started < DRAIN_TIMEOUT_S:
+        time.sleep(0.05)
+    for pub in pubs:
+        pub.stop()
+    for sub in subs:
+        sub.stop()
+    drain_s = time.time() - drain_started
+    probe.disconnect()
+
+    window_s = measure_end - measure_start
+    latencies = recorder.window(measure_start, measure_end)
+    cycles = [d for pub in pubs for d in pub.cycle_durations]
+    gaps = [b - a for a, b in zip(arrivals, arrivals[1:])]
+    cpu_user = usage_end[0] - usage_start[0]
+    cpu_sys = usage_end[1] - usage_start[1]
+    queue_stats = [s.stats() for s in subs]
+
+    return {
+        "benchmark": "ingest_e2e",
+        "started_at": datetime.fromtimestamp(t0, tz=timezone.utc).isoformat(),
+        "git_rev": _git_rev(),
+        "python": sys.version.split()[0],
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "verbose")},
+        "results": {
+            "measure_window_s": round(window_s, 3),
+            "turbines": len(sim.turbines),
+            "offered_msgs_per_s": round(len(sim.turbines) * args.rate, 1),
+            "published_msgs_per_s": round((published_end - published_start) / window_s, 1),
+            "persisted_msgs_per_s": round(len(latencies) / window_s, 1),
+            "persisted_total": len(recorder.latencies),
+            "published_total": sim.published,
+            "publish_to_persist": _summary(latencies),
+            "metrics_cycle": _summary(cycles),
+            "metrics_arrivals": len(arrivals),
+            "metrics_max_gap_s": round(max(gaps), 3) if gaps else None,
+            "queue_max_depth": max_depth,
+            "queue_dropped": sum(q["dropped"] for q in queue_stats),
+            "queue_errors": sum(q["errors"] for q in queue_stats),
+            "drain_s": round(drain_s, 3),
+            "cpu_user_s": round(cpu_user, 3),
+            "cpu_sys_s": round(cpu_sys, 3),
+            "cpu_pct_one_core": round((cpu_user + cpu_sys) / window_s * 100.0, 1),
+            "rss_max_mb": round(usage_end[2] / 1024.0, 1),
+        },
+    }
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    setup_logging(level="INFO" if args.verbose else "WARNING")
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        report = run(args)
+    if quiet:
+        quiet.close()
+
+    out = args.out
+    if out is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        out = os.path.join(RESULTS_DIR, f"ingest_e2e-{stamp}.json")
+    with open(out, "w") as fh:
+        json.dump(report, fh, indent=2)
+    print(json.dumps(report["results"], indent=2))
+    print(f"[Bench] Resultados en {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+# Micro-benchmarks de los caminos calientes de TelemetryDB (CPU puro, Mongo falso)
+"""
+Mide el costo por mensaje de la normalizacion / insercion y el costo por calculo de
+metricas (post-proceso de los grupos por turbina) a 10, 1k y 100k turbinas.
+Mongo se reemplaza por un sumidero en memoria: solo se mide Python.
+
+Cada caso reporta ns/op (mediana y minimo de --repeat corridas) y se compara contra
+benchmarks/baselines/micro_telemetrydb.json; una regresion mayor a --tolerance hace
+que el proceso termine con codigo 1 (usable en CI).
+
+Uso:
+    python -m benchmarks.micro_telemetrydb                    # corre y compara
+    python -m benchmarks.micro_telemetrydb -k get_metrics     # solo casos que contienen el texto
+    python -m benchmarks.micro_telemetrydb --update-baseline  # regraba la linea base
+"""
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from StatNode.Alerts.AlertEngine import AlertEngine
+from StatNode.DB.TelemetryDB import TelemetryDB
+from benchmarks.fakes import MemoryMongoClient
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "micro_telemetrydb.json")
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.25     # +25% sobre la linea base = regresion
+PER_MESSAGE_OPS = 20_000     # mensajes por corrida en los casos por mensaje
+MIN_RUN_S = 0.2              # duracion minima de una corrida (casos auto-escalados)
+METRICS_TURBINES = (10, 1_000, 100_000)
+WINDOW_MINUTES = 3
+ROTOR_RADIUS_M = 40.0
+
+
+class _StaticAggregate:
+    def __init__(self, groups):
+        self.groups = groups
+
+    def aggregate(self, pipeline):
+        return iter(self.groups)
+
+
+class _GroupsMongo(MemoryMongoClient):
+    """Responde cualquier aggregate con grupos por turbina precalculados."""
+    def __init__(self, groups):
+        super().__init__()
+        self.groups = groups
+
+    def get_collection(self, collection_name: str):
+        return _StaticAggregate(self.groups)
+
+
+def _raw_payload(rng: random.Random, turbine_id: int) -> dict:
+    # como lo publica WindTurbine en formato 'json' (string local + nombres)
+    return {
+        "farm_id": 1, "farm_name": "Farm-001", "turbine_id": turbine_id, "turbine_name": f"T-{turbine_id:03d}",
+        "timestamp": "2026-01-01 12:00:00",
+        "wind_speed_mps": round(rng.uniform(0, 25), 2), "wind_direction_deg": rng.randint(0, 359),
+        "rotor_speed_rpm": round(rng.uniform(10, 30), 2), "blade_pitch_angle_deg": round(rng.uniform(0, 30), 2),
+        "yaw_position_deg": round(rng.uniform(0, 360), 2), "vibrations_mms": round(rng.uniform(0.1, 5), 2),
+        "gear_temperature_c": round(rng.uniform(40, 70), 1), "bearing_temperature_c": round(rng.uniform(35, 65), 1),
+        "output_voltage_v": 400.0, "generated_current_a": round(rng.uniform(0, 3000), 2),
+        "active_power_kw": round(rng.uniform(0, 2500), 2), "reactive_power_kvar": round(rng.uniform(0, 750), 2),
+        "operational_state": "operational", "capacity_mw": 2.5,
+    }
+
+
+def _groups(n: int, rng: random.Random) -> list:
+    states = ("operational", "maintenance", "standby", "fault", "stopped")
+    out = []
+    for tid in range(1, n + 1):
+        count = 18
+        avg_power = rng.uniform(0, 2500)
+        out.append({
+            "_id": tid, "avg_wind": rng.uniform(3, 25), "avg_power_kw": avg_power,
+            "sum_power_kw": avg_power * count, "sample_count": count,
+            "active_samples": rng.randint(0, count), "last_state": rng.choice(states), "avg_capacity_mw": 2.5,
+        })
+    return out
+
+
+def _db(mongo=None, **kwargs) -> TelemetryDB:
+    return TelemetryDB(mongo_client=mongo or MemoryMongoClient(), ensure_indexes=False, **kwargs)
+
+
+# --- Casos ---
+# Cada caso devuelve (fn, entradas): se mide fn(entrada) para cada elemento. Los casos
+# que mutan su entrada reciben copias frescas por corrida (la copia no entra en la medicion).
+
+def case_ensure_timestamp_local_str(rng):
+    payloads = [_raw_payload(rng, 1) for _ in range(PER_MESSAGE_OPS)]
+    return _db()._ensure_timestamp, payloads
+
+
+def case_ensure_timestamp_epoch_ms(rng):
+    now_ms = int(time.time() * 1000)
+    return _db()._ensure_timestamp, [{"timestamp": now_ms + i} for i in range(PER_MESSAGE_OPS)]
+
+
+def case_ensure_timestamp_aware_datetime(rng):
+    now = datetime.now(timezone.utc)
+    return _db()._ensure_timestamp, [{"timestamp": now} for _ in range(PER_MESSAGE_OPS)]
+
+
+def case_ensure_numeric_fields_str_values(rng):
+    payloads = []
+    for _ in range(PER_MESSAGE_OPS):
+        p = _raw_payload(rng, 1)
+        for k in ("wind_speed_mps", "rotor_speed_rpm", "output_voltage_v", "generated_current_a"):
+            p[k] = str(p[k])
+        del p["active_power_kw"]  # fuerza el calculo V * I
+        payloads.append(p)
+    return _db()._ensure_numeric_fields, payloads
+
+
+def case_normalize_telemetry(rng):
+    return _db()._normalize_telemetry, \
+        [_raw_payload(rng, i % 50 + 1) for i in range(PER_MESSAGE_OPS)]
+
+
+def case_insert_telemetry_single(rng):
+    db = _db()
+    return db.insert_telemetry, [_raw_payload(rng, i % 50 + 1) for i in range(PER_MESSAGE_OPS)]
+
+
+def case_insert_telemetry_batch_buffer(rng):
+    # batch_size mayor que la corrida: mide normalizar + encolar (sin flush)
+    db = _db(batch_size=10 * PER_MESSAGE_OPS, flush_interval=3600)
+    return db.insert_telemetry, [_raw_payload(rng, i % 50 + 1) for i in range(PER_MESSAGE_OPS)]
+
+
+def case_compute_energy_kwh(rng):
+    return (lambda args: TelemetryDB._compute_energy_kwh(*args)), \
+        [(rng.uniform(0, 45000), 18, WINDOW_MINUTES) for _ in range(PER_MESSAGE_OPS)]
+
+
+def case_compute_cp(rng):
+    return (lambda args: TelemetryDB._compute_cp(*args)), \
+        [(rng.uniform(0, 2500), rng.uniform(3, 25), ROTOR_RADIUS_M) for _ in range(PER_MESSAGE_OPS)]
+
+
+def case_alerts_evaluate(rng):
+    # muestras ya normalizadas (salida de insert_telemetry), 50 turbinas a 1 muestra/s
+    db = _db()
+    start = datetime.now(timezone.utc).timestamp()
+    docs = []
+    for i in range(PER_MESSAGE_OPS):
+        doc = db._normalize_telemetry(_raw_payload(rng, i % 50 + 1))
+        doc["timestamp"] = datetime.fromtimestamp(start + i // 50, tz=timezone.utc)
+        docs.append(doc)
+    engine = AlertEngine(persist=False)
+    return engine.evaluate, docs
+
+
+def _metrics_case(method: str, n: int):
+    def case(rng):
+        db = _db(_GroupsMongo(_groups(n, rng)))
+        fn = getattr(db, method)
+        return (lambda _: fn(farm_id=1, minutes=WINDOW_MINUTES, rotor_radius_m=ROTOR_RADIUS_M)), None
+    return case
+
+
+CASES = {
+    "ensure_timestamp/local_str": case_ensure_timestamp_local_str,
+    "ensure_timestamp/epoch_ms": case_ensure_timestamp_epoch_ms,
+    "ensure_timestamp/aware_datetime": case_ensure_timestamp_aware_datetime,
+    "ensure_numeric_fields/str_values": case_ensure_numeric_fields_str_values,
+    "normalize_telemetry": case_normalize_telemetry,
+    "insert_telemetry/single": case_insert_telemetry_single,
+    "insert_telemetry/batch_buffer": case_insert_telemetry_batch_buffer,
+    "compute_energy_kwh": case_compute_energy_kwh,
+    "compute_cp": case_compute_cp,
+    "alerts/evaluate": case_alerts_evaluate,
+}
+for _n in METRICS_TURBINES:
+    CASES[f"get_metrics/{_n}_turbines"] = _metrics_case("get_metrics", _n)
+    CASES[f"get_metrics_per_turbine/{_n}_turbines"] = _metrics_case("get_metrics_per_turbine", _n)
+
+
+def _run_once(fn, items) -> float:
+    """Segundos por op de una corrida."""
+    if items is None:
+        # sin entrada por op: auto-escalar hasta MIN_RUN_S
+        loops = 1
+        while True:
+            start = time.perf_counter()
+            for _ in range(loops):
+                fn(None)
+            elapsed = time.perf_counter() - start
+            if elapsed >= MIN_RUN_S:
+                return elapsed / loops
+            loops *= 2 if elapsed * 2 < MIN_RUN_S else 1 + int(MIN_RUN_S / max(elapsed, 1e-9))
+
+    batch = copy.deepcopy(items)  # entradas frescas (varios casos las mutan)
+    start = time.perf_counter()
+    for item in batch:
+        fn(item)
+    return (time.perf_counter() - start) / len(batch)
+
+
+def run_cases(selected, repeat: int, seed: int = 1234) -> dict:
+    results = {}
+    for name in selected:
+        rng = random.Random(seed)
+        fn, items = CASES[name](rng)
+        fn(copy.deepcopy(items[0]) if items else None)  # warmup
+        samples = [_run_once(fn, items) for _ in range(repeat)]
+        results[name] = {
+            "ns_per_op": round(statistics.median(samples) * 1e9, 1),
+            "min_ns_per_op": round(min(samples) * 1e9, 1),
+            "repeat": repeat,
+        }
+    return results
+
+
+def _environment() -> dict:
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(),
+            "machine": platform.machine(), "system": platform.system(), "processor": platform.processor()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Devuelve filas (nombre, actual, base, ratio, regresion)."""
+    rows = []
+    for name, res in results.items():
+        base = baseline.get("cases", {}).get(name, {}).get("ns_per_op")
+        ratio = res["ns_per_op"] / base if base else None
+        rows.append((name, res["ns_per_op"], base, ratio, ratio is not None and ratio > 1.0 + tolerance))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de TelemetryDB")
+    parser.add_argument("-k", "--filter", default=None, help="solo casos cuyo nombre contiene el texto")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--json", default=None, help="escribe los resultados en este archivo")
+    args = parser.parse_args(argv)
+
+    selected = [n for n in CASES if not args.filter or args.filter in n]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = run_cases(selected, args.repeat)
+
+    report = {"benchmark": "micro_telemetrydb", "environment": _environment(), "cases": results}
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+    if args.update_baseline:
+        baseline = {"cases": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fh:
+                baseline = json.load(fh)
+        baseline["environment"] = report["environment"]
+        baseline.setdefault("cases", {}).update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+        print(f"[Bench] Linea base actualizada: {args.baseline}")
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)
+
+    regressions = 0
+    print(f"{'caso':45} {'ns/op':>14} {'base':>14} {'ratio':>7}")
+    for name, current, base, ratio, regressed in compare(results, baseline, args.tolerance):
+        regressions += regressed
+        print(f"{name:45} {current:14.1f} {base if base is not None else '-':>14} "
+              f"{'' if ratio is None else f'{ratio:.2f}':>7}{'  REGRESION' if regressed else ''}")
+    if regressions:
+        print(f"[Bench] {regressions} caso(s) mas lentos que la linea base (+{args.tolerance:.0%})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+# Politica 'spill' de BoundedWorkQueue: orden, drenaje en stop() y recuperacion del archivo
+import threading
+
+import pytest
+
+from Shared.BoundedWorkQueue import BoundedWorkQueue, _SpillFile
+
+
+class _Recorder:
+    """Handler que registra lo procesado; gate permite frenar a los workers para forzar el derrame."""
+    def __init__(self, gate: threading.Event = None):
+        self.items = []
+        self.gate = gate
+        self._lock = threading.Lock()
+
+    def __call__(self, topic, payload, content_type=None):
+        if self.gate is not None:
+            self.gate.wait()
+        with self._lock:
+            self.items.append((topic, payload, content_type))
+
+
+def _spill_queue(tmp_path, handler, **kwargs):
+    return BoundedWorkQueue(lambda: handler, maxsize=4, workers=2, policy="spill",
+                            spill_path=str(tmp_path / "spill.bin"), partition_key=lambda item: item[0], **kwargs)
+
+
+def _items(n, turbines=3):
+    return [(f"farms/1/turbines/{i % turbines}/raw", f"{i}".encode(), "application/json") for i in range(n)]
+
+
+def test_spill_keeps_order_per_partition(tmp_path):
+    gate = threading.Event()
+    handler = _Recorder(gate)
+    wq = _spill_queue(tmp_path, handler)
+    wq.start()
+    items = _items(60)
+    for item in items:
+        assert wq.put(item)
+    assert wq.spilled_total > 0
+    gate.set()
+    wq.stop()
+
+    assert sorted(handler.items) == sorted(items)
+    for topic in {t for t, _, _ in items}:
+        assert [p for t, p, _ in handler.items if t == topic] == [p for t, p, _ in items if t == topic]
+
+
+def test_stop_processes_spilled_items(tmp_path):
+    gate = threading.Event()
+    handler = _Recorder(gate)
+    wq = _spill_queue(tmp_path, handler)
+    wq.start()
+    items = _items(40)
+    for item in items:
+        wq.put(item)
+    threading.Timer(0.2, gate.set).start()
+    wq.stop()  # con items aun en disco
+
+    assert len(handler.items) == len(items)
+    assert not (tmp_path / "spill.bin").exists()
+
+
+def test_spill_file_recovered_on_reopen(tmp_path):
+    path = str(tmp_path / "spill.bin")
+    spill = _SpillFile(path, max_bytes=1 << 20)
+    items = _items(5)
+    for item in items:
+        spill.append(item)
+    assert spill.peek() == items[0]
+    spill.consume()
+    spill.close()  # quedan 4 pendientes: el archivo no se borra
+
+    handler = _Recorder()
+    wq = BoundedWorkQueue(lambda: handler, maxsize=4, workers=1, policy="spill", spill_path=path)
+    wq.start()
+    wq.stop()
+    assert handler.items == items[1:]
+
+
+def test_spill_file_discards_torn_tail(tmp_path):
+    path = str(tmp_path / "spill.bin")
+    spill = _SpillFile(path, max_bytes=1 << 20)
+    items = _items(3)
+    for item in items:
+        spill.append(item)
+    spill.close()
+    with open(path, "r+b") as fh:
+        fh.truncate(fh.seek(0, 2) - 3)  # corte a mitad del ultimo registro
+
+    spill = _SpillFile(path, max_bytes=1 << 20)
+    assert spill.pending == 2
+    spill.append(items[2])
+    got = []
+    while spill.pending:
+        got.append(spill.peek())
+        spill.consume()
+    assert got == items
+    spill.close()
+
+
+def test_spill_rejects_items_with_callbacks(tmp_path):
+    gate = threading.Event()
+    wq = BoundedWorkQueue(lambda: _Recorder(gate), maxsize=1, workers=1, policy="spill",
+                          spill_path=str(tmp_path / "spill.bin"))
+    wq.start()
+    wq.put(("t", b"0", None))
+    with pytest.raises(ValueError):
+        for _ in range(3):
+            wq.put(("t", b"1", None, lambda: None))
+    gate.set()
+    wq.stop()